@@ -1,3 +1,82 @@
+"""
+Admin pour le tuteur IA.
+"""
 from django.contrib import admin
+from .models import ExerciseStockItem, ExerciseStockDemand, Job, LLMCallRecord, LLMUsageDaily
 
-# Register your models here.
+
+@admin.register(ExerciseStockItem)
+class ExerciseStockItemAdmin(admin.ModelAdmin):
+    """Admin pour le stock d'exercices pré-générés."""
+
+    list_display = [
+        'topic', 'subject', 'level', 'difficulty',
+        'exercise_type', 'language', 'created_at'
+    ]
+    list_filter = ['subject', 'level', 'difficulty', 'exercise_type', 'language']
+    search_fields = ['topic']
+
+
+@admin.register(ExerciseStockDemand)
+class ExerciseStockDemandAdmin(admin.ModelAdmin):
+    """Admin pour les demandes de génération."""
+
+    list_display = [
+        'topic', 'subject', 'level', 'difficulty', 'exercise_type',
+        'language', 'requests', 'stock_hits', 'last_requested_at'
+    ]
+    list_filter = ['subject', 'level', 'difficulty', 'exercise_type', 'language']
+    search_fields = ['topic']
+
+
+@admin.register(LLMCallRecord)
+class LLMCallRecordAdmin(admin.ModelAdmin):
+    """Admin (lecture seule) du journal des appels LLM."""
+
+    list_display = [
+        'created_at', 'user', 'endpoint', 'model', 'route', 'prompt_tokens',
+        'completion_tokens', 'latency_ms', 'success', 'error'
+    ]
+    list_filter = ['endpoint', 'model', 'route', 'success']
+    search_fields = ['user__username']
+    date_hierarchy = 'created_at'
+    list_select_related = ['user']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LLMUsageDaily)
+class LLMUsageDailyAdmin(admin.ModelAdmin):
+    """Admin des consommations LLM journalières : qui et quoi coûte le plus."""
+
+    list_display = [
+        'date', 'user', 'endpoint', 'model', 'calls', 'errors',
+        'total_tokens', 'avg_latency_ms', 'p95_latency_ms', 'cost'
+    ]
+    list_filter = ['date', 'endpoint', 'model']
+    search_fields = ['user__username']
+    date_hierarchy = 'date'
+    list_select_related = ['user']
+
+    def total_tokens(self, obj):
+        return obj.total_tokens
+    total_tokens.short_description = 'Tokens'
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Admin des tâches de fond (générations IA en file d'attente)."""
+
+    list_display = ['id', 'kind', 'status', 'user', 'attempts', 'max_attempts', 'run_after', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    search_fields = ['user__username', 'error']
+    date_hierarchy = 'created_at'
+    list_select_related = ['user']
+    readonly_fields = ['locked_by', 'locked_at', 'created_at', 'finished_at']
@@ -0,0 +1,90 @@
+"""
+Minimal async counterpart of DRF's APIView for the LLM-bound endpoints.
+
+DRF views are synchronous, so a slow Groq call would hold a whole worker.
+These views run on the event loop under ASGI (uvicorn workers) and only hop
+to a thread for the blocking parts: DRF authentication/parsing and the ORM
+work that needs transactions or serializers.
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    return JsonResponse(
+        data,
+        status=status,
+        safe=False,
+        headers=headers,
+        json_dumps_params={'ensure_ascii': False}
+    )
+
+
+def _sse_event(event):
+    """Format a service stream event as a Server-Sent Event frame."""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def _sse_frames(events):
+    async for event in events:
+        yield _sse_event(event)
+
+
+def sse_response(events):
+    """Stream an async iterator of service events as text/event-stream."""
+    response = StreamingHttpResponse(_sse_frames(events), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Disable proxy buffering (nginx, Render) so chunks reach the client immediately
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """
+    Authenticate with the project's DRF authentication classes, expose the
+    parsed body as ``request.data`` and require an authenticated user.
+    """
+
+    require_authentication = True
+    require_staff = False
+
+    def _authenticate(self, request):
+        drf_request = Request(
+            request,
+            parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+            authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        )
+        # Both are lazy in DRF and may hit the database
+        user = drf_request.user
+        data = drf_request.data if request.method not in ('GET', 'HEAD', 'OPTIONS') else {}
+        return user, data
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user, data = await sync_to_async(self._authenticate)(request)
+        except exceptions.APIException as exc:
+            return json_response({'detail': exc.detail}, status=exc.status_code)
+
+        if self.require_authentication and not (user and user.is_authenticated):
+            return json_response(
+                {'detail': exceptions.NotAuthenticated.default_detail},
+                status=status.HTTP_401_UNAUTHORIZED,
+                headers={'WWW-Authenticate': 'Token'}
+            )
+        if self.require_staff and not user.is_staff:
+            return json_response(
+                {'detail': exceptions.PermissionDenied.default_detail},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        request.user = user
+        request.data = data
+        return await super().dispatch(request, *args, **kwargs)
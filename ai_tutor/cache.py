@@ -0,0 +1,148 @@
+"""
+Response cache for the AI tutor chat.
+
+Answers are keyed on a hash of the normalized conversation (whitespace, case
+and accents folded), the student level, the lesson passages the answer is
+grounded in and SYSTEM_PROMPT_VERSION, so
+identical short questions are served without a Groq round trip.
+Two backends are available: an in-process LRU ('memory') and the Django
+cache framework ('django', shared between workers).
+"""
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from .utils import fold_text
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry expiry."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def aget(self, key):
+        # Pure in-memory work: safe to run directly on the event loop
+        return self.get(key)
+
+    async def aset(self, key, value, ttl):
+        self.set(key, value, ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """Delegate to a Django cache alias; size is bounded by its MAX_ENTRIES option."""
+
+    key_prefix = 'ai_chat:'
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(self.key_prefix + key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(self.key_prefix + key, value, ttl)
+
+    async def aget(self, key):
+        return await self.cache.aget(self.key_prefix + key)
+
+    async def aset(self, key, value, ttl):
+        await self.cache.aset(self.key_prefix + key, value, ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ChatResponseCache:
+    """Cache of tutor answers for short conversations."""
+
+    def __init__(self, backend, ttl, max_turns):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_turns = max_turns
+
+    @classmethod
+    def from_settings(cls):
+        if settings.AI_CHAT_CACHE_BACKEND == 'django':
+            backend = DjangoCacheBackend(settings.AI_CHAT_CACHE_ALIAS)
+        else:
+            backend = MemoryCacheBackend(settings.AI_CHAT_CACHE_MAX_ENTRIES)
+        return cls(backend, settings.AI_CHAT_CACHE_TTL, settings.AI_CHAT_CACHE_MAX_TURNS)
+
+    def is_cacheable(self, messages):
+        """Only short conversations ending with a student question are worth caching."""
+        if not messages or messages[-1].get('role') != 'user':
+            return False
+        user_turns = sum(1 for m in messages if m.get('role') == 'user')
+        return user_turns <= self.max_turns
+
+    def make_key(self, messages, prompt_version, level=None, context=None):
+        normalized = [
+            [m.get('role', ''), fold_text(m.get('content'))]
+            for m in messages
+        ]
+        key_parts = [prompt_version, level or '', normalized]
+        if context:
+            key_parts.append(context)
+        payload = json.dumps(key_parts, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, content):
+        self.backend.set(key, content, self.ttl)
+
+    async def aget(self, key):
+        return await self.backend.aget(key)
+
+    async def aset(self, key, content):
+        await self.backend.aset(key, content, self.ttl)
+
+
+_chat_cache = None
+_chat_cache_lock = threading.Lock()
+
+
+def get_chat_cache():
+    """Return the process-wide chat cache, or None when disabled."""
+    global _chat_cache
+    if not settings.AI_CHAT_CACHE_ENABLED:
+        return None
+    if _chat_cache is None:
+        with _chat_cache_lock:
+            if _chat_cache is None:
+                _chat_cache = ChatResponseCache.from_settings()
+    return _chat_cache
@@ -0,0 +1,204 @@
+"""
+Process-wide pooled Groq clients.
+
+The OpenAI clients (and their httpx connection pools) are created lazily on
+first use and shared by every AIService of the worker process, so LLM calls
+reuse keep-alive connections instead of paying a new TLS handshake each time.
+The sync client serves management commands and scripts; the async client
+serves the async views and is bound to the event loop that created it, and
+closed with it (a WSGI server runs each async view in a new loop).
+Clients are dropped in forked children (gunicorn workers) and rebuilt there.
+"""
+import os
+import asyncio
+import logging
+import weakref
+import threading
+import httpx
+from openai import AsyncOpenAI, OpenAI
+from django.conf import settings
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+# Event loop -> (AsyncOpenAI client, task closing it when the loop shuts down)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class _ConnectionTrace:
+    """httpcore trace hook flagging requests that had to open a new connection."""
+
+    def __init__(self):
+        self.new_connection = False
+
+    def __call__(self, event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            self.new_connection = True
+
+
+class _AsyncConnectionTrace(_ConnectionTrace):
+    """Same hook for httpx.AsyncClient, where httpcore awaits the callback."""
+
+    async def __call__(self, event_name, info):
+        super().__call__(event_name, info)
+
+
+def _on_request(request):
+    request.extensions['trace'] = _ConnectionTrace()
+
+
+def _on_response(response):
+    trace = response.request.extensions.get('trace')
+    metrics.incr('http.requests')
+    if isinstance(trace, _ConnectionTrace) and trace.new_connection:
+        metrics.incr('http.connections.new')
+    else:
+        metrics.incr('http.connections.reused')
+
+
+async def _aon_request(request):
+    request.extensions['trace'] = _AsyncConnectionTrace()
+
+
+async def _aon_response(response):
+    _on_response(response)
+
+
+def _pool_options():
+    return {
+        'limits': httpx.Limits(
+            max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.AI_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': httpx.Timeout(
+            settings.AI_HTTP_READ_TIMEOUT,
+            connect=settings.AI_HTTP_CONNECT_TIMEOUT,
+        ),
+    }
+
+
+def _build_http_client():
+    return httpx.Client(
+        event_hooks={'request': [_on_request], 'response': [_on_response]},
+        **_pool_options()
+    )
+
+
+def _build_async_http_client():
+    return httpx.AsyncClient(
+        event_hooks={'request': [_aon_request], 'response': [_aon_response]},
+        **_pool_options()
+    )
+
+
+def get_client():
+    """Return the shared OpenAI client of this process, or None without API key."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _lock:
+        if _client is not None and _client_pid == pid:
+            return _client
+
+        api_key = os.getenv('GROQ_API_KEY')
+        if not api_key:
+            logger.warning("GROQ_API_KEY not found in environment variables.")
+            return None
+
+        # Masked logging for security
+        masked_key = f"{api_key[:6]}...{api_key[-4:]}" if len(api_key) > 10 else "***"
+        logger.info(f"GROQ_API_KEY found: {masked_key}")
+        try:
+            _client = OpenAI(
+                base_url=settings.AI_BASE_URL,
+                api_key=api_key,
+                http_client=_build_http_client(),
+                # Retries are handled by AIService (jitter, deadline, circuit breaker)
+                max_retries=0,
+            )
+            _client_pid = pid
+            metrics.incr('http.clients.created')
+            logger.info(f"Shared Groq client created for process {pid}.")
+        except Exception as e:
+            logger.error(f"Failed to initialize OpenAI client: {str(e)}")
+            return None
+        return _client
+
+
+async def _close_with_loop(loop, client):
+    """
+    Idle until the event loop shuts down, then close the client's pool.
+    ``asyncio.run`` (and so ``async_to_sync`` under WSGI) cancels the pending
+    tasks before closing its loop: the pool of a per-request loop is closed
+    with it instead of leaking its sockets.
+    """
+    try:
+        await asyncio.Future()
+    except asyncio.CancelledError:
+        with _lock:
+            if _async_clients.get(loop, (None,))[0] is client:
+                del _async_clients[loop]
+        await client.close()
+        metrics.incr('http.async_clients.closed')
+        raise
+
+
+def get_async_client():
+    """
+    Return the shared AsyncOpenAI client for the running event loop, or None
+    without API key. Must be called from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is not None:
+        return entry[0]
+
+    api_key = os.getenv('GROQ_API_KEY')
+    if not api_key:
+        logger.warning("GROQ_API_KEY not found in environment variables.")
+        return None
+    try:
+        # One pool per event loop: connections cannot outlive the loop that opened them
+        client = AsyncOpenAI(
+            base_url=settings.AI_BASE_URL,
+            api_key=api_key,
+            http_client=_build_async_http_client(),
+            max_retries=0,
+        )
+    except Exception as e:
+        logger.error(f"Failed to initialize AsyncOpenAI client: {str(e)}")
+        return None
+    with _lock:
+        # Loops closed without cancelling their tasks: nothing left to await, just forget them
+        for closed in [other for other in _async_clients if other.is_closed()]:
+            del _async_clients[closed]
+        # The task keeps the entry (and the client) alive as long as the loop runs
+        _async_clients[loop] = (client, loop.create_task(_close_with_loop(loop, client)))
+    metrics.incr('http.async_clients.created')
+    logger.info(f"Shared async Groq client created for process {os.getpid()}.")
+    return client
+
+
+def reset_client():
+    """Forget the shared clients (used after fork and in tests)."""
+    global _client, _client_pid
+    _client = None
+    _client_pid = None
+    _async_clients.clear()
+
+
+def _after_fork_in_child():
+    global _lock
+    _lock = threading.Lock()
+    reset_client()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Never share pooled sockets between a gunicorn master and its workers
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,157 @@
+"""
+Server-side history management for the tutor chat.
+
+The client sends the whole conversation on every turn. Before calling Groq
+the history is fitted into a token budget: system messages and the last
+turns are kept verbatim, older turns are folded into a rolling summary that
+is cached, so each old turn is summarized only once.
+"""
+import re
+import json
+import math
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from .utils import fold_text
+
+# Per-message overhead of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Llama-style BPE vocabularies average roughly 4 characters per token on French text
+CHARS_PER_TOKEN = 4
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+SUMMARY_PREFIX = "Résumé de la conversation précédente avec l'élève :\n"
+
+
+def estimate_tokens(text):
+    """Approximate the token count of a text without a real tokenizer."""
+    if not text:
+        return 0
+    return sum(math.ceil(len(piece) / CHARS_PER_TOKEN) for piece in _PIECE_RE.findall(str(text)))
+
+
+def message_tokens(message):
+    return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get('content'))
+
+
+def count_tokens(messages):
+    return sum(message_tokens(m) for m in messages)
+
+
+def split_turns(messages):
+    """Group messages into turns, each starting with a user message."""
+    turns = []
+    for message in messages:
+        if message.get('role') == 'user' or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def _history_key(messages):
+    normalized = [[m.get('role', ''), fold_text(m.get('content'))] for m in messages]
+    raw = json.dumps(normalized, ensure_ascii=False)
+    return 'ai_summary:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class RollingSummarizer:
+    """
+    Summarize folded turns, reusing the cached summary of the longest
+    already-summarized prefix so only the newly folded turns are sent.
+    ``summarize(previous_summary, messages)`` does the actual work.
+    """
+
+    # How many shorter prefixes to probe for a cached summary
+    max_prefix_lookups = 12
+
+    def __init__(self, summarize):
+        self.summarize = summarize
+
+    @property
+    def cache(self):
+        return caches[settings.AI_CHAT_SUMMARY_CACHE_ALIAS]
+
+    def __call__(self, messages):
+        cache = self.cache
+        key = _history_key(messages)
+        summary = cache.get(key)
+        if summary is not None:
+            return summary
+
+        previous_summary, start = '', 0
+        for end in range(len(messages) - 1, max(0, len(messages) - self.max_prefix_lookups) - 1, -1):
+            if end == 0:
+                break
+            cached = cache.get(_history_key(messages[:end]))
+            if cached is not None:
+                previous_summary, start = cached, end
+                break
+
+        summary = self.summarize(previous_summary, messages[start:])
+        cache.set(key, summary, settings.AI_CHAT_SUMMARY_TTL)
+        return summary
+
+
+def extractive_summary(previous_summary, messages, max_chars=1200):
+    """Fallback summary without LLM: the beginning of each folded message."""
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        role = 'Élève' if message.get('role') == 'user' else 'Tuteur'
+        content = ' '.join(str(message.get('content', '')).split())
+        lines.append(f"{role} : {content[:160]}")
+    return '\n'.join(lines)[-max_chars:]
+
+
+def window_messages(messages, budget, keep_turns, summarizer=None):
+    """
+    Fit ``messages`` into ``budget`` tokens.
+    Returns (messages_to_send, info) where info reports original and sent
+    token estimates, tokens saved and how many messages were summarized.
+    """
+    original_tokens = count_tokens(messages)
+    info = {
+        'original_tokens': original_tokens,
+        'prompt_tokens': original_tokens,
+        'tokens_saved': 0,
+        'summarized_messages': 0,
+    }
+    if original_tokens <= budget:
+        return messages, info
+
+    head = []
+    for message in messages:
+        if message.get('role') != 'system':
+            break
+        head.append(message)
+    turns = split_turns(messages[len(head):])
+
+    # Keep the last turns that fit (always at least the current question)
+    kept = []
+    available = budget - count_tokens(head)
+    for turn in reversed(turns[-keep_turns:] if keep_turns else turns[-1:]):
+        turn_tokens = count_tokens(turn)
+        if kept and turn_tokens > available:
+            break
+        kept.insert(0, turn)
+        available -= turn_tokens
+    folded = [m for turn in turns[:len(turns) - len(kept)] for m in turn]
+    window = head + [m for turn in kept for m in turn]
+
+    if folded and summarizer is not None:
+        summary_budget = available - MESSAGE_OVERHEAD_TOKENS - estimate_tokens(SUMMARY_PREFIX)
+        if summary_budget > 0:
+            summary = summarizer(folded)
+            while summary and estimate_tokens(summary) > summary_budget:
+                # Keep the most recent part of the summary
+                summary = summary[len(summary) // 5 + 1:]
+            window.insert(len(head), {"role": "system", "content": SUMMARY_PREFIX + summary})
+
+    prompt_tokens = count_tokens(window)
+    info.update({
+        'prompt_tokens': prompt_tokens,
+        'tokens_saved': max(0, original_tokens - prompt_tokens),
+        'summarized_messages': len(folded),
+    })
+    return window, info
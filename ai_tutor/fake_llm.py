@@ -0,0 +1,281 @@
+"""
+OpenAI-compatible stand-in for the Groq API, for benchmarks and offline work.
+
+    python manage.py fake_llm_server --port 8765 --latency 0.4 --tokens-per-second 250
+    AI_BASE_URL=http://127.0.0.1:8765/v1 GROQ_API_KEY=fake python manage.py runserver
+
+Exercise generations (requests with a ``response_format``) replay recorded
+exercise JSON of the requested type, chat requests replay recorded answers.
+Answers are delayed by a fixed latency (time to first token) and then sent
+at a fixed token rate, streamed as Server-Sent Events when asked. With
+``record_url`` the requests are forwarded to the real API and its answers
+are added to the fixtures, so later runs replay them without network.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import httpx
+from .conversation import count_tokens, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES = Path(__file__).resolve().parent / 'llm_fixtures' / 'recorded.json'
+
+# Line of the exercise prompt carrying the exercise type (see AIService._exercise_params)
+_EXERCISE_TYPE_RE = re.compile(r"^Type: (\w+)\.$", re.MULTILINE)
+# First line of a batch (worksheet) prompt
+_EXERCISE_COUNT_RE = re.compile(r"^Génère (\d+) exercices", re.MULTILINE)
+# Streaming pieces: a word with its trailing whitespace
+_PIECE_RE = re.compile(r"\S+\s*|\s+")
+
+FILLER_SENTENCE = (
+    "Très bonne question ! Reprenons la notion étape par étape avec un exemple simple, "
+    "puis essaie de l'appliquer toi-même. "
+)
+
+
+class FixtureStore:
+    """Recorded answers, replayed round-robin per kind and exercise type."""
+
+    def __init__(self, path=DEFAULT_FIXTURES):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._turns = defaultdict(int)
+        self.entries = json.loads(self.path.read_text(encoding='utf-8')) if self.path.exists() else []
+
+    def pick(self, kind, exercise_type=None):
+        candidates = [e for e in self.entries if e['kind'] == kind]
+        if exercise_type:
+            candidates = [e for e in candidates if e.get('exercise_type') == exercise_type] or candidates
+        if not candidates:
+            return None
+        with self._lock:
+            turn = self._turns[(kind, exercise_type)]
+            self._turns[(kind, exercise_type)] += 1
+        return candidates[turn % len(candidates)]['content']
+
+    def add(self, kind, content, exercise_type=None):
+        entry = {'kind': kind, 'content': content}
+        if exercise_type:
+            entry['exercise_type'] = exercise_type
+        with self._lock:
+            self.entries.append(entry)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.entries, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
+
+
+def _fallback_exercise(exercise_type):
+    """Valid exercise used when no fixture of this type was recorded."""
+    if exercise_type == 'classic':
+        content = {"text": "Calcule les expressions suivantes.", "questions": ["$3 + 4$", "$6 \\times 7$"]}
+        correct_answers = ["$3 + 4 = 7$", "$6 \\times 7 = 42$"]
+    else:
+        content = {"questions": [
+            {"question": "Combien font $2 + 2$ ?", "options": ["3", "4", "5", "6"], "correct_option": 1}
+        ]}
+        correct_answers = [1]
+    return json.dumps({
+        "title": "Exercice simulé",
+        "description": "Exercice renvoyé par le serveur LLM factice.",
+        "type": exercise_type or 'qcm',
+        "difficulty": "medium",
+        "content": content,
+        "correct_answers": correct_answers,
+        "explanation": "Réponse de démonstration.",
+        "hints": ["Relis bien l'énoncé."],
+        "points": 10,
+    }, ensure_ascii=False)
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures=None, latency=0.5, latency_jitter=0.0, tokens_per_second=250.0,
+                 chat_tokens=150, error_rate=0.0, error_status=500, record_url=None):
+        super().__init__(address, FakeLLMHandler)
+        self.fixtures = fixtures if fixtures is not None else FixtureStore()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.chat_tokens = chat_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.record_url = record_url.rstrip('/') if record_url else None
+        self.upstream = httpx.Client(timeout=120) if record_url else None
+
+    def first_token_delay(self):
+        jitter = random.uniform(-self.latency_jitter, self.latency_jitter) if self.latency_jitter else 0
+        return max(0.0, self.latency + jitter)
+
+    def token_delay(self, tokens):
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug(f"Fake LLM: {format % args}")
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            models = ['llama-3.3-70b-versatile', 'llama-3.1-8b-instant']
+            self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model"} for m in models]})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body"}})
+            return
+
+        server = self.server
+        if server.error_rate and random.random() < server.error_rate:
+            self._send_json(server.error_status, {"error": {"message": "Simulated failure"}}, {'Retry-After': '1'})
+            return
+
+        is_exercise = bool(body.get('response_format'))
+        kind = 'exercise' if is_exercise else 'chat'
+        prompt = '\n'.join(str(m.get('content', '')) for m in body.get('messages', []))
+        match = _EXERCISE_TYPE_RE.search(prompt) if is_exercise else None
+        exercise_type = match.group(1) if match else None
+        match = _EXERCISE_COUNT_RE.search(prompt) if is_exercise else None
+        batch_size = int(match.group(1)) if match else None
+
+        if server.record_url:
+            content = self._forward(body)
+            if content is None:
+                return
+            self._record(kind, content, exercise_type, batch_size)
+            wait_first, rate_limited = 0.0, False
+        else:
+            if batch_size:
+                exercises = [json.loads(self._replay(kind, exercise_type)) for _ in range(batch_size)]
+                content = json.dumps({"exercises": exercises}, ensure_ascii=False)
+            else:
+                content = self._replay(kind, exercise_type)
+            wait_first, rate_limited = server.first_token_delay(), True
+
+        usage = {
+            "prompt_tokens": count_tokens(body.get('messages', [])),
+            "completion_tokens": estimate_tokens(content),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = body.get('model', 'fake')
+
+        time.sleep(wait_first)
+        if body.get('stream'):
+            include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+            self._send_stream(model, content, usage if include_usage else None, rate_limited)
+        else:
+            if rate_limited:
+                time.sleep(server.token_delay(usage["completion_tokens"]))
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    def _replay(self, kind, exercise_type):
+        content = self.server.fixtures.pick(kind, exercise_type)
+        if content is not None:
+            return content
+        if kind == 'exercise':
+            return _fallback_exercise(exercise_type)
+        repeats = max(1, self.server.chat_tokens // max(1, estimate_tokens(FILLER_SENTENCE)))
+        return (FILLER_SENTENCE * repeats).strip()
+
+    def _record(self, kind, content, exercise_type, batch_size):
+        if not batch_size:
+            self.server.fixtures.add(kind, content, exercise_type)
+            return
+        # Worksheets are stored exercise by exercise so both paths can replay them
+        try:
+            exercises = json.loads(content).get('exercises', [])
+        except (ValueError, AttributeError):
+            exercises = []
+        for exercise in exercises:
+            self.server.fixtures.add(kind, json.dumps(exercise, ensure_ascii=False), exercise_type)
+
+    def _forward(self, body):
+        """Send the request to the real API (non streamed) and return the answer text."""
+        upstream_body = {k: v for k, v in body.items() if k not in ('stream', 'stream_options')}
+        try:
+            response = self.server.upstream.post(
+                f"{self.server.record_url}/chat/completions",
+                json=upstream_body,
+                headers={'Authorization': self.headers.get('Authorization', '')}
+            )
+        except httpx.HTTPError as e:
+            self._send_json(502, {"error": {"message": f"Upstream unreachable: {e}"}})
+            return None
+        if response.status_code != 200:
+            self._send_json(response.status_code, response.json() if response.content else {})
+            return None
+        return response.json()['choices'][0]['message']['content']
+
+    def _send_json(self, status, data, headers=None):
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, model, content, usage, rate_limited):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(delta=None, finish_reason=None, with_usage=False):
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if with_usage else [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}],
+            }
+            if with_usage:
+                data["usage"] = usage
+            self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n")
+
+        chunk({"role": "assistant", "content": ""})
+        for piece in _PIECE_RE.findall(content):
+            if rate_limited:
+                time.sleep(self.server.token_delay(estimate_tokens(piece)))
+            chunk({"content": piece})
+        chunk(finish_reason="stop")
+        if usage:
+            chunk(with_usage=True)
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
@@ -0,0 +1,48 @@
+"""
+Helpers shared by every path that turns generated exercise JSON into an Exercise.
+"""
+from django.db import connection, transaction
+from django.db.models import Max
+from exercises.models import Exercise
+
+
+def build_exercise(exercise_data, subject, level, exercise_type, difficulty, creator=None):
+    """Return an unsaved Exercise built from generated JSON."""
+    return Exercise(
+        title=exercise_data.get('title', f"Exercice de {subject.name}"),
+        description=exercise_data.get('description', ''),
+        subject=subject,
+        level=level,
+        exercise_type=exercise_type,
+        difficulty=difficulty,
+        content=exercise_data.get('content', {}),
+        correct_answers=exercise_data.get('correct_answers', []),
+        explanation=exercise_data.get('explanation', ''),
+        hints=exercise_data.get('hints', []),
+        points=int(exercise_data.get('points', 10)),
+        creator=creator,
+        is_ai_generated=True
+    )
+
+
+def save_exercises(exercises):
+    """Insert built exercises with one bulk INSERT in a transaction; returns them with their primary keys."""
+    # bulk_create does not call Exercise.save()
+    for exercise in exercises:
+        exercise.refresh_derived_fields()
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            return Exercise.objects.bulk_create(exercises)
+        # MySQL does not return the new primary keys of a bulk insert: reselect the
+        # rows inserted above the previous highest key, in insertion order
+        last_pk = Exercise.objects.aggregate(last=Max('pk'))['last'] or 0
+        Exercise.objects.bulk_create(exercises)
+        inserted = {}
+        rows = Exercise.objects.filter(
+            pk__gt=last_pk, creator=exercises[0].creator, is_ai_generated=True
+        ).order_by('pk').values_list('pk', 'title', 'subject_id')
+        for pk, *key in rows:
+            inserted.setdefault(tuple(key), []).append(pk)
+        for exercise in exercises:
+            exercise.pk = inserted[(exercise.title, exercise.subject_id)].pop(0)
+    return exercises
@@ -0,0 +1,215 @@
+"""
+Durable job queue on the application database, for AI work too long to
+run inside a request.
+
+``enqueue`` stores a Job row; ``manage.py run_workers`` processes claim
+them one at a time. On PostgreSQL (and MySQL 8) the claim is a
+``SELECT ... FOR UPDATE SKIP LOCKED`` so workers never wait on each other;
+elsewhere (SQLite, older MySQL) a job is claimed with a conditional UPDATE
+on its status and the worker that updated the row wins.
+
+A failed job is retried with exponential backoff and jitter until
+max_attempts; ``RetryJob`` asks for a retry after a given delay (e.g. the
+Retry-After of a rate limit). A job still running after
+AI_JOB_LEASE_TIMEOUT seconds is considered lost with its worker and is put
+back in the queue (or failed when it has no attempt left).
+"""
+import os
+import random
+import socket
+import logging
+import datetime
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .metrics import metrics
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+class RetryJob(Exception):
+    """Raised by a handler to retry the job after ``delay`` seconds (counts as an attempt)."""
+
+    def __init__(self, message, delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+
+class JobFailed(Exception):
+    """Raised by a handler for an error that retrying will not fix."""
+
+
+def handler(kind):
+    """Register ``func(payload, job) -> result dict`` as the handler of a job kind."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload, user=None, max_attempts=None, delay=0):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job.objects.create(
+        kind=kind,
+        payload=payload,
+        user=user,
+        max_attempts=max_attempts or settings.AI_JOB_MAX_ATTEMPTS,
+        run_after=timezone.now() + datetime.timedelta(seconds=delay),
+    )
+    metrics.incr(f'jobs.{kind}.enqueued')
+    return job
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def backoff_delay(attempts):
+    """Seconds before retrying a job that failed ``attempts`` times (exponential, jittered)."""
+    cap = min(settings.AI_JOB_RETRY_MAX_DELAY, settings.AI_JOB_RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+    return random.uniform(cap / 2, cap)
+
+
+def claim_job(worker):
+    """Lock the next runnable job for ``worker`` and mark it running; None if the queue is empty."""
+    now = timezone.now()
+    runnable = Job.objects.filter(status=Job.PENDING, run_after__lte=now).order_by('run_after', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = runnable.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            job.status, job.locked_by, job.locked_at = Job.RUNNING, worker, now
+            job.attempts += 1
+            job.save(update_fields=['status', 'locked_by', 'locked_at', 'attempts'])
+            return job
+
+    # No SKIP LOCKED: several workers may see the same candidates, only one
+    # of them changes the status of each row
+    for job_id in runnable.values_list('id', flat=True)[:settings.AI_JOB_CLAIM_CANDIDATES]:
+        claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def requeue_stale_jobs():
+    """Put back in the queue the jobs whose worker died while running them."""
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING, locked_at__lt=now - datetime.timedelta(seconds=settings.AI_JOB_LEASE_TIMEOUT)
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, error="Worker perdu pendant l'exécution.", finished_at=now
+    )
+    count = stale.update(status=Job.PENDING, locked_by='', locked_at=None, run_after=now)
+    if count:
+        metrics.incr('jobs.requeued', count)
+        logger.warning(f"{count} stale job(s) put back in the queue")
+    return count
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome; returns the new status."""
+    func = HANDLERS.get(job.kind)
+    started = timezone.now()
+    try:
+        if func is None:
+            raise JobFailed(f"Unknown job kind: {job.kind}")
+        result = func(job.payload, job)
+    except Exception as e:
+        return _job_failed(job, e)
+
+    job.status, job.result, job.error = Job.SUCCEEDED, result, ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    metrics.incr(f'jobs.{job.kind}.succeeded')
+    metrics.observe(f'jobs.{job.kind}.run_ms', (job.finished_at - started).total_seconds() * 1000)
+    logger.info(f"Job {job.pk} ({job.kind}) succeeded after {job.attempts} attempt(s)")
+    return job.status
+
+
+def _job_failed(job, error):
+    retryable = not isinstance(error, JobFailed)
+    job.error = str(error)[:2000]
+    if retryable and job.attempts < job.max_attempts:
+        delay = error.delay if isinstance(error, RetryJob) and error.delay else backoff_delay(job.attempts)
+        job.status, job.locked_by, job.locked_at = Job.PENDING, '', None
+        job.run_after = timezone.now() + datetime.timedelta(seconds=delay)
+        job.save(update_fields=['status', 'error', 'locked_by', 'locked_at', 'run_after'])
+        metrics.incr(f'jobs.{job.kind}.retried')
+        logger.warning(f"Job {job.pk} ({job.kind}) attempt {job.attempts} failed, retry in {delay:.1f} s: {job.error}")
+    else:
+        job.status, job.finished_at = Job.FAILED, timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        metrics.incr(f'jobs.{job.kind}.failed')
+        logger.error(f"Job {job.pk} ({job.kind}) failed after {job.attempts} attempt(s): {job.error}")
+    return job.status
+
+
+def run_next_job(worker):
+    """Claim and run one job; returns its status, or None when nothing is runnable."""
+    job = claim_job(worker)
+    if job is None:
+        return None
+    return run_job(job)
+
+
+def _ai_result(result):
+    """Turn an AIService error result into the matching job exception."""
+    if "retry_after" in result:
+        raise RetryJob(result["error"], delay=result["retry_after"])
+    if "error" in result:
+        raise RetryJob(result["error"])
+
+
+@handler('generate_exercises')
+def generate_exercises(payload, job):
+    """
+    Generate and save ``count`` exercises (one or a worksheet).
+    payload: subject_id, level, level_label, topic, difficulty, exercise_type, language, count.
+    """
+    from lessons.models import Subject
+    from .generation import build_exercise, save_exercises
+    from .services import AIService
+
+    try:
+        subject = Subject.objects.get(pk=payload['subject_id'])
+    except Subject.DoesNotExist:
+        raise JobFailed(f"Subject {payload['subject_id']} does not exist")
+    ai_service = AIService(job.user)
+    args = (subject.name, payload['level_label'], payload['topic'])
+    options = dict(difficulty=payload['difficulty'], exercise_type=payload['exercise_type'], language=payload['language'])
+
+    count = payload.get('count', 1)
+    if count == 1:
+        exercise_data = ai_service.generate_exercise(*args, **options)
+        _ai_result(exercise_data)
+        generated, errors = [exercise_data], []
+    else:
+        result = async_to_sync(ai_service.agenerate_exercises)(*args, count, **options)
+        _ai_result(result)
+        generated, errors = [], [{"error": error} for error in result["errors"]]
+        for index, exercise_data in enumerate(result["exercises"]):
+            if "error" in exercise_data:
+                errors.append({"index": index, "error": exercise_data["error"]})
+            else:
+                generated.append(exercise_data)
+        if not generated:
+            raise RetryJob("Aucun exercice valide n'a été généré.")
+
+    exercises = save_exercises([
+        build_exercise(exercise_data, subject, payload['level'], payload['exercise_type'], payload['difficulty'],
+                       creator=job.user)
+        for exercise_data in generated
+    ])
+    return {"requested": count, "exercise_ids": [exercise.pk for exercise in exercises], "errors": errors}
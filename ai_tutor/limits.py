@@ -0,0 +1,235 @@
+"""
+Rate and concurrency limits around the Groq calls.
+
+Each call takes a token from a global and a per-user token bucket, then a
+slot among the calls allowed in flight globally and per user. When a limit
+is reached the call waits in a bounded queue until its deadline. A full
+queue, or a wait that cannot end before the deadline, raises RateLimited
+with the number of seconds after which the client may retry (HTTP 429).
+State is kept per worker process.
+"""
+import time
+import math
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from django.conf import settings
+from .metrics import metrics
+
+# How often a queued call checks again for a free slot (seconds)
+POLL_INTERVAL = 0.05
+# Retry-After suggested when the waiting queue is full
+QUEUE_FULL_RETRY_AFTER = 5
+# Idle per-user states beyond this number are forgotten
+MAX_TRACKED_USERS = 10000
+
+
+class RateLimited(Exception):
+    """The call was refused by a limit; ``retry_after`` is in seconds."""
+
+    def __init__(self, retry_after, reason):
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+        super().__init__(
+            f"Le tuteur reçoit trop de demandes en ce moment, réessaie dans {self.retry_after} secondes."
+        )
+
+    @classmethod
+    def from_response(cls, response, reason='upstream'):
+        """Build from a Groq 429 response, honouring its Retry-After header."""
+        try:
+            retry_after = float(response.headers.get('retry-after', 1))
+        except (AttributeError, TypeError, ValueError):
+            retry_after = 1
+        return cls(retry_after, reason)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously; a rate of 0 disables it."""
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until the next token, counting tokens already reserved."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        # Tokens may go negative: each queued call reserves its token
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+
+    def give_back(self):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class _UserState:
+    def __init__(self):
+        self.bucket = TokenBucket(settings.AI_USER_REQUESTS_PER_MINUTE, settings.AI_USER_BURST)
+        self.in_flight = 0
+        # Calls queued or in flight: the state cannot be forgotten while > 0
+        self.active = 0
+
+
+class ConcurrencyLimiter:
+    """Global and per-user limits shared by every AIService of the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Rebuild the limits from settings (used in tests)."""
+        with self._lock:
+            self._bucket = TokenBucket(settings.AI_GLOBAL_REQUESTS_PER_MINUTE, settings.AI_GLOBAL_BURST)
+            self._in_flight = 0
+            self._queued = 0
+            self._users = OrderedDict()
+
+    def _user_state(self, user_key):
+        if user_key is None:
+            return None
+        state = self._users.get(user_key)
+        if state is None:
+            state = self._users[user_key] = _UserState()
+            if len(self._users) > MAX_TRACKED_USERS:
+                for key, old in list(self._users.items()):
+                    if len(self._users) <= MAX_TRACKED_USERS:
+                        break
+                    if old.active == 0:
+                        del self._users[key]
+        else:
+            self._users.move_to_end(user_key)
+        return state
+
+    def _has_slot(self, user):
+        global_max = settings.AI_GLOBAL_MAX_IN_FLIGHT
+        user_max = settings.AI_USER_MAX_IN_FLIGHT
+        if global_max > 0 and self._in_flight >= global_max:
+            return False
+        return user is None or user_max <= 0 or user.in_flight < user_max
+
+    def _admission(self, user_key):
+        """
+        Generator yielding how long to sleep before trying again; it returns
+        the user state once the call holds its slots, or raises RateLimited.
+        """
+        started = time.monotonic()
+        deadline = started + settings.AI_LIMIT_QUEUE_TIMEOUT
+        queued = False
+        admitted = False
+        with self._lock:
+            user = self._user_state(user_key)
+            if user:
+                user.active += 1
+        try:
+            with self._lock:
+                now = time.monotonic()
+                delay = max(self._bucket.delay(now), user.bucket.delay(now) if user else 0.0)
+                if delay or not self._has_slot(user):
+                    if self._queued >= settings.AI_LIMIT_QUEUE_SIZE:
+                        metrics.incr('limits.rejected.queue_full')
+                        raise RateLimited(max(delay, QUEUE_FULL_RETRY_AFTER), 'queue_full')
+                    if now + delay > deadline:
+                        metrics.incr('limits.rejected.rate')
+                        raise RateLimited(delay, 'rate')
+                    self._queued += 1
+                    queued = True
+                    metrics.set_gauge('limits.queue_depth', self._queued)
+                self._bucket.take(now)
+                if user:
+                    user.bucket.take(now)
+
+            if delay:
+                yield delay
+            while True:
+                with self._lock:
+                    if self._has_slot(user):
+                        self._in_flight += 1
+                        if user:
+                            user.in_flight += 1
+                        metrics.set_gauge('limits.in_flight', self._in_flight)
+                        admitted = True
+                        break
+                    if time.monotonic() >= deadline:
+                        self._bucket.give_back()
+                        if user:
+                            user.bucket.give_back()
+                        metrics.incr('limits.rejected.concurrency')
+                        raise RateLimited(1, 'concurrency')
+                yield POLL_INTERVAL
+        finally:
+            with self._lock:
+                if queued:
+                    self._queued -= 1
+                    metrics.set_gauge('limits.queue_depth', self._queued)
+                if user and not admitted:
+                    user.active -= 1
+
+        metrics.incr('limits.admitted')
+        if queued:
+            metrics.incr('limits.queued')
+            metrics.observe('limits.wait_ms', (time.monotonic() - started) * 1000)
+        return user
+
+    def _release(self, user):
+        with self._lock:
+            self._in_flight -= 1
+            if user:
+                user.in_flight -= 1
+                user.active -= 1
+            metrics.set_gauge('limits.in_flight', self._in_flight)
+
+    @contextmanager
+    def acquire(self, user_key=None):
+        """Hold the limits for a blocking call; waits with time.sleep."""
+        if not settings.AI_LIMITS_ENABLED:
+            yield
+            return
+        admission = self._admission(user_key)
+        try:
+            while True:
+                time.sleep(next(admission))
+        except StopIteration as done:
+            user = done.value
+        finally:
+            admission.close()
+        try:
+            yield
+        finally:
+            self._release(user)
+
+    @asynccontextmanager
+    async def aacquire(self, user_key=None):
+        """Hold the limits for a coroutine; waits without blocking the event loop."""
+        if not settings.AI_LIMITS_ENABLED:
+            yield
+            return
+        admission = self._admission(user_key)
+        try:
+            while True:
+                await asyncio.sleep(next(admission))
+        except StopIteration as done:
+            user = done.value
+        finally:
+            admission.close()
+        try:
+            yield
+        finally:
+            self._release(user)
+
+
+limiter = ConcurrencyLimiter()
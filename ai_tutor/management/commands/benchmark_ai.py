@@ -0,0 +1,97 @@
+"""
+Concurrent load benchmark for the AI endpoints of a running server.
+
+Start the server in the mode to compare, then point the benchmark at it:
+
+    # Sync (previous setup)
+    gunicorn backend.wsgi:application --workers 2 --bind 127.0.0.1:8000
+    # ASGI (uvicorn workers)
+    gunicorn backend.asgi:application -k uvicorn_worker.UvicornWorker --workers 2 --bind 127.0.0.1:8000
+
+    python manage.py benchmark_ai --url http://127.0.0.1:8000 --token <token> --concurrency 100 --requests 500
+
+Reports throughput, error count and latency percentiles.
+
+Offline and reproducible: replace Groq by the bundled fake server first,
+
+    python manage.py fake_llm_server --latency 0.4 --tokens-per-second 250
+    AI_BASE_URL=http://127.0.0.1:8765/v1 GROQ_API_KEY=fake gunicorn ...
+"""
+import time
+import asyncio
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from ai_tutor.metrics import percentile
+
+ENDPOINTS = {
+    'chat': ('/api/ai/chat/', {
+        'messages': [{'role': 'user', 'content': "Explique-moi les fractions."}]
+    }),
+    'stream': ('/api/ai/chat/stream/', {
+        'messages': [{'role': 'user', 'content': "Explique-moi les fractions."}]
+    }),
+    'exercise': ('/api/ai/generate-exercise/', {
+        'subject': 'Mathématiques', 'level': 'CM1', 'topic': 'Fractions'
+    }),
+}
+
+
+class Command(BaseCommand):
+    help = "Mesure le débit des endpoints IA d'un serveur en cours d'exécution sous charge concurrente."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='URL de base du serveur.')
+        parser.add_argument('--token', required=True, help="Token d'authentification d'un utilisateur.")
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='chat')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requêtes simultanées.')
+        parser.add_argument('--requests', type=int, default=200, help='Nombre total de requêtes.')
+        parser.add_argument('--timeout', type=float, default=120.0, help='Timeout par requête (secondes).')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency et --requests doivent être positifs.")
+        result = asyncio.run(self.run(options))
+
+        latencies = sorted(result['latencies'])
+        self.stdout.write(
+            f"Endpoint: {options['endpoint']}  concurrence: {options['concurrency']}  "
+            f"requêtes: {options['requests']}"
+        )
+        self.stdout.write(f"Durée totale: {result['elapsed']:.2f}s")
+        self.stdout.write(f"Débit: {len(latencies) / result['elapsed']:.1f} req/s")
+        self.stdout.write(f"Erreurs: {result['errors']}  ({dict(result['statuses'])})")
+        if latencies:
+            self.stdout.write(
+                f"Latence p50: {percentile(latencies, 50):.0f}ms  "
+                f"p95: {percentile(latencies, 95):.0f}ms  max: {latencies[-1]:.0f}ms"
+            )
+
+    async def run(self, options):
+        path, payload = ENDPOINTS[options['endpoint']]
+        url = options['url'].rstrip('/') + path
+        headers = {'Authorization': f"Token {options['token']}"}
+        result = {'latencies': [], 'errors': 0, 'statuses': {}}
+        remaining = iter(range(options['requests']))
+
+        limits = httpx.Limits(max_connections=options['concurrency'])
+        async with httpx.AsyncClient(timeout=options['timeout'], limits=limits, headers=headers) as client:
+
+            async def worker():
+                for _ in remaining:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post(url, json=payload)
+                        await response.aread()
+                        status = response.status_code
+                    except httpx.HTTPError as e:
+                        status = type(e).__name__
+                    result['statuses'][status] = result['statuses'].get(status, 0) + 1
+                    if isinstance(status, int) and status < 400:
+                        result['latencies'].append((time.perf_counter() - started) * 1000)
+                    else:
+                        result['errors'] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+            result['elapsed'] = time.perf_counter() - started
+        return result
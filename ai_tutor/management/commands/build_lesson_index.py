@@ -0,0 +1,43 @@
+"""
+Build the lesson retrieval index and save it as a snapshot that the workers
+load at startup (they then only index the lessons changed since).
+
+    python manage.py build_lesson_index
+    python manage.py build_lesson_index --query "comment additionner deux fractions" --lesson 12
+"""
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ai_tutor.retrieval import LessonIndex
+
+
+class Command(BaseCommand):
+    help = "Construit l'index de recherche des leçons utilisé par le tuteur et l'enregistre sur disque."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help='Fichier de sortie (AI_LESSON_INDEX_PATH par défaut).')
+        parser.add_argument('--query', default=None, help='Question de test à rechercher après la construction.')
+        parser.add_argument('--lesson', type=int, default=None, help='Limiter la recherche de test à cette leçon.')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.AI_LESSON_INDEX_PATH
+        if not path:
+            raise CommandError("AI_LESSON_INDEX_PATH n'est pas défini, utilisez --path.")
+
+        started = time.perf_counter()
+        index = LessonIndex()
+        index.sync()
+        elapsed = time.perf_counter() - started
+        index.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(index.lessons)} leçon(s), {len(index.passages)} passage(s), {len(index.postings)} termes "
+            f"indexés en {elapsed:.2f}s -> {path}"
+        ))
+
+        if options['query']:
+            started = time.perf_counter()
+            for _ in range(100):
+                results = index.search(options['query'], options['lesson'], settings.AI_LESSON_TOP_K)
+            self.stdout.write(f"Recherche: {(time.perf_counter() - started) * 10:.3f}ms en moyenne")
+            for score, passage in results:
+                self.stdout.write(f"  {score:.2f}  leçon {passage.lesson_id}  {passage.text[:100]}")
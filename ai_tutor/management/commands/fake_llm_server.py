@@ -0,0 +1,59 @@
+"""
+Local OpenAI-compatible LLM server replaying recorded Groq answers.
+
+    python manage.py fake_llm_server --latency 0.4 --tokens-per-second 250
+    python manage.py fake_llm_server --record https://api.groq.com/openai/v1   # enrich the fixtures
+
+Then start Django with AI_BASE_URL=http://127.0.0.1:8765/v1 and any GROQ_API_KEY.
+"""
+from django.core.management.base import BaseCommand
+from ai_tutor.fake_llm import DEFAULT_FIXTURES, FakeLLMServer, FixtureStore
+
+
+class Command(BaseCommand):
+    help = "Lance un serveur LLM factice compatible OpenAI pour les tests de charge hors ligne."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.5,
+                            help='Délai avant le premier token (secondes).')
+        parser.add_argument('--latency-jitter', type=float, default=0.0,
+                            help='Variation aléatoire du délai, en plus ou en moins (secondes).')
+        parser.add_argument('--tokens-per-second', type=float, default=250.0,
+                            help='Débit de génération simulé (0 = instantané).')
+        parser.add_argument('--chat-tokens', type=int, default=150,
+                            help='Longueur des réponses de chat sans enregistrement.')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Proportion de requêtes en erreur (0 à 1).")
+        parser.add_argument('--error-status', type=int, default=500,
+                            help='Code HTTP des erreurs simulées (500, 503, 429...).')
+        parser.add_argument('--fixtures', default=str(DEFAULT_FIXTURES),
+                            help='Fichier JSON des réponses enregistrées.')
+        parser.add_argument('--record', metavar='URL', default=None,
+                            help="Relayer vers l'API réelle et enregistrer ses réponses.")
+
+    def handle(self, *args, **options):
+        fixtures = FixtureStore(options['fixtures'])
+        server = FakeLLMServer(
+            (options['host'], options['port']),
+            fixtures=fixtures,
+            latency=options['latency'],
+            latency_jitter=options['latency_jitter'],
+            tokens_per_second=options['tokens_per_second'],
+            chat_tokens=options['chat_tokens'],
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            record_url=options['record'],
+        )
+        mode = f"enregistrement depuis {options['record']}" if options['record'] else "rejeu"
+        self.stdout.write(self.style.SUCCESS(
+            f"Serveur LLM factice sur http://{options['host']}:{options['port']}/v1 "
+            f"({mode}, {len(fixtures.entries)} réponse(s) enregistrée(s))"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,56 @@
+"""
+Worker that keeps the stock of pre-generated AI exercises filled.
+
+    python manage.py refill_exercise_stock              # run forever
+    python manage.py refill_exercise_stock --once       # single pass (cron)
+    python manage.py refill_exercise_stock --report     # fill-level report
+"""
+import time
+from django.core.management.base import BaseCommand
+from ai_tutor.services import AIService
+from ai_tutor.stock import fill_report, refill_stock
+
+
+class Command(BaseCommand):
+    help = "Remplit le stock d'exercices pré-générés pour les thèmes les plus demandés."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Une seule passe puis arrêt.')
+        parser.add_argument('--interval', type=int, default=60, help='Secondes entre deux passes.')
+        parser.add_argument('--max-generations', type=int, default=None,
+                            help='Nombre maximum de générations par passe.')
+        parser.add_argument('--report', action='store_true', help='Afficher le niveau de remplissage et quitter.')
+
+    def handle(self, *args, **options):
+        if options['report']:
+            self.print_report()
+            return
+
+        ai_service = AIService()
+        if not ai_service.client:
+            self.stderr.write(self.style.ERROR("GROQ_API_KEY non configurée."))
+            return
+
+        while True:
+            added = refill_stock(
+                ai_service,
+                max_generations=options['max_generations'],
+                log=lambda message: self.stdout.write(message)
+            )
+            self.stdout.write(self.style.SUCCESS(f"{added} exercice(s) ajouté(s) au stock."))
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def print_report(self):
+        rows = fill_report()
+        if not rows:
+            self.stdout.write("Aucun créneau populaire pour le moment.")
+            return
+        for row in rows:
+            self.stdout.write(
+                f"{row['fill_percent']:>3}%  {row['in_stock']}/{row['target']}  "
+                f"{row['subject']} | {row['level']} | {row['difficulty']} | "
+                f"{row['exercise_type']} | {row['language']} | {row['topic']}  "
+                f"(demandes: {row['requests']}, servies du stock: {row['stock_hits']})"
+            )
@@ -0,0 +1,40 @@
+"""
+Daily rollups of the LLM call ledger (cron, once an hour or once a day).
+
+    python manage.py rollup_llm_usage               # yesterday and today
+    python manage.py rollup_llm_usage --days 30     # the last 30 days
+    python manage.py rollup_llm_usage --purge       # also delete old call records
+"""
+import datetime
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ai_tutor.usage import purge_records, rollup_day, usage_recorder
+
+
+class Command(BaseCommand):
+    help = "Agrège le journal des appels LLM en consommations journalières (tokens, latence, coût)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help="Nombre de jours à recalculer, aujourd'hui inclus.")
+        parser.add_argument('--date', type=datetime.date.fromisoformat, default=None,
+                            help='Recalculer un seul jour (AAAA-MM-JJ).')
+        parser.add_argument('--purge', action='store_true',
+                            help='Supprimer les appels plus anciens que AI_USAGE_RETENTION_DAYS.')
+
+    def handle(self, *args, **options):
+        # Records buffered by this process (management shell, tests) first
+        usage_recorder.flush()
+
+        if options['date']:
+            days = [options['date']]
+        else:
+            today = timezone.localdate()
+            days = [today - datetime.timedelta(days=offset) for offset in range(max(1, options['days']))]
+
+        for day in sorted(days):
+            rows = rollup_day(day)
+            self.stdout.write(f"{day}: {rows} ligne(s) agrégée(s).")
+
+        if options['purge']:
+            deleted = purge_records()
+            self.stdout.write(self.style.SUCCESS(f"{deleted} appel(s) ancien(s) supprimé(s)."))
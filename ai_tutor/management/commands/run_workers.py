@@ -0,0 +1,96 @@
+"""
+Pool of worker processes running the background jobs of the database queue.
+
+    python manage.py run_workers --processes 2
+    python manage.py run_workers --once        # run the runnable jobs, then exit (cron, tests)
+
+SIGTERM / Ctrl-C lets every worker finish its current job before exiting.
+"""
+import time
+import signal
+import multiprocessing
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from ai_tutor.jobs import requeue_stale_jobs, run_next_job, worker_name
+from ai_tutor.usage import usage_recorder
+
+# Seconds between two checks for jobs lost with a dead worker
+STALE_CHECK_INTERVAL = 60
+
+
+class Stopping:
+    """Stop flag set by signal handlers (they must not touch the Event's lock)."""
+
+    def __init__(self):
+        self.requested = False
+
+    def request(self, signum=None, frame=None):
+        self.requested = True
+
+
+def work(stop, once=False):
+    """Loop of one worker process: claim and run jobs until ``stop`` is set."""
+    stopping = Stopping()
+    if not once:
+        # Pool process: the parent decides when to stop, SIGTERM finishes the current job
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, stopping.request)
+    name = worker_name()
+    next_stale_check = 0.0
+    while not stopping.requested and not stop.is_set():
+        close_old_connections()
+        if time.monotonic() >= next_stale_check:
+            requeue_stale_jobs()
+            next_stale_check = time.monotonic() + STALE_CHECK_INTERVAL
+        if run_next_job(name) is None:
+            if once:
+                break
+            stop.wait(settings.AI_JOB_POLL_INTERVAL)
+    # Worker processes exit without running atexit hooks
+    usage_recorder.flush()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Lance des processus qui exécutent les tâches de fond (générations IA) de la file d'attente."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='Nombre de processus workers.')
+        parser.add_argument('--once', action='store_true',
+                            help="Exécuter les tâches prêtes puis s'arrêter (un seul processus).")
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError("--processes doit être positif.")
+        stop = multiprocessing.Event()
+        if options['once']:
+            work(stop, once=True)
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=work, args=(stop,), name=f'ai-job-worker-{number}')
+            for number in range(options['processes'])
+        ]
+        for process in workers:
+            process.start()
+        self.stdout.write(self.style.SUCCESS(f"{len(workers)} worker(s) démarré(s)."))
+
+        stopping = Stopping()
+        signal.signal(signal.SIGTERM, stopping.request)
+        signal.signal(signal.SIGINT, stopping.request)
+        while not stopping.requested:
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    self.stderr.write(f"Worker {process.name} arrêté (code {process.exitcode}), redémarrage.")
+                    workers[index] = multiprocessing.Process(target=work, args=(stop,), name=process.name)
+                    workers[index].start()
+            time.sleep(1)
+
+        stop.set()
+        self.stdout.write("Arrêt : fin des tâches en cours...")
+        for process in workers:
+            process.join()
+        self.stdout.write(self.style.SUCCESS("Workers arrêtés."))
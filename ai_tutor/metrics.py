@@ -0,0 +1,78 @@
+"""
+Lightweight in-process metrics for the AI tutor.
+
+Counters, gauges and latency timings are kept per worker process and exposed
+through the admin-only ``ai/metrics/`` endpoint.
+"""
+import threading
+from collections import defaultdict, deque
+
+
+class MetricsRegistry:
+    """Thread-safe store of counters, gauges and latency samples."""
+
+    def __init__(self, max_samples=1000):
+        self._lock = threading.Lock()
+        self._max_samples = max_samples
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._timings = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value_ms):
+        """Record a latency sample (milliseconds)."""
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {
+                    'count': 0,
+                    'sum': 0.0,
+                    'max': 0.0,
+                    'samples': deque(maxlen=self._max_samples),
+                }
+            timing['count'] += 1
+            timing['sum'] += value_ms
+            timing['max'] = max(timing['max'], value_ms)
+            timing['samples'].append(value_ms)
+
+    def snapshot(self):
+        """Return a JSON-serializable view of every metric."""
+        with self._lock:
+            timings = {}
+            for name, timing in self._timings.items():
+                samples = sorted(timing['samples'])
+                timings[name] = {
+                    'count': timing['count'],
+                    'avg_ms': round(timing['sum'] / timing['count'], 2) if timing['count'] else 0,
+                    'p50_ms': round(percentile(samples, 50), 2),
+                    'p95_ms': round(percentile(samples, 95), 2),
+                    'max_ms': round(timing['max'], 2),
+                }
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'timings': timings,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+def percentile(sorted_samples, percent):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(percent / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('lessons', '0003_alter_lesson_options_lesson_pdf_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExerciseStockItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.CharField(choices=[('cp1', 'CP1'), ('cp2', 'CP2'), ('ce1', 'CE1'), ('ce2', 'CE2'), ('cm1', 'CM1'), ('cm2', 'CM2'), ('sixieme', '6ème'), ('cinquieme', '5ème'), ('quatrieme', '4ème'), ('troisieme', '3ème'), ('seconde', 'Seconde'), ('premiere', 'Première'), ('terminale', 'Terminale')], max_length=20, verbose_name='Niveau')),
+                ('difficulty', models.CharField(choices=[('easy', 'Facile'), ('medium', 'Moyen'), ('hard', 'Difficile')], max_length=20, verbose_name='Difficulté')),
+                ('exercise_type', models.CharField(choices=[('qcm', 'QCM'), ('classic', "Classique (Fiche d'exercices)")], max_length=20, verbose_name="Type d'exercice")),
+                ('language', models.CharField(default='fr', max_length=5, verbose_name='Langue')),
+                ('topic', models.CharField(max_length=200, verbose_name='Thème')),
+                ('topic_key', models.CharField(max_length=200, verbose_name='Thème normalisé')),
+                ('payload', models.JSONField(verbose_name='Exercice généré (JSON)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_items', to='lessons.subject', verbose_name='Matière')),
+            ],
+            options={
+                'verbose_name': 'Exercice en stock',
+                'verbose_name_plural': 'Exercices en stock',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['subject', 'level', 'difficulty', 'exercise_type', 'language', 'topic_key'], name='ai_stock_slot_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExerciseStockDemand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.CharField(choices=[('cp1', 'CP1'), ('cp2', 'CP2'), ('ce1', 'CE1'), ('ce2', 'CE2'), ('cm1', 'CM1'), ('cm2', 'CM2'), ('sixieme', '6ème'), ('cinquieme', '5ème'), ('quatrieme', '4ème'), ('troisieme', '3ème'), ('seconde', 'Seconde'), ('premiere', 'Première'), ('terminale', 'Terminale')], max_length=20, verbose_name='Niveau')),
+                ('difficulty', models.CharField(choices=[('easy', 'Facile'), ('medium', 'Moyen'), ('hard', 'Difficile')], max_length=20, verbose_name='Difficulté')),
+                ('exercise_type', models.CharField(choices=[('qcm', 'QCM'), ('classic', "Classique (Fiche d'exercices)")], max_length=20, verbose_name="Type d'exercice")),
+                ('language', models.CharField(default='fr', max_length=5, verbose_name='Langue')),
+                ('topic', models.CharField(max_length=200, verbose_name='Thème')),
+                ('topic_key', models.CharField(max_length=200, verbose_name='Thème normalisé')),
+                ('requests', models.PositiveIntegerField(default=0, verbose_name='Demandes')),
+                ('stock_hits', models.PositiveIntegerField(default=0, verbose_name='Servies depuis le stock')),
+                ('last_requested_at', models.DateTimeField(auto_now=True, verbose_name='Dernière demande')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_demands', to='lessons.subject', verbose_name='Matière')),
+            ],
+            options={
+                'verbose_name': 'Demande de génération',
+                'verbose_name_plural': 'Demandes de génération',
+                'ordering': ['-requests'],
+                'unique_together': {('subject', 'level', 'difficulty', 'exercise_type', 'language', 'topic_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ai_tutor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCallRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, verbose_name='Date')),
+                ('endpoint', models.CharField(max_length=30, verbose_name='Fonction')),
+                ('model', models.CharField(max_length=60, verbose_name='Modèle')),
+                ('prompt_tokens', models.PositiveIntegerField(default=0, verbose_name='Tokens du prompt')),
+                ('completion_tokens', models.PositiveIntegerField(default=0, verbose_name='Tokens générés')),
+                ('latency_ms', models.PositiveIntegerField(default=0, verbose_name='Latence (ms)')),
+                ('success', models.BooleanField(default=True, verbose_name='Succès')),
+                ('error', models.CharField(blank=True, max_length=60, verbose_name='Erreur')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to=settings.AUTH_USER_MODEL, verbose_name='Utilisateur')),
+            ],
+            options={
+                'verbose_name': 'Appel LLM',
+                'verbose_name_plural': 'Appels LLM',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LLMUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Jour')),
+                ('endpoint', models.CharField(max_length=30, verbose_name='Fonction')),
+                ('model', models.CharField(max_length=60, verbose_name='Modèle')),
+                ('calls', models.PositiveIntegerField(default=0, verbose_name='Appels')),
+                ('errors', models.PositiveIntegerField(default=0, verbose_name='Erreurs')),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0, verbose_name='Tokens du prompt')),
+                ('completion_tokens', models.PositiveBigIntegerField(default=0, verbose_name='Tokens générés')),
+                ('avg_latency_ms', models.PositiveIntegerField(default=0, verbose_name='Latence moyenne (ms)')),
+                ('p95_latency_ms', models.PositiveIntegerField(default=0, verbose_name='Latence p95 (ms)')),
+                ('cost', models.DecimalField(decimal_places=6, default=0, max_digits=12, verbose_name='Coût (USD)')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_usage', to=settings.AUTH_USER_MODEL, verbose_name='Utilisateur')),
+            ],
+            options={
+                'verbose_name': 'Consommation LLM journalière',
+                'verbose_name_plural': 'Consommations LLM journalières',
+                'ordering': ['-date', '-cost'],
+                'unique_together': {('date', 'user', 'endpoint', 'model')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_tutor', '0002_llm_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='llmcallrecord',
+            name='route',
+            field=models.CharField(blank=True, max_length=40, verbose_name='Règle de routage'),
+        ),
+    ]
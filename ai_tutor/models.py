@@ -1,3 +1,207 @@
+"""
+Modèles pour le tuteur IA.
+"""
+from django.conf import settings
 from django.db import models
+from lessons.models import Lesson, Subject
+from exercises.models import Exercise
 
-# Create your models here.
+
+class ExerciseStockItem(models.Model):
+    """Exercice pré-généré par l'IA, en attente d'être attribué à un élève."""
+
+    subject = models.ForeignKey(
+        Subject,
+        on_delete=models.CASCADE,
+        related_name='stock_items',
+        verbose_name='Matière'
+    )
+    level = models.CharField(
+        max_length=20,
+        choices=Lesson.LEVEL_CHOICES,
+        verbose_name='Niveau'
+    )
+    difficulty = models.CharField(
+        max_length=20,
+        choices=Exercise.DIFFICULTY_CHOICES,
+        verbose_name='Difficulté'
+    )
+    exercise_type = models.CharField(
+        max_length=20,
+        choices=Exercise.EXERCISE_TYPES,
+        verbose_name='Type d\'exercice'
+    )
+    language = models.CharField(max_length=5, default='fr', verbose_name='Langue')
+    topic = models.CharField(max_length=200, verbose_name='Thème')
+    topic_key = models.CharField(max_length=200, verbose_name='Thème normalisé')
+    payload = models.JSONField(verbose_name='Exercice généré (JSON)')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Exercice en stock'
+        verbose_name_plural = 'Exercices en stock'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(
+                fields=['subject', 'level', 'difficulty', 'exercise_type', 'language', 'topic_key'],
+                name='ai_stock_slot_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - {self.level} - {self.topic} ({self.difficulty}, {self.exercise_type})"
+
+
+class ExerciseStockDemand(models.Model):
+    """Demandes de génération par créneau, pour déterminer les thèmes populaires à stocker."""
+
+    subject = models.ForeignKey(
+        Subject,
+        on_delete=models.CASCADE,
+        related_name='stock_demands',
+        verbose_name='Matière'
+    )
+    level = models.CharField(
+        max_length=20,
+        choices=Lesson.LEVEL_CHOICES,
+        verbose_name='Niveau'
+    )
+    difficulty = models.CharField(
+        max_length=20,
+        choices=Exercise.DIFFICULTY_CHOICES,
+        verbose_name='Difficulté'
+    )
+    exercise_type = models.CharField(
+        max_length=20,
+        choices=Exercise.EXERCISE_TYPES,
+        verbose_name='Type d\'exercice'
+    )
+    language = models.CharField(max_length=5, default='fr', verbose_name='Langue')
+    topic = models.CharField(max_length=200, verbose_name='Thème')
+    topic_key = models.CharField(max_length=200, verbose_name='Thème normalisé')
+    requests = models.PositiveIntegerField(default=0, verbose_name='Demandes')
+    stock_hits = models.PositiveIntegerField(default=0, verbose_name='Servies depuis le stock')
+    last_requested_at = models.DateTimeField(auto_now=True, verbose_name='Dernière demande')
+
+    class Meta:
+        verbose_name = 'Demande de génération'
+        verbose_name_plural = 'Demandes de génération'
+        ordering = ['-requests']
+        unique_together = ['subject', 'level', 'difficulty', 'exercise_type', 'language', 'topic_key']
+
+    def __str__(self):
+        return f"{self.subject} - {self.level} - {self.topic} ({self.requests})"
+
+
+class LLMCallRecord(models.Model):
+    """Journal (en ajout seul) de chaque appel au LLM, écrit par lots hors du cycle de requête."""
+
+    created_at = models.DateTimeField(db_index=True, verbose_name='Date')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='llm_calls',
+        verbose_name='Utilisateur'
+    )
+    endpoint = models.CharField(max_length=30, verbose_name='Fonction')
+    model = models.CharField(max_length=60, verbose_name='Modèle')
+    route = models.CharField(max_length=40, blank=True, verbose_name='Règle de routage')
+    prompt_tokens = models.PositiveIntegerField(default=0, verbose_name='Tokens du prompt')
+    completion_tokens = models.PositiveIntegerField(default=0, verbose_name='Tokens générés')
+    latency_ms = models.PositiveIntegerField(default=0, verbose_name='Latence (ms)')
+    success = models.BooleanField(default=True, verbose_name='Succès')
+    error = models.CharField(max_length=60, blank=True, verbose_name='Erreur')
+
+    class Meta:
+        verbose_name = 'Appel LLM'
+        verbose_name_plural = 'Appels LLM'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M} - {self.endpoint} - {self.model}"
+
+
+class LLMUsageDaily(models.Model):
+    """Agrégat journalier des appels LLM par fonction, modèle et utilisateur."""
+
+    date = models.DateField(verbose_name='Jour')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='llm_usage',
+        verbose_name='Utilisateur'
+    )
+    endpoint = models.CharField(max_length=30, verbose_name='Fonction')
+    model = models.CharField(max_length=60, verbose_name='Modèle')
+    calls = models.PositiveIntegerField(default=0, verbose_name='Appels')
+    errors = models.PositiveIntegerField(default=0, verbose_name='Erreurs')
+    prompt_tokens = models.PositiveBigIntegerField(default=0, verbose_name='Tokens du prompt')
+    completion_tokens = models.PositiveBigIntegerField(default=0, verbose_name='Tokens générés')
+    avg_latency_ms = models.PositiveIntegerField(default=0, verbose_name='Latence moyenne (ms)')
+    p95_latency_ms = models.PositiveIntegerField(default=0, verbose_name='Latence p95 (ms)')
+    cost = models.DecimalField(max_digits=12, decimal_places=6, default=0, verbose_name='Coût (USD)')
+
+    class Meta:
+        verbose_name = 'Consommation LLM journalière'
+        verbose_name_plural = 'Consommations LLM journalières'
+        ordering = ['-date', '-cost']
+        unique_together = ['date', 'user', 'endpoint', 'model']
+
+    def __str__(self):
+        return f"{self.date} - {self.endpoint} - {self.model} ({self.calls} appels)"
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+
+class Job(models.Model):
+    """Tâche de fond (génération IA longue) exécutée par `manage.py run_workers`."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'En attente'),
+        (RUNNING, 'En cours'),
+        (SUCCEEDED, 'Terminée'),
+        (FAILED, 'Échouée'),
+    ]
+
+    kind = models.CharField(max_length=50, verbose_name='Type de tâche')
+    payload = models.JSONField(default=dict, verbose_name='Paramètres')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, verbose_name='Statut')
+    result = models.JSONField(null=True, blank=True, verbose_name='Résultat')
+    error = models.TextField(blank=True, verbose_name='Dernière erreur')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Tentatives')
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name='Tentatives maximum')
+    run_after = models.DateTimeField(verbose_name='Exécutable à partir de')
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name='Worker')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Prise en charge le')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='ai_jobs',
+        verbose_name='Utilisateur'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Terminée le')
+
+    class Meta:
+        verbose_name = 'Tâche de fond'
+        verbose_name_plural = 'Tâches de fond'
+        ordering = ['-created_at']
+        indexes = [
+            # Claim query: next pending job whose time has come
+            models.Index(fields=['status', 'run_after'], name='ai_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
@@ -0,0 +1,116 @@
+"""
+Retries and circuit breaking for the Groq calls.
+
+Transient failures (429, 5xx, timeouts, connection errors) are retried with
+exponential backoff and full jitter, within the deadline of the call. Each
+model has a circuit breaker: after repeated transient failures it opens and
+calls fail fast with CircuitOpen, until a single probe call succeeds again.
+State is kept per worker process.
+"""
+import time
+import random
+import threading
+import openai
+from django.conf import settings
+from .metrics import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """The provider is considered degraded for this model: fail fast."""
+
+    def __init__(self, model, retry_after):
+        self.model = model
+        self.retry_after = retry_after
+        super().__init__(f"Circuit open for {model}, retry in {retry_after:.0f} s")
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def retry_delay(attempt, error=None):
+    """Seconds to wait before retry number ``attempt`` (0-based)."""
+    # Honour the provider's Retry-After on 429
+    if isinstance(error, openai.RateLimitError):
+        try:
+            return float(error.response.headers.get('retry-after'))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    cap = min(settings.AI_RETRY_MAX_DELAY, settings.AI_RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set_gauge(f'breaker.{self.name}.state', state)
+
+    def before_call(self):
+        """Raise CircuitOpen unless the call may go through."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            elapsed = time.monotonic() - self.opened_at
+            if self.state == OPEN and elapsed >= settings.AI_BREAKER_RESET_TIMEOUT:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                # A single probe call decides whether to close the circuit
+                self._probing = True
+                return
+            metrics.incr(f'breaker.{self.name}.rejected')
+            raise CircuitOpen(self.name, max(0.0, settings.AI_BREAKER_RESET_TIMEOUT - elapsed))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+                metrics.incr(f'breaker.{self.name}.closed')
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (
+                    self.state == CLOSED and self.failures >= settings.AI_BREAKER_FAILURE_THRESHOLD):
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+                metrics.incr(f'breaker.{self.name}.opened')
+
+    def release(self):
+        """End a probe that neither succeeded nor failed transiently (e.g. a 400)."""
+        with self._lock:
+            self._probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(model):
+    breaker = _breakers.get(model)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(model, CircuitBreaker(model))
+    return breaker
+
+
+def reset_breakers():
+    """Close every circuit (used in tests)."""
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,326 @@
+"""
+In-process BM25 index over the lessons, used to ground the tutor chat.
+
+Each active lesson is cut into passages of about AI_LESSON_PASSAGE_TOKENS
+tokens (its summary is one more passage); chapter and lesson titles are
+indexed with every passage. The index lives in each worker process:
+
+- it is built when the worker starts (``warm_lesson_index``), from the
+  snapshot written by ``manage.py build_lesson_index`` when there is one,
+  then caught up with the lessons changed since;
+- lessons saved or deleted in this process are re-indexed right away
+  (signals), and a lesson is re-checked against its ``updated_at`` before
+  being used, so changes made by other workers are picked up too.
+
+A search is a few dictionary lookups and takes well under a millisecond
+for a lesson; the freshness check is one primary-key query, and the
+lesson is only read again when it changed.
+"""
+import re
+import html
+import math
+import time
+import heapq
+import pickle
+import logging
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from django.conf import settings
+from .conversation import estimate_tokens
+from .metrics import metrics
+from .utils import fold_text
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# Block-level HTML tags and blank lines separate paragraphs
+_BLOCK_RE = re.compile(r"</?(?:h[1-6]|p|li|ul|ol|div|br|tr|table|section|blockquote)\b[^>]*>|\n\s*\n", re.IGNORECASE)
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_TERM_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+    a ai as au aux avec c ca ce ces cet cette d dans de des du elle elles en est et etre il ils
+    j je l la le les leur leurs lui m ma mais me mes moi mon n ne nos notre nous on ou par pas
+    pour qu que quel quelle qui s sa se ses si son sont sur t ta te tes toi ton tu un une vos
+    votre vous y comment pourquoi quoi explique expliquer peux peut veux stp svp merci
+    the of and to is in what how why
+""".split())
+
+
+def tokenize(text):
+    """Folded terms of a text, stop words removed and plurals reduced ("Fractions" -> "fraction")."""
+    terms = []
+    for term in _TERM_RE.findall(fold_text(text)):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 3 and term[-1] in 'sx' and not term.endswith('ss'):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+def split_passages(text, max_tokens):
+    """Cut a lesson body (HTML or plain text) into passages of at most about ``max_tokens`` tokens."""
+    paragraphs = []
+    for block in _BLOCK_RE.split(text or ''):
+        block = _SPACE_RE.sub(' ', html.unescape(_TAG_RE.sub(' ', block))).strip()
+        if not block:
+            continue
+        if estimate_tokens(block) <= max_tokens:
+            paragraphs.append(block)
+        else:
+            paragraphs.extend(_SENTENCE_RE.split(block))
+
+    passages, current, size = [], [], 0
+    for paragraph in paragraphs:
+        tokens = estimate_tokens(paragraph)
+        if current and size + tokens > max_tokens:
+            passages.append(' '.join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += tokens
+    if current:
+        passages.append(' '.join(current))
+    return passages
+
+
+class Passage:
+    def __init__(self, lesson_id, text, kind='content'):
+        self.lesson_id = lesson_id
+        self.text = text
+        self.kind = kind
+
+    def __repr__(self):
+        return f"Passage({self.lesson_id}, {self.kind!r}, {self.text[:40]!r})"
+
+
+class LessonIndex:
+    """Inverted index (term -> {passage id: term frequency}) scored with BM25."""
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.passages = {}
+        self.lengths = {}
+        self.postings = defaultdict(dict)
+        self.total_length = 0
+        self.next_id = 0
+        # lesson id -> {updated_at, title, chapter, passages (ids), terms}
+        self.lessons = {}
+        self.ready = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['postings'] = dict(self.postings)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.postings = defaultdict(dict, self.postings)
+        self._lock = threading.Lock()
+
+    def _add_passage(self, passage, terms):
+        passage_id = self.next_id
+        self.next_id += 1
+        self.passages[passage_id] = passage
+        self.lengths[passage_id] = len(terms)
+        self.total_length += len(terms)
+        for term, frequency in Counter(terms).items():
+            self.postings[term][passage_id] = frequency
+        return passage_id
+
+    def _remove(self, lesson_id):
+        entry = self.lessons.pop(lesson_id, None)
+        if entry is None:
+            return
+        for passage_id in entry['passages']:
+            self.passages.pop(passage_id)
+            self.total_length -= self.lengths.pop(passage_id)
+        for term in entry['terms']:
+            postings = self.postings[term]
+            for passage_id in entry['passages']:
+                postings.pop(passage_id, None)
+            if not postings:
+                del self.postings[term]
+
+    def index_lesson(self, lesson):
+        """(Re)index one lesson; ``lesson.chapter`` should be loaded with it."""
+        title_terms = tokenize(f"{lesson.chapter.title} {lesson.title}")
+        texts = [(text, 'content') for text in split_passages(lesson.content, settings.AI_LESSON_PASSAGE_TOKENS)]
+        if lesson.summary and lesson.summary.strip():
+            texts.append((_SPACE_RE.sub(' ', lesson.summary).strip(), 'summary'))
+        passages = [(Passage(lesson.pk, text, kind), title_terms + tokenize(text)) for text, kind in texts]
+        with self._lock:
+            self._remove(lesson.pk)
+            self.lessons[lesson.pk] = {
+                'updated_at': lesson.updated_at,
+                'title': lesson.title,
+                'chapter': lesson.chapter.title,
+                'passages': [self._add_passage(passage, terms) for passage, terms in passages],
+                'terms': set(term for _, terms in passages for term in terms),
+            }
+
+    def remove_lesson(self, lesson_id):
+        with self._lock:
+            self._remove(lesson_id)
+
+    def sync(self):
+        """Index new or changed active lessons and drop the others; returns how many changed."""
+        from lessons.models import Lesson
+
+        stamps = dict(Lesson.objects.filter(is_active=True).values_list('id', 'updated_at'))
+        stale = [pk for pk, updated_at in stamps.items()
+                 if pk not in self.lessons or self.lessons[pk]['updated_at'] != updated_at]
+        removed = [pk for pk in list(self.lessons) if pk not in stamps]
+        for lesson_id in removed:
+            self.remove_lesson(lesson_id)
+        for start in range(0, len(stale), 500):
+            for lesson in Lesson.objects.filter(pk__in=stale[start:start + 500]).select_related('chapter'):
+                self.index_lesson(lesson)
+        self.ready = True
+        return len(stale) + len(removed)
+
+    def refresh_lesson(self, lesson_id):
+        """Re-index a lesson changed by another process; False if it is gone or inactive."""
+        from lessons.models import Lesson
+
+        updated_at = Lesson.objects.filter(pk=lesson_id, is_active=True).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            self.remove_lesson(lesson_id)
+            return False
+        entry = self.lessons.get(lesson_id)
+        if entry is None or entry['updated_at'] != updated_at:
+            self.index_lesson(Lesson.objects.select_related('chapter').get(pk=lesson_id))
+        return True
+
+    def lesson_info(self, lesson_id):
+        """(title, chapter title) of an indexed lesson, or None."""
+        entry = self.lessons.get(lesson_id)
+        return (entry['title'], entry['chapter']) if entry else None
+
+    def search(self, query, lesson_id=None, k=3):
+        """Top-k (score, Passage) for the query, within one lesson when ``lesson_id`` is given."""
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self.passages)
+            if not terms or not count:
+                return []
+            scope = set(self.lessons[lesson_id]['passages']) if lesson_id in self.lessons else None
+            if lesson_id is not None and scope is None:
+                return []
+            average_length = self.total_length / count
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                candidates = scope.intersection(postings) if scope is not None else postings
+                for passage_id in candidates:
+                    frequency = postings[passage_id]
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[passage_id] / average_length)
+                    scores[passage_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, self.passages[passage_id]) for passage_id, score in best]
+
+    def fallback_passages(self, lesson_id, k=1):
+        """Passages to use when nothing matches: the summary, else the beginning of the lesson."""
+        with self._lock:
+            entry = self.lessons.get(lesson_id)
+            if entry is None:
+                return []
+            passages = [self.passages[passage_id] for passage_id in entry['passages']]
+        summaries = [p for p in passages if p.kind == 'summary']
+        return (summaries or passages)[:k]
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = pickle.dumps({'version': SNAPSHOT_VERSION, 'index': self}, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(data)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        """Index saved by ``save``, or None when there is no usable snapshot."""
+        try:
+            data = pickle.loads(Path(path).read_bytes())
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.info(f"No usable lesson index snapshot at {path}: {str(e)}")
+            return None
+        if data.get('version') != SNAPSHOT_VERSION:
+            return None
+        return data['index']
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_lesson_index():
+    """Index of this process, built on first use (snapshot + catch-up, or from the database)."""
+    global _index
+    if _index is not None and _index.ready:
+        return _index
+    with _index_lock:
+        if _index is None or not _index.ready:
+            index = LessonIndex.load(settings.AI_LESSON_INDEX_PATH) if settings.AI_LESSON_INDEX_PATH else None
+            index = index or LessonIndex()
+            changed = index.sync()
+            logger.info(f"Lesson index ready: {len(index.lessons)} lessons, {len(index.passages)} passages "
+                        f"({changed} indexed at startup)")
+            _index = index
+    return _index
+
+
+def current_lesson_index():
+    """Index of this process if it was already built, without building it."""
+    return _index if _index is not None and _index.ready else None
+
+
+def warm_lesson_index():
+    """Build the index in the background when the worker starts."""
+    if not settings.AI_LESSON_INDEX_ENABLED:
+        return
+
+    def build():
+        from django.db import close_old_connections
+        try:
+            get_lesson_index()
+        except Exception as e:
+            logger.warning(f"Lesson index warm-up failed, it will be built on first use: {str(e)}")
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=build, name='lesson-index-warmup', daemon=True).start()
+
+
+def lesson_passages(lesson_id, query, k=None):
+    """
+    Return (lesson info, passages) for grounding a chat answer in a lesson:
+    the top-k passages of the lesson for the query, or its summary when none
+    matches. Lesson info is (title, chapter title); (None, []) if the lesson
+    does not exist or is inactive.
+    """
+    index = get_lesson_index()
+    if not index.refresh_lesson(lesson_id):
+        return None, []
+    k = k or settings.AI_LESSON_TOP_K
+    started = time.perf_counter()
+    results = [passage for score, passage in index.search(query, lesson_id, k) if score > 0]
+    metrics.observe('retrieval.search_ms', (time.perf_counter() - started) * 1000)
+    if results:
+        metrics.incr('retrieval.hits')
+    else:
+        metrics.incr('retrieval.fallbacks')
+        results = index.fallback_passages(lesson_id)
+    return index.lesson_info(lesson_id), results
@@ -0,0 +1,122 @@
+"""
+Choice of the model and token cap of each Groq call.
+
+The rules of AI_ROUTING_RULES are tried in order and the first one whose
+conditions all hold gives the model and max_tokens. Conditions (all
+optional):
+
+    task                 'chat', 'exercise', 'exercise_batch', 'exercise_repair' (or a list)
+    min_level/max_level  student level code, e.g. 'cm2' (inclusive)
+    max_message_tokens   size of the last student message
+    max_context_tokens   size of the whole conversation sent to Groq
+    math                 True/False: the request involves maths or LaTeX
+
+Each decision is logged and counted in metrics (routing.<rule>), and the
+rule name is stored with the call in the usage ledger, so that latencies
+and errors per rule can be compared (usage.route_report).
+"""
+import re
+import logging
+from django.conf import settings
+from lessons.resolvers import resolve_level
+from users.models import level_rank as code_rank
+from .conversation import count_tokens, estimate_tokens
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# LaTeX, arithmetic between numbers, or a maths / science notion
+_MATH_RE = re.compile(
+    r"\$|\\[a-zA-Z]+|\d\s*[-+*/×÷^=<>]\s*\d|\b\d+\s*%|"
+    r"\b(équation|fraction|calcul|racine|puissance|dérivée|intégrale|théorème|pythagore|thalès|"
+    r"géométrie|aire|périmètre|volume|pourcentage|probabilité|fonction|algèbre|vecteur|multiplication|division)",
+    re.IGNORECASE
+)
+_MATH_SUBJECT_RE = re.compile(r"math|physique|chimie|science|svt", re.IGNORECASE)
+
+
+class Route:
+    def __init__(self, name, model, max_tokens=None, features=None):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.features = features or {}
+
+    def apply(self, params):
+        """Set the routed model and token cap on Groq request parameters."""
+        params["model"] = self.model
+        if self.max_tokens:
+            params["max_tokens"] = self.max_tokens
+        return params
+
+    def __repr__(self):
+        return f"Route({self.name!r}, {self.model!r}, max_tokens={self.max_tokens})"
+
+
+def level_rank(level):
+    """Position of a level code or label ('cm2', '6ème') in the school order; None if unknown."""
+    return code_rank(resolve_level(level))
+
+
+def needs_math(*texts):
+    return any(text and _MATH_RE.search(text) for text in texts)
+
+
+class ModelRouter:
+    def __init__(self, rules=None):
+        self._rules = rules
+
+    @property
+    def rules(self):
+        return self._rules if self._rules is not None else settings.AI_ROUTING_RULES
+
+    def features(self, task, messages=None, level=None, subject=None):
+        messages = messages or []
+        last_user = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+        return {
+            'task': task,
+            'level': level_rank(level),
+            'message_tokens': estimate_tokens(last_user),
+            'context_tokens': count_tokens(messages),
+            'math': bool(subject and _MATH_SUBJECT_RE.search(subject)) or needs_math(last_user),
+        }
+
+    def matches(self, rule, features):
+        tasks = rule.get('task')
+        if tasks and features['task'] not in ([tasks] if isinstance(tasks, str) else tasks):
+            return False
+        for key, compare in (('min_level', lambda rank, bound: rank >= bound),
+                             ('max_level', lambda rank, bound: rank <= bound)):
+            if key in rule:
+                bound = level_rank(rule[key])
+                if features['level'] is None or bound is None or not compare(features['level'], bound):
+                    return False
+        if 'max_message_tokens' in rule and features['message_tokens'] > rule['max_message_tokens']:
+            return False
+        if 'max_context_tokens' in rule and features['context_tokens'] > rule['max_context_tokens']:
+            return False
+        if 'math' in rule and features['math'] != rule['math']:
+            return False
+        return True
+
+    def route(self, task, default_model, default_max_tokens=None, messages=None, level=None, subject=None):
+        """Return the Route of a call; the defaults apply when no rule matches or routing is off."""
+        if not settings.AI_ROUTING_ENABLED:
+            return Route('default', default_model, default_max_tokens)
+        features = self.features(task, messages, level, subject)
+        route = Route('default', default_model, default_max_tokens, features)
+        for rule in self.rules:
+            if self.matches(rule, features):
+                route = Route(
+                    rule.get('name', task),
+                    rule.get('model', default_model),
+                    rule.get('max_tokens', default_max_tokens),
+                    features
+                )
+                break
+        metrics.incr(f'routing.{route.name}')
+        logger.info(f"Route {task} -> {route.name}: {route.model}, max_tokens={route.max_tokens} {features}")
+        return route
+
+
+router = ModelRouter()
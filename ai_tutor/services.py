@@ -1,77 +1,519 @@
 import os
 import json
+import math
+import asyncio
+import time
 import logging
-from openai import OpenAI
+import textwrap
+import openai
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from .cache import get_chat_cache
+from .client import get_async_client, get_client
+from .conversation import RollingSummarizer, count_tokens, estimate_tokens, extractive_summary, window_messages
+from .limits import RateLimited, limiter
+from .resilience import CircuitOpen, get_breaker, is_retryable, retry_delay
+from .retrieval import lesson_passages
+from .routing import router
+from .metrics import metrics
+from .usage import usage_recorder
+from .validation import check_exercise
 
 logger = logging.getLogger(__name__)
 
+CHAT_MODEL = "llama-3.3-70b-versatile"
+# Used when no routing rule matches (see AI_ROUTING_RULES)
+CHAT_MAX_TOKENS = 1024
+
+# Bump whenever SYSTEM_MESSAGE changes so cached answers are not reused
+SYSTEM_PROMPT_VERSION = "2"
+
+# System prompt to set the persona
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "Tu es un tuteur intelligent pour des élèves de primaire et collège. "
+               "Tu es patient, encourageant et pédagogique. "
+               "Tes réponses doivent être adaptées au niveau de l'élève. "
+               "N'hésite pas à utiliser des émojis pour être plus convivial.\n\n"
+               "IMPORTANT POUR LES MATHÉMATIQUES ET SCIENCES :\n"
+               "Utilise TOUJOURS la notation LaTeX pour TOUTES les expressions mathématiques, "
+               "formules chimiques et symboles techniques.\n"
+               "Chaque expression DOIT être entourée de dollars :\n"
+               "- Un seul dollar pour le texte en ligne (ex: $x = 2$)\n"
+               "- Doubles dollars pour les blocs (ex: $$\\frac{1}{2}$$)\n"
+               "Ne JAMAIS écrire de symboles techniques ou formules sans ces délimiteurs."
+}
+
 class AIService:
-    def __init__(self):
-        self.api_key = os.getenv('GROQ_API_KEY')
-        self.client = None
-        if self.api_key:
-            # Masked logging for security
-            masked_key = f"{self.api_key[:6]}...{self.api_key[-4:]}" if len(self.api_key) > 10 else "***"
-            logger.info(f"GROQ_API_KEY found: {masked_key}")
+    def __init__(self, user=None):
+        # Shared per-process client: connections are pooled across requests
+        self.client = get_client()
+        # Calls are limited per user on top of the global limits
+        self.user_key = getattr(user, 'pk', None)
+
+    @property
+    def async_client(self):
+        """Shared async client of the running event loop (ASGI views)."""
+        return get_async_client()
+
+    def _create_completion(self, endpoint, route=None, **params):
+        """
+        Single entry point for every synchronous Groq call.
+        endpoint: feature name the call is recorded under in the usage ledger.
+        route: routing decision the call was made with, also recorded.
+        """
+        with limiter.acquire(self.user_key):
+            started = time.monotonic()
             try:
-                self.client = OpenAI(
-                    base_url="https://api.groq.com/openai/v1",
-                    api_key=self.api_key
-                )
-                logger.info("AIService initialized with Groq client.")
+                response = self._call_groq(**params)
+            except Exception as e:
+                # A call refused by an open circuit never reached Groq
+                if not isinstance(e, CircuitOpen):
+                    self._record_call(endpoint, params["model"], started, error=e, route=route)
+                raise
+            self._record_call(endpoint, params["model"], started, usage=response.usage, route=route)
+            return response
+
+    async def _acreate_completion(self, endpoint, route=None, **params):
+        """Single entry point for every asynchronous Groq call."""
+        async with limiter.aacquire(self.user_key):
+            started = time.monotonic()
+            try:
+                response = await self._acall_groq(**params)
             except Exception as e:
-                logger.error(f"Failed to initialize OpenAI client: {str(e)}")
+                # A call refused by an open circuit never reached Groq
+                if not isinstance(e, CircuitOpen):
+                    self._record_call(endpoint, params["model"], started, error=e, route=route)
+                raise
+            self._record_call(endpoint, params["model"], started, usage=response.usage, route=route)
+            return response
+
+    def _record_call(self, endpoint, model, started, usage=None, error=None, prompt_tokens=0, completion_tokens=0,
+                     route=None):
+        """Add a Groq call to the usage ledger (written in batches in the background)."""
+        latency_ms = (time.monotonic() - started) * 1000
+        if usage is not None:
+            prompt_tokens = usage.prompt_tokens or 0
+            completion_tokens = usage.completion_tokens or 0
+        metrics.observe(f'llm.{endpoint}.latency_ms', latency_ms)
+        if route is not None:
+            metrics.observe(f'routing.{route.name}.latency_ms', latency_ms)
+        metrics.incr('llm.prompt_tokens', prompt_tokens)
+        metrics.incr('llm.completion_tokens', completion_tokens)
+        if error is not None:
+            metrics.incr(f'llm.{endpoint}.errors')
+        usage_recorder.record(
+            user_id=self.user_key,
+            endpoint=endpoint,
+            model=model,
+            route=route.name if route is not None else '',
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency_ms=round(latency_ms),
+            success=error is None,
+            error=type(error).__name__[:60] if error is not None else '',
+        )
+
+    def _call_groq(self, **params):
+        """One Groq call, retried on transient errors until AI_CALL_DEADLINE."""
+        breaker = get_breaker(params["model"])
+        deadline = time.monotonic() + settings.AI_CALL_DEADLINE
+        attempt = 0
+        while True:
+            breaker.before_call()
+            try:
+                response = self.client.chat.completions.create(timeout=self._attempt_timeout(deadline), **params)
+            except Exception as e:
+                time.sleep(self._retry_delay_or_raise(breaker, e, attempt, deadline))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return response
+
+    async def _acall_groq(self, **params):
+        breaker = get_breaker(params["model"])
+        deadline = time.monotonic() + settings.AI_CALL_DEADLINE
+        attempt = 0
+        while True:
+            breaker.before_call()
+            try:
+                response = await self.async_client.chat.completions.create(timeout=self._attempt_timeout(deadline), **params)
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay_or_raise(breaker, e, attempt, deadline))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return response
+
+    def _attempt_timeout(self, deadline):
+        return max(1.0, min(settings.AI_CALL_TIMEOUT, deadline - time.monotonic()))
+
+    def _retry_delay_or_raise(self, breaker, error, attempt, deadline):
+        """Return the delay before the next attempt, or raise when the call has failed for good."""
+        if not is_retryable(error):
+            breaker.release()
+            raise error
+        breaker.record_failure()
+        delay = retry_delay(attempt, error)
+        if attempt < settings.AI_RETRY_ATTEMPTS and time.monotonic() + delay < deadline:
+            metrics.incr('llm.retries')
+            logger.warning(f"Groq call failed ({type(error).__name__}), retry {attempt + 1} in {delay:.1f} s")
+            return delay
+        if isinstance(error, openai.RateLimitError):
+            metrics.incr('limits.rejected.upstream')
+            raise RateLimited.from_response(error.response) from error
+        raise error
+
+    def _refused(self, error):
+        """Error result for a call refused by a limit (429) or an open circuit (503)."""
+        if isinstance(error, CircuitOpen):
+            logger.warning(f"AI call refused: {str(error)}")
+            retry_after = max(1, math.ceil(error.retry_after))
+            return {
+                "error": f"Le tuteur est momentanément indisponible, réessaie dans {retry_after} secondes.",
+                "retry_after": retry_after,
+                "unavailable": True,
+            }
+        logger.warning(f"AI call refused ({error.reason}), retry after {error.retry_after} s")
+        return {"error": str(error), "retry_after": error.retry_after}
+
+    def _chat_route(self, messages, level):
+        return router.route('chat', CHAT_MODEL, CHAT_MAX_TOKENS, messages=messages, level=level)
+
+    def _chat_models(self, route):
+        """The routed chat model followed by its fallback chain."""
+        return [route.model] + [model for model in settings.AI_CHAT_FALLBACK_MODELS if model != route.model]
+
+    def _can_fall_back(self, error, models, index):
+        if index == len(models) - 1:
+            return False
+        if isinstance(error, RateLimited):
+            # Groq quotas are per model; our own limits are not
+            can = error.reason == 'upstream'
         else:
-            logger.warning("GROQ_API_KEY not found in environment variables.")
+            can = isinstance(error, CircuitOpen) or is_retryable(error)
+        if can:
+            metrics.incr(f'llm.fallback.{models[index + 1]}')
+            logger.warning(f"Chat model {models[index]} failed ({type(error).__name__}), falling back to {models[index + 1]}")
+        return can
+
+    def _chat_completion(self, messages, route):
+        """Chat call walking the fallback chain; returns (response, model)."""
+        models = self._chat_models(route)
+        for index, model in enumerate(models):
+            try:
+                return self._create_completion('chat', route=route, **self._chat_params(messages, route, model=model)), model
+            except Exception as e:
+                if not self._can_fall_back(e, models, index):
+                    raise
+
+    async def _achat_completion(self, messages, route):
+        models = self._chat_models(route)
+        for index, model in enumerate(models):
+            try:
+                return await self._acreate_completion(
+                    'chat', route=route, **self._chat_params(messages, route, model=model)
+                ), model
+            except Exception as e:
+                if not self._can_fall_back(e, models, index):
+                    raise
+
+    async def _aopen_chat_stream(self, messages, route):
+        """Open a chat stream, falling back only while no token was sent."""
+        models = self._chat_models(route)
+        for index, model in enumerate(models):
+            started = time.monotonic()
+            try:
+                return await self._acall_groq(**self._chat_params(messages, route, stream=True, model=model)), model
+            except Exception as e:
+                if not isinstance(e, CircuitOpen):
+                    self._record_call('chat_stream', model, started, error=e, route=route)
+                if not self._can_fall_back(e, models, index):
+                    raise
 
-    def get_chat_response(self, messages):
+    def _prepare_chat_messages(self, messages, level=None, grounding=None):
+        """
+        Prepend the tutor persona unless the client already sent a system
+        message, then the lesson passages (see _lesson_grounding) if any.
+        """
+        if not messages or messages[0].get('role') != 'system':
+            system_message = SYSTEM_MESSAGE
+            if level:
+                level_label = dict(get_user_model().LEVEL_CHOICES).get(level, level)
+                system_message = {
+                    "role": "system",
+                    "content": f"{SYSTEM_MESSAGE['content']}\n\nNiveau de l'élève : {level_label}."
+                }
+            messages.insert(0, system_message)
+        if grounding:
+            position = next((i for i, m in enumerate(messages) if m.get('role') != 'system'), len(messages))
+            messages.insert(position, {"role": "system", "content": grounding})
+        return messages
+
+    def _lesson_grounding(self, messages, lesson_id):
+        """
+        System message text holding the passages of the lesson the student is
+        reading that are relevant to the last question; None without a lesson.
+        """
+        if not lesson_id or not settings.AI_LESSON_INDEX_ENABLED:
+            return None
+        query = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+        try:
+            info, passages = lesson_passages(lesson_id, query)
+        except Exception as e:
+            logger.warning(f"Lesson retrieval failed for lesson {lesson_id}: {str(e)}")
+            return None
+        if not passages:
+            return None
+        title, chapter = info
+        extracts = "\n".join(f"[{number}] {passage.text}" for number, passage in enumerate(passages, start=1))
+        return (
+            f"L'élève étudie la leçon « {title} » (chapitre « {chapter} »).\n"
+            f"Extraits de la leçon utiles pour la question :\n{extracts}\n\n"
+            "Appuie-toi sur ces extraits, reste dans le programme de la leçon et réponds de façon concise."
+        )
+
+    def _summarize_history(self, previous_summary, messages):
+        """Summarize folded chat turns with the small summary model."""
+        transcript = "\n".join(
+            f"{'Élève' if m.get('role') == 'user' else 'Tuteur'} : {m.get('content', '')}"
+            for m in messages if m.get('role') != 'system'
+        )
+        if previous_summary:
+            transcript = f"Résumé précédent :\n{previous_summary}\n\nSuite de la conversation :\n{transcript}"
+        try:
+            response = self._create_completion(
+                'summary',
+                model=settings.AI_CHAT_SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": "Résume cette conversation entre un élève et son tuteur en quelques phrases. "
+                                                  "Garde les notions abordées, les difficultés de l'élève et les questions restées ouvertes."},
+                    {"role": "user", "content": transcript}
+                ],
+                temperature=0.2,
+                max_tokens=settings.AI_CHAT_SUMMARY_MAX_TOKENS
+            )
+            metrics.incr('chat.summaries')
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.warning(f"Conversation summary failed, using extractive fallback: {str(e)}")
+            metrics.incr('chat.summary_errors')
+            return extractive_summary(previous_summary, messages)
+
+    def _fit_context(self, messages):
+        """Apply the per-request token budget to the conversation sent to Groq."""
+        window, info = window_messages(
+            messages,
+            budget=settings.AI_CHAT_TOKEN_BUDGET,
+            keep_turns=settings.AI_CHAT_KEEP_TURNS,
+            summarizer=RollingSummarizer(self._summarize_history)
+        )
+        if info['tokens_saved']:
+            metrics.incr('chat.context.tokens_saved', info['tokens_saved'])
+        return window, info
+
+    def _lookup_cache(self, messages, level, grounding=None):
+        """
+        Return (cache_key, cached_content). cache_key is None when the
+        conversation is not cacheable or the cache is disabled.
+        """
+        cache = get_chat_cache()
+        if cache is None or not cache.is_cacheable(messages):
+            return None, None
+        cache_key = cache.make_key(messages, SYSTEM_PROMPT_VERSION, level, grounding)
+        cached = cache.get(cache_key)
+        metrics.incr('chat.cache.hits' if cached is not None else 'chat.cache.misses')
+        return cache_key, cached
+
+    async def _alookup_cache(self, messages, level, grounding=None):
+        cache = get_chat_cache()
+        if cache is None or not cache.is_cacheable(messages):
+            return None, None
+        cache_key = cache.make_key(messages, SYSTEM_PROMPT_VERSION, level, grounding)
+        cached = await cache.aget(cache_key)
+        metrics.incr('chat.cache.hits' if cached is not None else 'chat.cache.misses')
+        return cache_key, cached
+
+    def _store_cache(self, cache_key, content):
+        cache = get_chat_cache()
+        if cache is not None and cache_key and content:
+            cache.set(cache_key, content)
+
+    async def _astore_cache(self, cache_key, content):
+        cache = get_chat_cache()
+        if cache is not None and cache_key and content:
+            await cache.aset(cache_key, content)
+
+    def _chat_params(self, messages, route, stream=False, model=None):
+        params = {
+            "model": model or route.model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": route.max_tokens or CHAT_MAX_TOKENS,
+        }
+        if stream:
+            params["stream"] = True
+            # Token usage arrives in the last chunk
+            params["stream_options"] = {"include_usage": True}
+        return params
+
+    def _chat_result(self, response, started, cache_key, context_info, model=CHAT_MODEL):
+        latency_ms = (time.monotonic() - started) * 1000
+        metrics.incr('chat.responses')
+        metrics.observe('chat.latency_ms', latency_ms)
+        logger.info(f"AI chat response in {latency_ms:.0f} ms")
+        return {
+            "content": response.choices[0].message.content,
+            "cache": "miss" if cache_key else "bypass",
+            "context": context_info,
+            "model": model,
+        }
+
+    def get_chat_response(self, messages, level=None, lesson=None):
         """
         Get a response from the AI tutor.
         messages: list of dictionary with 'role' and 'content'.
+        level: optional student level code, used in the prompt and the cache key.
+        lesson: optional id of the lesson the student is reading; its passages
+        relevant to the question are given to the model.
+        The result reports "cache": "hit", "miss" or "bypass".
         """
+        grounding = self._lesson_grounding(messages, lesson)
+        cache_key, cached = self._lookup_cache(messages, level, grounding)
+        if cached is not None:
+            return {"content": cached, "cache": "hit"}
+
         if not self.client:
             return {"error": "Groq API key not configured."}
 
+        started = time.monotonic()
         try:
-            # System prompt to set the persona
-            system_message = {
-                "role": "system",
-                "content": "Tu es un tuteur intelligent pour des élèves de primaire et collège. "
-                           "Tu es patient, encourageant et pédagogique. "
-                           "Tes réponses doivent être adaptées au niveau de l'élève. "
-                           "N'hésite pas à utiliser des émojis pour être plus convivial.\n\n"
-                           "IMPORTANT POUR LES MATHÉMATIQUES ET SCIENCES :\n"
-                           "Utilise TOUJOURS la notation LaTeX pour TOUTES les expressions mathématiques, "
-                           "formules chimiques et symboles techniques.\n"
-                           "Chaque expression DOIT être entourée de dollars :\n"
-                           "- Un seul dollar pour le texte en ligne (ex: $x = 2$)\n"
-                           "- Doubles dollars pour les blocs (ex: $$\\frac{1}{2}$$)\n"
-                           "Ne JAMAIS écrire de symboles techniques ou formules sans ces délimiteurs."
-            }
-            
-            # Prepend system message if not present (simple check)
-            if not messages or messages[0].get('role') != 'system':
-                messages.insert(0, system_message)
-
-            response = self.client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1024
+            messages, context_info = self._fit_context(self._prepare_chat_messages(messages, level, grounding))
+            route = self._chat_route(messages, level)
+            response, model = self._chat_completion(messages, route)
+            result = self._chat_result(response, started, cache_key, context_info, model)
+            if model == route.model:
+                # Fallback answers are not cached over the routed model's
+                self._store_cache(cache_key, result["content"])
+            return result
+        except (RateLimited, CircuitOpen) as e:
+            return self._refused(e)
+        except Exception as e:
+            metrics.incr('chat.errors')
+            return {"error": str(e)}
+
+    async def aget_chat_response(self, messages, level=None, lesson=None):
+        """Async counterpart of get_chat_response, used by the ASGI views."""
+        grounding = await sync_to_async(self._lesson_grounding)(messages, lesson) if lesson else None
+        cache_key, cached = await self._alookup_cache(messages, level, grounding)
+        if cached is not None:
+            return {"content": cached, "cache": "hit"}
+
+        if not self.async_client:
+            return {"error": "Groq API key not configured."}
+
+        started = time.monotonic()
+        try:
+            # Summarizing folded turns is a rare, cached sync call: keep it off the event loop
+            messages, context_info = await sync_to_async(self._fit_context, thread_sensitive=False)(
+                self._prepare_chat_messages(messages, level, grounding)
             )
-            return {"content": response.choices[0].message.content}
+            route = self._chat_route(messages, level)
+            response, model = await self._achat_completion(messages, route)
+            result = self._chat_result(response, started, cache_key, context_info, model)
+            if model == route.model:
+                await self._astore_cache(cache_key, result["content"])
+            return result
+        except (RateLimited, CircuitOpen) as e:
+            return self._refused(e)
         except Exception as e:
+            metrics.incr('chat.errors')
             return {"error": str(e)}
 
-    def generate_exercise(self, subject, level, topic, difficulty='medium', exercise_type='qcm', language='fr'):
+    async def astream_chat_response(self, messages, level=None, lesson=None):
         """
-        Generate a new exercise based on criteria.
-        Returns a JSON object compatible with the Exercise model.
+        Stream a response from the AI tutor as it is generated.
+        Yields events: {'type': 'delta', 'content': ...} for each chunk, then a
+        final {'type': 'done', 'ttft_ms': ..., 'latency_ms': ..., 'cache': ...}
+        or {'type': 'error', 'error': ...}.
         """
-        if not self.client:
-            return {"error": "Groq API key not configured."}
+        grounding = await sync_to_async(self._lesson_grounding)(messages, lesson) if lesson else None
+        cache_key, cached = await self._alookup_cache(messages, level, grounding)
+        if cached is not None:
+            yield {"type": "delta", "content": cached}
+            yield {"type": "done", "ttft_ms": 0, "latency_ms": 0, "cache": "hit"}
+            return
+
+        if not self.async_client:
+            yield {"type": "error", "error": "Groq API key not configured."}
+            return
+
+        started = time.monotonic()
+        ttft_ms = None
+        parts = []
+        try:
+            messages, context_info = await sync_to_async(self._fit_context, thread_sensitive=False)(
+                self._prepare_chat_messages(messages, level, grounding)
+            )
+            route = self._chat_route(messages, level)
+            # The in-flight slot is held until the whole answer is streamed
+            async with limiter.aacquire(self.user_key):
+                call_started = time.monotonic()
+                stream, model = await self._aopen_chat_stream(messages, route)
+                usage = None
+                try:
+                    async for chunk in stream:
+                        usage = getattr(chunk, 'usage', None) or usage
+                        if not chunk.choices:
+                            continue
+                        content = chunk.choices[0].delta.content
+                        if not content:
+                            continue
+                        if ttft_ms is None:
+                            ttft_ms = (time.monotonic() - started) * 1000
+                            metrics.observe('chat.stream.ttft_ms', ttft_ms)
+                        parts.append(content)
+                        yield {"type": "delta", "content": content}
+                except Exception as e:
+                    self._record_call('chat_stream', model, call_started, error=e, route=route)
+                    raise
+                # Estimate the tokens when the stream did not report its usage
+                self._record_call(
+                    'chat_stream', model, call_started, usage=usage,
+                    prompt_tokens=count_tokens(messages),
+                    completion_tokens=estimate_tokens(''.join(parts)),
+                    route=route
+                )
+        except (RateLimited, CircuitOpen) as e:
+            yield {"type": "error", **self._refused(e)}
+            return
+        except Exception as e:
+            metrics.incr('chat.stream.errors')
+            logger.error(f"AI chat stream failed: {str(e)}")
+            yield {"type": "error", "error": str(e)}
+            return
 
+        latency_ms = (time.monotonic() - started) * 1000
+        metrics.incr('chat.stream.responses')
+        metrics.observe('chat.stream.latency_ms', latency_ms)
+        logger.info(f"AI chat stream done: ttft={ttft_ms or 0:.0f} ms, total={latency_ms:.0f} ms")
+        if model == route.model:
+            await self._astore_cache(cache_key, ''.join(parts))
+        yield {
+            "type": "done",
+            "model": model,
+            "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+            "latency_ms": round(latency_ms, 1),
+            "cache": "miss" if cache_key else "bypass",
+            "context": context_info,
+        }
+
+    def _exercise_params(self, subject, level, topic, difficulty, exercise_type, language, count=1):
+        """
+        Build the Groq request parameters for an exercise generation.
+        With count > 1 the answer is {"exercises": [...]} holding count exercises.
+        """
         subject_lower = subject.lower()
         # Define format instructions based on exercise type
         if exercise_type == 'qcm':
@@ -119,15 +561,9 @@ class AIService:
             
         diff_label = difficulty_map.get(difficulty, difficulty)
 
-        print(f"DEBUG: Generating exercise with type={exercise_type}, difficulty={diff_label}, language={language}")
+        logger.debug(f"Generating exercise with type={exercise_type}, difficulty={diff_label}, language={language}")
 
-        prompt = (
-            f"Génère un exercice de {subject} pour un niveau {level} sur le thème '{topic}'.\n"
-            f"Difficulté: {diff_label}.\n"
-            f"Type: {exercise_type}.\n"
-            f"{language_instruction}\n"
-            f"{math_instruction}\n\n"
-            "Tu DOIS répondre avec un JSON valide respectant cette structure exacte :\n"
+        exercise_schema = (
             "{\n"
             "  \"title\": \"Titre de l'exercice\",\n"
             "  \"description\": \"Brève description ou consigne\",\n"
@@ -138,23 +574,204 @@ class AIService:
             "  \"explanation\": \"Explication pédagogique\",\n"
             "  \"hints\": [\"Indice 1\", \"Indice 2\"],\n"
             "  \"points\": 10\n"
-            "}\n\n"
+            "}"
+        )
+        if count == 1:
+            request_line = f"Génère un exercice de {subject} pour un niveau {level} sur le thème '{topic}'.\n"
+            structure = exercise_schema
+        else:
+            # One call for the whole worksheet: the long instructions are sent once
+            request_line = f"Génère {count} exercices différents de {subject} pour un niveau {level} sur le thème '{topic}'.\n"
+            structure = (
+                "{\n  \"exercises\": [\n" + textwrap.indent(exercise_schema, "    ") + "\n  ]\n}\n"
+                f"La liste 'exercises' DOIT contenir EXACTEMENT {count} exercices, chacun avec des questions différentes."
+            )
+
+        prompt = (
+            request_line +
+            f"Difficulté: {diff_label}.\n"
+            f"Type: {exercise_type}.\n"
+            f"{language_instruction}\n"
+            f"{math_instruction}\n\n"
+            "Tu DOIS répondre avec un JSON valide respectant cette structure exacte :\n" +
+            structure + "\n\n"
             "Format spécifique pour 'content' :\n"
             f"{format_instructions}\n"
             "Réponds UNIQUEMENT avec le JSON, pas de texte superflu."
         )
 
+        return {
+            "model": CHAT_MODEL,
+            "messages": [
+                {"role": "system", "content": "Tu es un générateur d'exercices scolaires. Tu réponds uniquement en JSON valide."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.7,
+            "response_format": {"type": "json_object"},
+        }
+
+    def _exercise_route(self, task, params, subject=None, level=None):
+        """Route a generation call and set the chosen model on its parameters."""
+        route = router.route(task, CHAT_MODEL, messages=params["messages"], subject=subject, level=level)
+        route.apply(params)
+        return route
+
+    def _check_generated(self, exercise_data, exercise_type, difficulty):
+        result = check_exercise(exercise_data, exercise_type, difficulty)
+        if result.repairs:
+            metrics.incr('exercise_validation.repaired')
+            logger.info(f"Generated exercise repaired locally: {'; '.join(result.repairs)}")
+        if result.ok:
+            metrics.incr('exercise_validation.valid')
+        else:
+            logger.warning(f"Generated exercise invalid, re-prompting {result.failing_fields}: "
+                           f"{'; '.join(str(p) for p in result.problems)}")
+        return result
+
+    def _repair_params(self, result, exercise_type):
+        """Ask the LLM again for the failing fields only, not the whole exercise."""
+        fields = result.failing_fields
+        if 'content' in fields and 'correct_answers' not in fields:
+            # Answers must follow the new questions
+            fields.append('correct_answers')
+        problems = "\n".join(f"- {problem}" for problem in result.problems)
+        example = ", ".join(f'"{field}": ...' for field in fields)
+        prompt = (
+            f"Voici un exercice de type '{exercise_type}' au format JSON :\n"
+            f"{json.dumps(result.data, ensure_ascii=False)}\n\n"
+            f"Ces champs sont invalides :\n{problems}\n\n"
+            f"Corrige UNIQUEMENT les champs {', '.join(fields)} en gardant le reste de l'exercice cohérent. "
+            "Toute expression mathématique doit être entourée de $.\n"
+            f"Réponds UNIQUEMENT avec un JSON ne contenant que ces champs : {{{example}}}"
+        )
+        return fields, {
+            "model": CHAT_MODEL,
+            "messages": [
+                {"role": "system", "content": "Tu corriges des exercices scolaires générés. Tu réponds uniquement en JSON valide."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.2,
+            "response_format": {"type": "json_object"},
+        }
+
+    def _merge_repair(self, result, fields, fixed, exercise_type, difficulty):
+        exercise_data = dict(result.data)
+        if isinstance(fixed, dict):
+            exercise_data.update({field: fixed[field] for field in fields if field in fixed})
+        second = check_exercise(exercise_data, exercise_type, difficulty)
+        if second.ok:
+            metrics.incr('exercise_validation.reprompted')
+            return second.data
+        metrics.incr('exercise_validation.rejected')
+        return {"error": "Generated exercise is invalid: " + "; ".join(str(p) for p in second.problems)}
+
+    def _validated_exercise(self, exercise_data, exercise_type, difficulty):
+        """Validate and repair a generated exercise: locally first, then by re-prompting the failing fields."""
+        result = self._check_generated(exercise_data, exercise_type, difficulty)
+        if result.ok:
+            return result.data
+        fields, params = self._repair_params(result, exercise_type)
+        route = self._exercise_route('exercise_repair', params)
         try:
-            response = self.client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {"role": "system", "content": "Tu es un générateur d'exercices scolaires. Tu réponds uniquement en JSON valide."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
+            response = self._create_completion('exercise_repair', route=route, **params)
+            fixed = json.loads(response.choices[0].message.content)
+        except (RateLimited, CircuitOpen) as e:
+            return self._refused(e)
+        except Exception as e:
+            return {"error": f"Error repairing exercise: {str(e)}"}
+        return self._merge_repair(result, fields, fixed, exercise_type, difficulty)
+
+    async def _avalidated_exercise(self, exercise_data, exercise_type, difficulty):
+        result = self._check_generated(exercise_data, exercise_type, difficulty)
+        if result.ok:
+            return result.data
+        fields, params = self._repair_params(result, exercise_type)
+        route = self._exercise_route('exercise_repair', params)
+        try:
+            response = await self._acreate_completion('exercise_repair', route=route, **params)
+            fixed = json.loads(response.choices[0].message.content)
+        except (RateLimited, CircuitOpen) as e:
+            return self._refused(e)
+        except Exception as e:
+            return {"error": f"Error repairing exercise: {str(e)}"}
+        return self._merge_repair(result, fields, fixed, exercise_type, difficulty)
+
+    def generate_exercise(self, subject, level, topic, difficulty='medium', exercise_type='qcm', language='fr'):
+        """
+        Generate a new exercise based on criteria.
+        Returns a JSON object compatible with the Exercise model.
+        """
+        if not self.client:
+            return {"error": "Groq API key not configured."}
+
+        try:
+            params = self._exercise_params(subject, level, topic, difficulty, exercise_type, language)
+            route = self._exercise_route('exercise', params, subject, level)
+            response = self._create_completion('exercise', route=route, **params)
             content = response.choices[0].message.content
-            return json.loads(content)
+            exercise_data = json.loads(content)
+        except (RateLimited, CircuitOpen) as e:
+            return self._refused(e)
         except Exception as e:
             return {"error": f"Error generating exercise: {str(e)}"}
+        return self._validated_exercise(exercise_data, exercise_type, difficulty)
+
+    async def agenerate_exercise(self, subject, level, topic, difficulty='medium', exercise_type='qcm', language='fr'):
+        """Async counterpart of generate_exercise, used by the ASGI views."""
+        if not self.async_client:
+            return {"error": "Groq API key not configured."}
+
+        try:
+            params = self._exercise_params(subject, level, topic, difficulty, exercise_type, language)
+            route = self._exercise_route('exercise', params, subject, level)
+            response = await self._acreate_completion('exercise', route=route, **params)
+            content = response.choices[0].message.content
+            exercise_data = json.loads(content)
+        except (RateLimited, CircuitOpen) as e:
+            return self._refused(e)
+        except Exception as e:
+            return {"error": f"Error generating exercise: {str(e)}"}
+        return await self._avalidated_exercise(exercise_data, exercise_type, difficulty)
+
+    async def agenerate_exercises(self, subject, level, topic, count, difficulty='medium', exercise_type='qcm', language='fr'):
+        """
+        Generate a worksheet of ``count`` exercises, several per Groq call
+        (AI_EXERCISE_BATCH_PER_CALL), the calls running concurrently.
+        Returns {"exercises": [...], "errors": [...]} where errors lists the
+        calls that failed, or {"error": ...} when every call failed.
+        Exercises are validated and repaired like in generate_exercise; those
+        still invalid are {"error": ...} items.
+        """
+        if not self.async_client:
+            return {"error": "Groq API key not configured."}
+
+        per_call = max(1, settings.AI_EXERCISE_BATCH_PER_CALL)
+        sizes = [min(per_call, count - start) for start in range(0, count, per_call)]
+
+        async def generate_chunk(size):
+            try:
+                params = self._exercise_params(subject, level, topic, difficulty, exercise_type, language, count=size)
+                route = self._exercise_route('exercise_batch', params, subject, level)
+                response = await self._acreate_completion('exercise_batch', route=route, **params)
+                data = json.loads(response.choices[0].message.content)
+                exercises = data.get('exercises') if isinstance(data, dict) else data
+                if not isinstance(exercises, list):
+                    return {"error": "Error generating exercises: no 'exercises' list in the answer"}
+                return {"exercises": exercises[:size]}
+            except (RateLimited, CircuitOpen) as e:
+                return self._refused(e)
+            except Exception as e:
+                return {"error": f"Error generating exercises: {str(e)}"}
+
+        results = await asyncio.gather(*(generate_chunk(size) for size in sizes))
+        failed = [result for result in results if "error" in result]
+        if len(failed) == len(results):
+            return failed[0]
+        exercises = await asyncio.gather(*(
+            self._avalidated_exercise(exercise_data, exercise_type, difficulty)
+            for result in results for exercise_data in result.get("exercises", [])
+        ))
+        return {
+            "exercises": list(exercises),
+            "errors": [result["error"] for result in failed],
+        }
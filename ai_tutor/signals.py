@@ -0,0 +1,44 @@
+"""
+Keep the lesson index of this process in sync with lesson edits.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from lessons.models import Chapter, Lesson
+from .retrieval import current_lesson_index
+
+
+@receiver(post_save, sender=Lesson)
+def reindex_lesson(sender, instance, **kwargs):
+    index = current_lesson_index()
+    if index is None:
+        return
+
+    def update():
+        if instance.is_active:
+            index.index_lesson(Lesson.objects.select_related('chapter').get(pk=instance.pk))
+        else:
+            index.remove_lesson(instance.pk)
+
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Lesson)
+def unindex_lesson(sender, instance, **kwargs):
+    index = current_lesson_index()
+    if index is not None:
+        index.remove_lesson(instance.pk)
+
+
+@receiver(post_save, sender=Chapter)
+def reindex_chapter_lessons(sender, instance, created, **kwargs):
+    # Chapter titles are indexed with every passage of their lessons
+    index = current_lesson_index()
+    if index is None or created:
+        return
+
+    def update():
+        for lesson in instance.lessons.filter(is_active=True).select_related('chapter'):
+            index.index_lesson(lesson)
+
+    transaction.on_commit(update)
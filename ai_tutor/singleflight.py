@@ -0,0 +1,110 @@
+"""
+Single-flight coalescing of identical expensive calls.
+
+Concurrent calls sharing a key wait for one leader instead of each hitting
+the LLM. Inside a worker the followers await the leader's future; across
+workers the leader holds a lock in the Django cache (``cache.aadd``) and
+publishes its result there for a short time, while followers poll for it. Cross-worker
+coalescing therefore needs a shared cache backend (database, Redis...);
+with the default local-memory cache it only works within a process.
+The callers are async views, so ``ado`` takes a coroutine function.
+"""
+import time
+import asyncio
+import uuid
+import hashlib
+import logging
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class SingleFlight:
+    """Run ``fn`` once per key among concurrent callers and share its result."""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self._calls = {}
+
+    @property
+    def cache(self):
+        return caches[settings.AI_SINGLEFLIGHT_CACHE_ALIAS]
+
+    def make_key(self, *parts):
+        raw = '|'.join(str(part) for part in parts)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def ado(self, key, fn):
+        """
+        Await ``fn`` (a coroutine function) once per key; return (result,
+        coalesced) where coalesced is True for followers.
+        """
+        loop = asyncio.get_running_loop()
+        future = self._calls.get(key)
+        if future is not None and future.get_loop() is loop and not future.done():
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), settings.AI_SINGLEFLIGHT_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                result = _MISSING
+            metrics.observe(f'singleflight.{self.namespace}.wait_ms', (time.monotonic() - started) * 1000)
+            if result is not _MISSING:
+                metrics.incr(f'singleflight.{self.namespace}.coalesced_local')
+                return result, True
+            metrics.incr(f'singleflight.{self.namespace}.fallbacks')
+            return await fn(), False
+
+        future = loop.create_future()
+        self._calls[key] = future
+        result = _MISSING
+        try:
+            result, coalesced = await self._ado_across_workers(key, fn)
+            return result, coalesced
+        finally:
+            # Followers fall back to their own call when the leader failed
+            future.set_result(result)
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    async def _ado_across_workers(self, key, fn):
+        cache = self.cache
+        lock_key = f'sf:{self.namespace}:lock:{key}'
+        result_key = f'sf:{self.namespace}:result:{key}'
+        token = uuid.uuid4().hex
+
+        if await cache.aadd(lock_key, token, settings.AI_SINGLEFLIGHT_LOCK_TIMEOUT):
+            metrics.incr(f'singleflight.{self.namespace}.leaders')
+            try:
+                result = await fn()
+                await cache.aset(result_key, result, settings.AI_SINGLEFLIGHT_RESULT_TTL)
+                return result, False
+            finally:
+                if await cache.aget(lock_key) == token:
+                    await cache.adelete(lock_key)
+
+        started = time.monotonic()
+        deadline = started + settings.AI_SINGLEFLIGHT_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            result = await cache.aget(result_key, _MISSING)
+            if result is not _MISSING:
+                metrics.incr(f'singleflight.{self.namespace}.coalesced_remote')
+                metrics.observe(f'singleflight.{self.namespace}.wait_ms', (time.monotonic() - started) * 1000)
+                return result, True
+            if await cache.aget(lock_key) is None:
+                result = await cache.aget(result_key, _MISSING)
+                if result is not _MISSING:
+                    metrics.incr(f'singleflight.{self.namespace}.coalesced_remote')
+                    return result, True
+                break
+            await asyncio.sleep(settings.AI_SINGLEFLIGHT_POLL_INTERVAL)
+
+        logger.warning(f"Single-flight leader for {self.namespace} gave no result, running the call locally")
+        metrics.incr(f'singleflight.{self.namespace}.fallbacks')
+        return await fn(), False
+
+
+exercise_generation = SingleFlight('generate_exercise')
@@ -0,0 +1,162 @@
+"""
+Stock of pre-generated AI exercises.
+
+The refill worker (``manage.py refill_exercise_stock``) keeps a few validated
+exercises per popular (subject, level, difficulty, exercise_type, language,
+topic) slot, so GenerateExerciseView can claim one in a couple of queries and
+only falls back to a live LLM call when the slot is empty.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from lessons.models import Lesson
+from .generation import build_exercise
+from .metrics import metrics
+from .models import ExerciseStockItem, ExerciseStockDemand
+from .utils import fold_text
+
+logger = logging.getLogger(__name__)
+
+SLOT_FIELDS = ('subject_id', 'level', 'difficulty', 'exercise_type', 'language', 'topic_key')
+
+
+def slot_key(subject, level, difficulty, exercise_type, language, topic):
+    return {
+        'subject': subject,
+        'level': level,
+        'difficulty': difficulty,
+        'exercise_type': exercise_type,
+        'language': language,
+        'topic_key': fold_text(topic)[:200],
+    }
+
+
+def record_demand(subject, level, difficulty, exercise_type, language, topic):
+    """Count a generation request for its slot; popular slots get stocked."""
+    key = slot_key(subject, level, difficulty, exercise_type, language, topic)
+    now = timezone.now()
+    if ExerciseStockDemand.objects.filter(**key).update(requests=F('requests') + 1, last_requested_at=now):
+        return
+    try:
+        with transaction.atomic():
+            ExerciseStockDemand.objects.create(topic=topic[:200], requests=1, **key)
+    except IntegrityError:
+        # Created concurrently by another request
+        ExerciseStockDemand.objects.filter(**key).update(requests=F('requests') + 1, last_requested_at=now)
+
+
+def claim_exercise(user, subject, level, difficulty, exercise_type, language, topic):
+    """
+    Atomically take one stocked exercise for the slot and save it as an
+    Exercise owned by ``user``. Returns None when the slot is empty.
+    """
+    key = slot_key(subject, level, difficulty, exercise_type, language, topic)
+    for _ in range(3):
+        with transaction.atomic():
+            candidates = ExerciseStockItem.objects.filter(**key).order_by('created_at')
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            item = candidates.first()
+            if item is None:
+                break
+            # The delete doubles as the claim on databases without row locks (SQLite)
+            deleted, _ = ExerciseStockItem.objects.filter(pk=item.pk).delete()
+            if not deleted:
+                continue
+            exercise = build_exercise(item.payload, subject, level, exercise_type, difficulty, creator=user)
+            exercise.save()
+        ExerciseStockDemand.objects.filter(**key).update(stock_hits=F('stock_hits') + 1)
+        metrics.incr('exercise_stock.hits')
+        return exercise
+    metrics.incr('exercise_stock.misses')
+    return None
+
+
+def stock_counts():
+    """Return {slot tuple: number of stocked exercises}."""
+    rows = ExerciseStockItem.objects.values(*SLOT_FIELDS).annotate(count=Count('id'))
+    return {tuple(row[f] for f in SLOT_FIELDS): row['count'] for row in rows}
+
+
+def popular_slots():
+    """Slots worth stocking: the most requested ones over the recent demand window."""
+    since = timezone.now() - timedelta(days=settings.AI_EXERCISE_STOCK_DEMAND_DAYS)
+    return list(
+        ExerciseStockDemand.objects.filter(
+            last_requested_at__gte=since,
+            requests__gte=settings.AI_EXERCISE_STOCK_MIN_REQUESTS,
+            subject__is_active=True
+        ).select_related('subject').order_by('-requests')[:settings.AI_EXERCISE_STOCK_MAX_SLOTS]
+    )
+
+
+def _demand_slot(demand):
+    return tuple(getattr(demand, f) for f in SLOT_FIELDS)
+
+
+def refill_stock(ai_service, max_generations=None, log=logger.info):
+    """
+    Generate exercises for popular slots below AI_EXERCISE_STOCK_TARGET.
+    Returns the number of exercises added to the stock.
+    """
+    target = settings.AI_EXERCISE_STOCK_TARGET
+    counts = stock_counts()
+    level_labels = dict(Lesson.LEVEL_CHOICES)
+    added = 0
+    for demand in popular_slots():
+        missing = target - counts.get(_demand_slot(demand), 0)
+        for _ in range(max(0, missing)):
+            if max_generations is not None and added >= max_generations:
+                return added
+            exercise_data = ai_service.generate_exercise(
+                demand.subject.name,
+                level_labels.get(demand.level, demand.level),
+                demand.topic,
+                demand.difficulty,
+                demand.exercise_type,
+                demand.language
+            )
+            if "error" in exercise_data:
+                log(f"Generation failed for '{demand.topic}': {exercise_data['error']}")
+                metrics.incr('exercise_stock.refill_errors')
+                break
+            ExerciseStockItem.objects.create(
+                subject=demand.subject,
+                level=demand.level,
+                difficulty=demand.difficulty,
+                exercise_type=demand.exercise_type,
+                language=demand.language,
+                topic=demand.topic,
+                topic_key=demand.topic_key,
+                payload=exercise_data
+            )
+            added += 1
+            metrics.incr('exercise_stock.refilled')
+    return added
+
+
+def fill_report():
+    """Fill level of every popular slot, emptiest first."""
+    target = settings.AI_EXERCISE_STOCK_TARGET
+    counts = stock_counts()
+    rows = []
+    for demand in popular_slots():
+        in_stock = counts.get(_demand_slot(demand), 0)
+        rows.append({
+            'subject': demand.subject.name,
+            'level': demand.level,
+            'difficulty': demand.difficulty,
+            'exercise_type': demand.exercise_type,
+            'language': demand.language,
+            'topic': demand.topic,
+            'requests': demand.requests,
+            'stock_hits': demand.stock_hits,
+            'in_stock': in_stock,
+            'target': target,
+            'fill_percent': int(min(in_stock, target) * 100 / target) if target else 100,
+        })
+    rows.sort(key=lambda row: (row['fill_percent'], -row['requests']))
+    return rows
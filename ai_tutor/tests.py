@@ -1,3 +1,1239 @@
-from django.test import TestCase
+import os
+import json
+import httpx
+import pickle
+import asyncio
+import datetime
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import mock
+from decimal import Decimal
+from pathlib import Path
+from openai import APIStatusError, OpenAI
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, SimpleTestCase, TestCase, modify_settings, override_settings
+from django.utils import timezone
+from django.db.models import QuerySet
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, connection
+from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
+from lessons.models import Subject
+from exercises.models import Exercise
+from . import client as groq_client
+from .services import AIService
+from .generation import build_exercise, save_exercises
+from .metrics import MetricsRegistry, metrics
+from .async_api import _sse_event
+from .cache import ChatResponseCache, MemoryCacheBackend
+from .conversation import SUMMARY_PREFIX, count_tokens, window_messages
+from .jobs import HANDLERS, JobFailed, RetryJob, claim_job, enqueue, requeue_stale_jobs, run_job
+from .limits import ConcurrencyLimiter, RateLimited, TokenBucket, limiter
+from .models import ExerciseStockDemand, ExerciseStockItem, Job, LLMCallRecord, LLMUsageDaily
+from .resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from .retrieval import LessonIndex, split_passages, tokenize
+from .routing import ModelRouter, level_rank
+from .validation import balance_latex, check_exercise
+from .stock import claim_exercise, record_demand, refill_stock
+from .singleflight import SingleFlight
+from .usage import UsageRecorder, call_cost, rollup_day
+from .fake_llm import FakeLLMServer, FixtureStore
 
-# Create your tests here.
+
+def chunk(content):
+    """Streamed completion chunk carrying ``content``."""
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+async def sse_events(response):
+    """Decode the (type, data) pairs of a Server-Sent Events response."""
+    events = []
+    content = b''.join([part async for part in response])
+    for frame in content.decode('utf-8').split('\n\n'):
+        if frame:
+            event, data = frame.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+async def stream_of(chunks):
+    for item in chunks:
+        yield item
+
+
+def completion(content):
+    """Non-streamed completion answering ``content``."""
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=120, completion_tokens=30)
+    )
+
+
+@override_settings(AI_CHAT_CACHE_ENABLED=False)
+class ChatStreamTests(TestCase):
+    """Chat answers streamed as Server-Sent Events, with the time to first token measured."""
+
+    def setUp(self):
+        metrics.reset()
+        limiter.reset()
+        self.user = get_user_model().objects.create_user('eleve', password='x')
+        self.client = AsyncClient()
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        self.groq = mock.Mock()
+        self.groq.chat.completions.create = mock.AsyncMock()
+        for patcher in (mock.patch('ai_tutor.services.get_async_client', return_value=self.groq),
+                        mock.patch('ai_tutor.client.logger'),
+                        mock.patch('ai_tutor.routing.logger'),
+                        mock.patch('ai_tutor.services.logger')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('ai_tutor.services.usage_recorder')
+        self.usage_recorder = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def answer_with(self, *chunks):
+        self.groq.chat.completions.create.return_value = stream_of(chunks)
+
+    def stream(self, url='/api/ai/chat/stream/', **data):
+        data = {'messages': [{'role': 'user', 'content': 'Bonjour'}], **data}
+        return self.client.post(url, data, content_type='application/json', headers=self.headers)
+
+    def test_sse_framing(self):
+        self.assertEqual(
+            _sse_event({'type': 'delta', 'content': 'Très bien'}),
+            'event: delta\ndata: {"type": "delta", "content": "Très bien"}\n\n'
+        )
+
+    async def test_deltas_then_done_with_ttft(self):
+        self.answer_with(chunk(''), chunk('Bon'), SimpleNamespace(choices=[]), chunk('jour !'))
+        response = await self.stream()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual((response['Cache-Control'], response['X-Accel-Buffering']), ('no-cache', 'no'))
+        events = await sse_events(response)
+        self.assertEqual([data['content'] for event, data in events if event == 'delta'], ['Bon', 'jour !'])
+        event, done = events[-1]
+        self.assertEqual(event, 'done')
+        self.assertGreaterEqual(done['latency_ms'], done['ttft_ms'])
+        self.assertTrue(self.groq.chat.completions.create.call_args.kwargs['stream'])
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['timings']['chat.stream.ttft_ms']['count'], 1)
+        self.assertEqual(snapshot['counters']['chat.stream.responses'], 1)
+
+    async def test_stream_flag_on_chat(self):
+        self.answer_with(chunk('Salut'))
+        events = await sse_events(await self.stream('/api/ai/chat/', stream=True))
+        self.assertEqual([event for event, data in events], ['delta', 'done'])
+
+    async def test_failure_ends_the_stream_with_an_error_event(self):
+        self.groq.chat.completions.create.side_effect = RuntimeError('Groq en panne')
+        events = await sse_events(await self.stream())
+        self.assertEqual(events, [('error', {'type': 'error', 'error': 'Groq en panne'})])
+        self.assertEqual(metrics.snapshot()['counters']['chat.stream.errors'], 1)
+        self.assertNotIn('chat.stream.ttft_ms', metrics.snapshot()['timings'])
+
+    def test_metrics_for_admins_only(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(client.get('/api/ai/metrics/').status_code, 403)
+        client.force_authenticate(get_user_model().objects.create_user('admin', password='x', is_staff=True))
+        self.assertIn('timings', client.get('/api/ai/metrics/').data)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+
+    def test_timing_percentiles(self):
+        registry = MetricsRegistry()
+        for value in range(1, 101):
+            registry.observe('latency', value)
+        registry.incr('calls', 2)
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters'], {'calls': 2})
+        self.assertEqual(
+            snapshot['timings']['latency'],
+            {'count': 100, 'avg_ms': 50.5, 'p50_ms': 51, 'p95_ms': 95, 'max_ms': 100}
+        )
+        registry.reset()
+        self.assertEqual(registry.snapshot(), {'counters': {}, 'gauges': {}, 'timings': {}})
+
+
+class SharedClientTests(SimpleTestCase):
+    """One pooled Groq client per process, counting new and reused connections."""
+
+    def setUp(self):
+        metrics.reset()
+        groq_client.reset_client()
+        self.addCleanup(groq_client.reset_client)
+        for patcher in (mock.patch.dict(os.environ, GROQ_API_KEY='test-key'),
+                        mock.patch('ai_tutor.client.logger')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_one_client_per_process(self):
+        client = groq_client.get_client()
+        self.assertIs(groq_client.get_client(), client)
+        self.assertIs(AIService().client, client)
+        self.assertEqual(metrics.snapshot()['counters']['http.clients.created'], 1)
+
+    def test_rebuilt_in_a_forked_worker(self):
+        client = groq_client.get_client()
+        with mock.patch('ai_tutor.client.os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(groq_client.get_client(), client)
+        self.assertEqual(metrics.snapshot()['counters']['http.clients.created'], 2)
+
+    def test_no_client_without_api_key(self):
+        with mock.patch.dict(os.environ, GROQ_API_KEY=''):
+            self.assertIsNone(groq_client.get_client())
+        self.assertNotIn('http.clients.created', metrics.snapshot()['counters'])
+
+    def test_new_and_reused_connections_counted(self):
+        for new_connection in (True, False, False):
+            request = httpx.Request('POST', 'https://api.groq.com/openai/v1/chat/completions')
+            groq_client._on_request(request)
+            if new_connection:
+                request.extensions['trace']('connection.connect_tcp.complete', {})
+            groq_client._on_response(httpx.Response(200, request=request))
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(
+            (counters['http.requests'], counters['http.connections.new'], counters['http.connections.reused']),
+            (3, 1, 2)
+        )
+
+
+class ChatResponseCacheTests(SimpleTestCase):
+    """Cache keys fold case, accents and whitespace but keep level, passages and prompt version apart."""
+
+    def setUp(self):
+        self.cache = ChatResponseCache(MemoryCacheBackend(max_entries=2), ttl=60, max_turns=2)
+
+    def key(self, content, **kwargs):
+        kwargs.setdefault('prompt_version', 'v1')
+        return self.cache.make_key([{'role': 'user', 'content': content}], **kwargs)
+
+    def test_key_folds_case_accents_and_whitespace(self):
+        self.assertEqual(
+            self.key("Qu'est-ce qu'une fraction ?", level='cm2'),
+            self.key("  qu'est-ce   qu'une FRACTION ? ", level='cm2')
+        )
+        self.assertEqual(self.key("C'est quoi un périmètre"), self.key("c'est quoi un perimetre"))
+
+    def test_key_depends_on_level_context_and_prompt_version(self):
+        base = self.key('Une fraction ?', level='cm2')
+        self.assertNotEqual(base, self.key('Une fraction ?', level='sixieme'))
+        self.assertNotEqual(base, self.key('Une fraction ?', level='cm2', context=[1, 2]))
+        self.assertNotEqual(base, self.key('Une fraction ?', level='cm2', prompt_version='v2'))
+
+    def test_only_short_conversations_ending_with_a_question(self):
+        question = {'role': 'user', 'content': 'Une fraction ?'}
+        answer = {'role': 'assistant', 'content': 'Une partie d’un tout.'}
+        self.assertTrue(self.cache.is_cacheable([question]))
+        self.assertFalse(self.cache.is_cacheable([question, answer]))
+        self.assertFalse(self.cache.is_cacheable([question, answer, question, answer, question]))
+
+    def test_memory_backend_evicts_least_recently_used_and_expired(self):
+        backend = self.cache.backend
+        backend.set('a', 1, 60)
+        backend.set('b', 2, 60)
+        backend.get('a')
+        backend.set('c', 3, 60)
+        self.assertEqual((backend.get('a'), backend.get('b'), backend.get('c')), (1, None, 3))
+        with mock.patch('ai_tutor.cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(backend.get('a'))
+
+
+def qcm_payload(title='Fractions'):
+    """Generated QCM that passes validation."""
+    return {
+        'title': title,
+        'content': {'questions': [{'question': 'Combien font 1/2 + 1/2 ?', 'options': ['1', '2', '1/4']}]},
+        'correct_answers': [0],
+    }
+
+
+class ExerciseStockTests(TestCase):
+    """Stocked exercises claimed once per slot, and refilled for popular slots."""
+
+    def setUp(self):
+        metrics.reset()
+        self.subject = Subject.objects.create(name='Mathématiques', slug='maths')
+        self.user = get_user_model().objects.create_user('eleve', password='x')
+        self.slot = {
+            'subject': self.subject, 'level': 'cm1', 'difficulty': 'medium',
+            'exercise_type': 'qcm', 'language': 'fr', 'topic': 'Les fractions',
+        }
+
+    def stock(self, title='Fractions', topic='Les fractions'):
+        return ExerciseStockItem.objects.create(
+            subject=self.subject, level='cm1', difficulty='medium', exercise_type='qcm', language='fr',
+            topic=topic, topic_key='les fractions', payload=qcm_payload(title)
+        )
+
+    def claim(self, **slot):
+        return claim_exercise(self.user, **{**self.slot, **slot})
+
+    def test_claim_takes_the_oldest_item_once(self):
+        self.stock('Premier')
+        self.stock('Second')
+        record_demand(**self.slot)
+        exercise = self.claim(topic='  LES Fractions ')
+        self.assertEqual((exercise.title, exercise.creator, exercise.is_ai_generated), ('Premier', self.user, True))
+        self.assertEqual(self.claim().title, 'Second')
+        self.assertIsNone(self.claim())
+        self.assertIsNone(self.claim(difficulty='hard'))
+
+        self.assertEqual(ExerciseStockItem.objects.count(), 0)
+        self.assertEqual(ExerciseStockDemand.objects.get().stock_hits, 2)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual((counters['exercise_stock.hits'], counters['exercise_stock.misses']), (2, 2))
+
+    def test_item_deleted_by_a_concurrent_claim_is_skipped(self):
+        taken = self.stock('Pris')
+        self.stock('Libre')
+        ExerciseStockItem.objects.filter(pk=taken.pk).delete()
+        first = QuerySet.first
+        picks = [taken]
+
+        def stale_first(queryset):
+            # The other worker deleted the row between our select and our delete
+            return picks.pop() if picks else first(queryset)
+
+        with mock.patch.object(QuerySet, 'first', autospec=True, side_effect=stale_first):
+            exercise = self.claim()
+        self.assertEqual(exercise.title, 'Libre')
+        self.assertEqual(Exercise.objects.count(), 1)
+        self.assertFalse(ExerciseStockItem.objects.exists())
+
+    def test_record_demand_counts_requests_per_slot(self):
+        record_demand(**self.slot)
+        record_demand(**{**self.slot, 'topic': 'les   FRACTIONS'})
+        record_demand(**{**self.slot, 'level': 'cm2'})
+        demand = ExerciseStockDemand.objects.get(level='cm1')
+        self.assertEqual((demand.requests, demand.topic_key), (2, 'les fractions'))
+        self.assertEqual(ExerciseStockDemand.objects.count(), 2)
+
+    @override_settings(AI_EXERCISE_STOCK_TARGET=3, AI_EXERCISE_STOCK_MIN_REQUESTS=2)
+    def test_refill_tops_up_popular_slots(self):
+        record_demand(**self.slot)
+        record_demand(**self.slot)
+        record_demand(**{**self.slot, 'level': 'cm2'})
+        self.stock()
+        ai_service = mock.Mock()
+        ai_service.generate_exercise.side_effect = [qcm_payload('A'), qcm_payload('B')]
+
+        self.assertEqual(refill_stock(ai_service, log=mock.Mock()), 2)
+        self.assertEqual(ai_service.generate_exercise.call_args.args, ('Mathématiques', 'CM1', 'Les fractions', 'medium', 'qcm', 'fr'))
+        self.assertEqual(refill_stock(ai_service, log=mock.Mock()), 0)
+        self.assertEqual(
+            list(ExerciseStockItem.objects.values_list('payload__title', flat=True)),
+            ['Fractions', 'A', 'B']
+        )
+
+    @override_settings(AI_EXERCISE_STOCK_TARGET=3, AI_EXERCISE_STOCK_MIN_REQUESTS=1)
+    def test_refill_stops_on_errors_and_at_the_generation_budget(self):
+        record_demand(**self.slot)
+        ai_service = mock.Mock()
+        ai_service.generate_exercise.return_value = {'error': 'Groq en panne'}
+        self.assertEqual(refill_stock(ai_service, log=mock.Mock()), 0)
+        self.assertEqual(ai_service.generate_exercise.call_count, 1)
+
+        ai_service.generate_exercise.return_value = qcm_payload()
+        self.assertEqual(refill_stock(ai_service, max_generations=2, log=mock.Mock()), 2)
+        self.assertEqual(ExerciseStockItem.objects.count(), 2)
+
+    def test_generate_exercise_served_from_stock(self):
+        self.stock('Depuis le stock')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('ai_tutor.views.logger'):
+            response = client.post('/api/ai/generate-exercise/', {
+                'subject': 'mathématiques', 'level': 'CM1', 'topic': 'Les Fractions', 'exercise_type': 'qcm'
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['X-Exercise-Source'], 'stock')
+        self.assertEqual(response.json()['title'], 'Depuis le stock')
+        self.assertEqual(Exercise.objects.get().creator, self.user)
+        self.assertEqual(ExerciseStockDemand.objects.get().stock_hits, 1)
+
+
+@override_settings(AI_SINGLEFLIGHT_WAIT_TIMEOUT=5, AI_SINGLEFLIGHT_POLL_INTERVAL=0.01)
+class SingleFlightTests(SimpleTestCase):
+    """Identical concurrent calls share the leader's result, within and across workers."""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.flight = SingleFlight('test')
+        self.key = self.flight.make_key('maths', 'cm1', 'fractions')
+        patcher = mock.patch('ai_tutor.singleflight.logger')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def counter(self, name):
+        return metrics.snapshot()['counters'].get(f'singleflight.test.{name}', 0)
+
+    def publish_from_other_worker(self, result=None):
+        cache.add(f'sf:test:lock:{self.key}', 'other-worker', 60)
+        if result is not None:
+            cache.set(f'sf:test:result:{self.key}', result, 60)
+
+    def test_key_depends_on_every_part(self):
+        self.assertEqual(self.key, self.flight.make_key('maths', 'cm1', 'fractions'))
+        self.assertNotEqual(self.key, self.flight.make_key('maths', 'cm2', 'fractions'))
+
+    def test_async_followers_wait_for_the_leader(self):
+        async def leader_call():
+            await asyncio.sleep(0.01)
+            return {'title': 'Fractions'}
+
+        follower_call = mock.AsyncMock(return_value={'title': 'Copie'})
+
+        async def run():
+            return await asyncio.gather(
+                self.flight.ado(self.key, leader_call),
+                self.flight.ado(self.key, follower_call),
+                self.flight.ado(self.flight.make_key('autre'), follower_call),
+            )
+
+        leader, follower, other = asyncio.run(run())
+        self.assertEqual((leader, follower), (({'title': 'Fractions'}, False), ({'title': 'Fractions'}, True)))
+        self.assertEqual(other, ({'title': 'Copie'}, False))
+        follower_call.assert_awaited_once()
+        self.assertEqual((self.counter('leaders'), self.counter('coalesced_local')), (2, 1))
+        self.assertEqual(cache.get(f'sf:test:result:{self.key}'), {'title': 'Fractions'})
+        self.assertIsNone(cache.get(f'sf:test:lock:{self.key}'))
+
+    def test_async_followers_run_their_own_call_when_the_leader_fails(self):
+        async def leader_call():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('Groq en panne')
+
+        follower_call = mock.AsyncMock(return_value={'title': 'Copie'})
+
+        async def run():
+            return await asyncio.gather(
+                self.flight.ado(self.key, leader_call),
+                self.flight.ado(self.key, follower_call),
+                return_exceptions=True
+            )
+
+        leader, follower = asyncio.run(run())
+        self.assertIsInstance(leader, RuntimeError)
+        self.assertEqual(follower, ({'title': 'Copie'}, False))
+        self.assertEqual(self.counter('fallbacks'), 1)
+
+    def test_async_result_published_by_another_worker(self):
+        self.publish_from_other_worker({'title': 'Fractions'})
+        call = mock.AsyncMock()
+        self.assertEqual(asyncio.run(self.flight.ado(self.key, call)), ({'title': 'Fractions'}, True))
+        call.assert_not_awaited()
+        self.assertEqual(self.counter('coalesced_remote'), 1)
+
+    @override_settings(AI_SINGLEFLIGHT_WAIT_TIMEOUT=0.05)
+    def test_async_call_runs_itself_when_the_other_worker_gives_nothing(self):
+        self.publish_from_other_worker()
+        call = mock.AsyncMock(return_value='local')
+        self.assertEqual(asyncio.run(self.flight.ado(self.key, call)), ('local', False))
+        self.assertEqual(self.counter('fallbacks'), 1)
+
+
+@override_settings(AI_CHAT_CACHE_ENABLED=False, AI_EXERCISE_STOCK_ENABLED=False)
+class AsyncViewTests(TestCase):
+    """The LLM-bound endpoints run as async views on the shared async client."""
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        limiter.reset()
+        self.user = get_user_model().objects.create_user('eleve', password='x', level='cm1')
+        self.client = AsyncClient()
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        self.subject = Subject.objects.create(name='Mathématiques', slug='maths')
+        self.groq = mock.Mock()
+        self.groq.chat.completions.create = mock.AsyncMock()
+        for patcher in (mock.patch('ai_tutor.services.get_async_client', return_value=self.groq),
+                        mock.patch('ai_tutor.client.logger'),
+                        mock.patch('ai_tutor.routing.logger'),
+                        mock.patch('ai_tutor.services.logger'),
+                        mock.patch('ai_tutor.views.logger')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('ai_tutor.services.usage_recorder')
+        self.usage_recorder = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json', headers=self.headers)
+
+    async def test_authentication_required(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = await self.client.post('/api/ai/chat/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_chat_answer(self):
+        self.groq.chat.completions.create.return_value = completion('Une fraction est une partie d’un tout.')
+        response = await self.post('/api/ai/chat/', {'messages': [{'role': 'user', 'content': 'Une fraction ?'}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['content'], 'Une fraction est une partie d’un tout.')
+        self.assertIn('CM1', self.groq.chat.completions.create.call_args.kwargs['messages'][0]['content'])
+        record = self.usage_recorder.record.call_args.kwargs
+        self.assertEqual(
+            (record['user_id'], record['endpoint'], record['prompt_tokens'], record['completion_tokens'], record['success']),
+            (self.user.pk, 'chat', 120, 30, True)
+        )
+        with self.assertLogs('django.request', 'WARNING'):
+            response = await self.post('/api/ai/chat/', {'messages': []})
+        self.assertEqual(response.status_code, 400)
+
+    # WhiteNoise is sync-only: under the test client it would serialize the requests
+    @modify_settings(MIDDLEWARE={'remove': 'whitenoise.middleware.WhiteNoiseMiddleware'})
+    async def test_identical_generations_share_one_llm_call(self):
+        async def generate(**params):
+            await asyncio.sleep(0.05)
+            return completion(json.dumps(qcm_payload('Fractions')))
+
+        self.groq.chat.completions.create.side_effect = generate
+        data = {'subject': 'Mathématiques', 'level': 'CM1', 'topic': 'Les fractions'}
+        responses = await asyncio.gather(
+            self.post('/api/ai/generate-exercise/', data),
+            self.post('/api/ai/generate-exercise/', {**data, 'topic': '  les FRACTIONS'})
+        )
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(sorted(response['X-Exercise-Source'] for response in responses), ['coalesced', 'live'])
+        self.groq.chat.completions.create.assert_awaited_once()
+        # Each student still gets a private copy
+        self.assertEqual(len({response.json()['id'] for response in responses}), 2)
+        self.assertEqual(await Exercise.objects.filter(creator=self.user, title='Fractions').acount(), 2)
+
+    async def test_shared_exercise_only_with_single_flight(self):
+        self.groq.chat.completions.create.return_value = completion(json.dumps(qcm_payload('Fractions')))
+        data = {'subject': 'Mathématiques', 'level': 'CM1', 'topic': 'Les fractions'}
+        with self.settings(AI_GENERATION_SHARE_EXERCISE=True, AI_GENERATION_SINGLEFLIGHT_ENABLED=False):
+            response = await self.post('/api/ai/generate-exercise/', data)
+        exercise = await Exercise.objects.aget(pk=response.json()['id'])
+        self.assertEqual((exercise.creator_id, exercise.visibility), (self.user.pk, Exercise.PRIVATE))
+
+        with self.settings(AI_GENERATION_SHARE_EXERCISE=True):
+            response = await self.post('/api/ai/generate-exercise/', data)
+        exercise = await Exercise.objects.aget(pk=response.json()['id'])
+        self.assertEqual((exercise.creator_id, exercise.visibility), (None, Exercise.PUBLIC))
+
+    async def test_generation_error(self):
+        self.groq.chat.completions.create.side_effect = RuntimeError('Groq en panne')
+        with self.assertLogs('django.request', 'ERROR'):
+            response = await self.post('/api/ai/generate-exercise/', {'subject': 'maths', 'level': 'cm1', 'topic': 'Aires'})
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('Groq en panne', response.json()['error'])
+        self.assertFalse(await Exercise.objects.aexists())
+
+
+class WindowMessagesTests(SimpleTestCase):
+    """History fitted into the token budget: system prompt and last turns verbatim, older turns summarized."""
+
+    def conversation(self, turns, words=40):
+        messages = [{'role': 'system', 'content': 'Tu es un tuteur.'}]
+        for number in range(turns):
+            messages.append({'role': 'user', 'content': f'Question {number} ' + 'mot ' * words})
+            messages.append({'role': 'assistant', 'content': f'Réponse {number} ' + 'mot ' * words})
+        messages.append({'role': 'user', 'content': 'Et maintenant ?'})
+        return messages
+
+    def test_untouched_within_budget(self):
+        messages = self.conversation(2)
+        window, info = window_messages(messages, budget=10000, keep_turns=2)
+        self.assertIs(window, messages)
+        self.assertEqual((info['tokens_saved'], info['summarized_messages']), (0, 0))
+
+    def test_old_turns_folded_into_a_summary(self):
+        messages = self.conversation(6)
+        summarizer = mock.Mock(return_value='Fractions vues.')
+        window, info = window_messages(messages, budget=count_tokens(messages) // 2, keep_turns=2)
+        self.assertEqual(window[0], messages[0])
+        self.assertEqual(window[-3:], messages[-3:])
+        self.assertEqual(info['summarized_messages'], len(messages) - 1 - 3)
+
+        window, info = window_messages(messages, budget=count_tokens(messages) // 2, keep_turns=2, summarizer=summarizer)
+        folded = summarizer.call_args.args[0]
+        self.assertEqual(folded, messages[1:-3])
+        self.assertEqual(window[1], {'role': 'system', 'content': SUMMARY_PREFIX + 'Fractions vues.'})
+        self.assertLessEqual(info['prompt_tokens'], count_tokens(messages) // 2)
+        self.assertEqual(info['tokens_saved'], info['original_tokens'] - info['prompt_tokens'])
+
+    def test_current_question_always_kept(self):
+        messages = self.conversation(1, words=400)
+        messages[-1]['content'] = 'mot ' * 400
+        window, info = window_messages(messages, budget=50, keep_turns=3)
+        self.assertEqual(window[-1], messages[-1])
+        self.assertEqual(info['summarized_messages'], 2)
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def test_burst_then_continuous_refill(self):
+        bucket = TokenBucket(per_minute=60, burst=2)
+        now = bucket.updated
+        for _ in range(2):
+            self.assertEqual(bucket.delay(now), 0)
+            bucket.take(now)
+        self.assertAlmostEqual(bucket.delay(now), 1.0)
+        bucket.take(now)
+        # The queued call reserved its token: the next one waits one more second
+        self.assertAlmostEqual(bucket.delay(now), 2.0)
+        self.assertAlmostEqual(bucket.delay(now + 2), 0)
+        self.assertEqual(bucket.delay(now + 3600), 0)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_zero_rate_disables_the_bucket(self):
+        bucket = TokenBucket(per_minute=0, burst=1)
+        for _ in range(5):
+            bucket.take(bucket.updated)
+        self.assertEqual(bucket.delay(bucket.updated), 0)
+
+
+@override_settings(
+    AI_LIMITS_ENABLED=True, AI_GLOBAL_REQUESTS_PER_MINUTE=6000, AI_GLOBAL_BURST=100,
+    AI_GLOBAL_MAX_IN_FLIGHT=1, AI_USER_REQUESTS_PER_MINUTE=6000, AI_USER_BURST=100,
+    AI_USER_MAX_IN_FLIGHT=1, AI_LIMIT_QUEUE_SIZE=10, AI_LIMIT_QUEUE_TIMEOUT=0.1,
+)
+class ConcurrencyLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.limiter = ConcurrencyLimiter()
+
+    def test_slot_released_after_the_call(self):
+        with self.limiter.acquire('a'):
+            self.assertEqual(self.limiter._in_flight, 1)
+        with self.limiter.acquire('b'):
+            pass
+        self.assertEqual(self.limiter._in_flight, 0)
+        self.assertEqual(self.limiter._users['a'].active, 0)
+
+    def test_waits_then_refuses_when_no_slot_frees_up(self):
+        with self.limiter.acquire('a'):
+            with self.assertRaises(RateLimited) as refused:
+                with self.limiter.acquire('b'):
+                    pass
+        self.assertEqual(refused.exception.reason, 'concurrency')
+        self.assertEqual(self.limiter._queued, 0)
+        with self.limiter.acquire('b'):
+            pass
+
+    @override_settings(AI_LIMIT_QUEUE_SIZE=0)
+    def test_full_queue_refused_at_once(self):
+        with self.limiter.acquire('a'):
+            with self.assertRaises(RateLimited) as refused:
+                with self.limiter.acquire('b'):
+                    pass
+        self.assertEqual(refused.exception.reason, 'queue_full')
+
+    @override_settings(AI_USER_REQUESTS_PER_MINUTE=1, AI_USER_BURST=1)
+    def test_user_rate_gives_retry_after(self):
+        limiter = ConcurrencyLimiter()
+        with limiter.acquire('a'):
+            pass
+        with self.assertRaises(RateLimited) as refused:
+            with limiter.acquire('a'):
+                pass
+        self.assertEqual(refused.exception.reason, 'rate')
+        self.assertGreaterEqual(refused.exception.retry_after, 59)
+        with limiter.acquire('b'):
+            pass
+
+    def test_async_acquire(self):
+        async def call():
+            async with self.limiter.aacquire('a'):
+                return self.limiter._in_flight
+
+        self.assertEqual(asyncio.run(call()), 1)
+        self.assertEqual(self.limiter._in_flight, 0)
+
+
+@override_settings(AI_USAGE_ENABLED=True, AI_USAGE_BATCH_SIZE=3, AI_USAGE_MAX_BUFFER=5,
+                   AI_MODEL_PRICES={'llama-3.3-70b-versatile': (0.59, 0.79)})
+class UsageLedgerTests(TestCase):
+    """Call records are buffered, written in batches and rolled up per day."""
+
+    def setUp(self):
+        metrics.reset()
+        self.recorder = UsageRecorder()
+        # The background flusher would write through its own database connection
+        patcher = mock.patch.object(self.recorder, '_ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = get_user_model().objects.create_user('eleve', password='x')
+
+    def record(self, endpoint='chat', model='llama-3.3-70b-versatile', **fields):
+        fields = {'user_id': self.user.pk, 'prompt_tokens': 1000, 'completion_tokens': 500, 'latency_ms': 200, **fields}
+        self.recorder.record(endpoint=endpoint, model=model, **fields)
+
+    def test_records_are_buffered_until_flushed(self):
+        self.record()
+        self.record(endpoint='exercise', user_id=None)
+        self.assertFalse(LLMCallRecord.objects.exists())
+        self.assertFalse(self.recorder._wakeup.is_set())
+        self.record(success=False, error='APIError')
+        # A full batch wakes the flusher up
+        self.assertTrue(self.recorder._wakeup.is_set())
+
+        self.assertEqual(self.recorder.flush(), 3)
+        self.assertEqual(self.recorder.flush(), 0)
+        self.assertEqual(LLMCallRecord.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(LLMCallRecord.objects.get(success=False).error, 'APIError')
+        self.assertEqual(metrics.snapshot()['counters']['usage.records_written'], 3)
+
+    def test_buffer_is_bounded(self):
+        for _ in range(7):
+            self.record()
+        self.assertEqual(metrics.snapshot()['counters']['usage.records_dropped'], 2)
+        self.assertEqual(self.recorder.flush(), 5)
+
+    @override_settings(AI_USAGE_ENABLED=False)
+    def test_nothing_recorded_when_disabled(self):
+        self.record()
+        self.assertEqual(self.recorder.flush(), 0)
+
+    def test_failed_batch_is_kept_for_the_next_flush(self):
+        for _ in range(4):
+            self.record()
+        with mock.patch('ai_tutor.usage.logger'), \
+                mock.patch.object(self.recorder, '_write', side_effect=DatabaseError('base indisponible')):
+            self.assertEqual(self.recorder.flush(), 0)
+        self.record(latency_ms=900)
+        # Requeued in front of the newer record, oldest dropped over AI_USAGE_MAX_BUFFER
+        self.record(latency_ms=950)
+        self.assertEqual(metrics.snapshot()['counters']['usage.records_dropped'], 1)
+        self.assertEqual(self.recorder.flush(), 5)
+        self.assertEqual(
+            list(LLMCallRecord.objects.order_by('pk').values_list('latency_ms', flat=True)),
+            [200, 200, 200, 900, 950]
+        )
+
+    def test_records_of_deleted_users_kept_without_user(self):
+        self.record()
+        self.record(user_id=self.user.pk + 1)
+        write = self.recorder._write
+        with mock.patch.object(self.recorder, '_write', side_effect=[IntegrityError('FOREIGN KEY'), None]) as failing:
+            self.assertEqual(self.recorder.flush(), 2)
+        batch = failing.call_args.args[0]
+        self.assertEqual([fields['user_id'] for fields in batch], [self.user.pk, None])
+        write(batch)
+        self.assertEqual(LLMCallRecord.objects.filter(user__isnull=True).count(), 1)
+
+    def test_cost_from_model_prices(self):
+        self.assertEqual(call_cost('llama-3.3-70b-versatile', 4000, 2000), Decimal('0.003940'))
+        self.assertEqual(call_cost('modele-inconnu', 4000, 2000), Decimal('0'))
+
+    def test_daily_rollup_per_user_feature_and_model(self):
+        day = datetime.date(2026, 3, 2)
+        at = timezone.make_aware(datetime.datetime(2026, 3, 2, 10))
+        for latency in (100, 200, 300):
+            self.record(latency_ms=latency, created_at=at)
+        self.record(latency_ms=400, success=False, created_at=at)
+        self.recorder.flush()
+        self.record(endpoint='exercise', user_id=None, created_at=at)
+        self.record(created_at=at + datetime.timedelta(days=1))
+        self.recorder.flush()
+
+        self.assertEqual(rollup_day(day), 2)
+        chat = LLMUsageDaily.objects.get(endpoint='chat')
+        self.assertEqual(
+            (chat.date, chat.user, chat.calls, chat.errors, chat.prompt_tokens, chat.completion_tokens),
+            (day, self.user, 4, 1, 4000, 2000)
+        )
+        self.assertEqual((chat.avg_latency_ms, chat.p95_latency_ms, chat.cost), (250, 400, Decimal('0.003940')))
+        self.assertIsNone(LLMUsageDaily.objects.get(endpoint='exercise').user)
+
+        # Rolling up the same day again replaces its rows
+        self.record(created_at=at)
+        self.recorder.flush()
+        self.assertEqual(rollup_day(day), 2)
+        self.assertEqual(LLMUsageDaily.objects.get(endpoint='chat').calls, 5)
+
+
+class FakeLLMServerTests(SimpleTestCase):
+    """The fake server answers the OpenAI client from recorded fixtures, streamed or not."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'recorded.json'
+        path.write_text(json.dumps([
+            {'kind': 'exercise', 'exercise_type': 'qcm', 'content': '{"title": "QCM 1"}'},
+            {'kind': 'exercise', 'exercise_type': 'classic', 'content': '{"title": "Fiche 1"}'},
+            {'kind': 'exercise', 'exercise_type': 'classic', 'content': '{"title": "Fiche 2"}'},
+            {'kind': 'chat', 'content': 'Une fraction partage une unité en parts égales.'},
+        ]), encoding='utf-8')
+        self.fixtures = FixtureStore(path)
+        patcher = mock.patch('httpx._client.logger')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start(self, **options):
+        server = FakeLLMServer(('127.0.0.1', 0), fixtures=self.fixtures, latency=0, tokens_per_second=0, **options)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        client = OpenAI(api_key='fake', base_url=f'http://127.0.0.1:{server.server_address[1]}/v1', max_retries=0)
+        self.addCleanup(client.close)
+        return client
+
+    def generate(self, client, exercise_type):
+        return client.chat.completions.create(
+            model='llama-3.3-70b-versatile',
+            messages=[{'role': 'user', 'content': f'Génère un exercice.\nType: {exercise_type}.\n'}],
+            response_format={'type': 'json_object'}
+        )
+
+    def test_exercises_replayed_round_robin_per_type(self):
+        client = self.start()
+        titles = [json.loads(self.generate(client, 'classic').choices[0].message.content)['title'] for _ in range(3)]
+        self.assertEqual(titles, ['Fiche 1', 'Fiche 2', 'Fiche 1'])
+        response = self.generate(client, 'qcm')
+        self.assertEqual(response.choices[0].message.content, '{"title": "QCM 1"}')
+        self.assertGreater(response.usage.completion_tokens, 0)
+
+    def test_chat_streamed_with_usage(self):
+        client = self.start()
+        messages = [{'role': 'user', 'content': 'Une fraction ?'}]
+        stream = client.chat.completions.create(
+            model='llama-3.3-70b-versatile',
+            messages=messages,
+            stream=True,
+            stream_options={'include_usage': True}
+        )
+        chunks = list(stream)
+        pieces = [c.choices[0].delta.content for c in chunks if c.choices and c.choices[0].delta.content]
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(''.join(pieces), 'Une fraction partage une unité en parts égales.')
+        self.assertEqual(chunks[-1].choices, [])
+        self.assertEqual(chunks[-1].usage.prompt_tokens, count_tokens(messages))
+
+    def test_injected_errors(self):
+        client = self.start(error_rate=1, error_status=503)
+        with self.assertRaises(APIStatusError) as raised:
+            self.generate(client, 'qcm')
+        self.assertEqual(raised.exception.status_code, 503)
+
+
+@override_settings(AI_EXERCISE_BATCH_MAX=6, AI_EXERCISE_BATCH_PER_CALL=2)
+class GenerateExerciseBatchTests(TestCase):
+    """A worksheet is generated with a few concurrent calls and saved without its invalid exercises."""
+
+    def setUp(self):
+        metrics.reset()
+        limiter.reset()
+        self.user = get_user_model().objects.create_user('eleve', password='x', level='cm1')
+        self.client = AsyncClient()
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=self.user).key}'}
+        Subject.objects.create(name='Mathématiques', slug='maths')
+        self.groq = mock.Mock()
+        self.groq.chat.completions.create = mock.AsyncMock()
+        for patcher in (mock.patch('ai_tutor.services.get_async_client', return_value=self.groq),
+                        mock.patch('ai_tutor.services.usage_recorder'),
+                        mock.patch('ai_tutor.client.logger'),
+                        mock.patch('ai_tutor.routing.logger'),
+                        mock.patch('ai_tutor.services.logger'),
+                        mock.patch('ai_tutor.views.logger')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def answers(self, *calls):
+        self.groq.chat.completions.create.side_effect = [
+            call if isinstance(call, Exception) else completion(json.dumps({'exercises': call})) for call in calls
+        ]
+
+    def post(self, count, **data):
+        data = {'subject': 'maths', 'level': 'CM1', 'topic': 'Les fractions', 'count': count, **data}
+        return self.client.post('/api/ai/generate-exercises/', data, content_type='application/json', headers=self.headers)
+
+    async def test_worksheet_split_into_calls_and_saved_together(self):
+        self.answers([qcm_payload('A'), qcm_payload('B')], [qcm_payload('C')])
+        response = await self.post(3)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['requested'], data['created'], data['errors']), (3, 3, []))
+        self.assertEqual([exercise['title'] for exercise in data['exercises']], ['A', 'B', 'C'])
+        self.assertTrue(all(exercise['id'] for exercise in data['exercises']))
+        self.assertEqual(await Exercise.objects.filter(creator=self.user, level='cm1').acount(), 3)
+
+        prompts = [call.kwargs['messages'][-1]['content'] for call in self.groq.chat.completions.create.call_args_list]
+        self.assertIn('Génère 2 exercices différents', prompts[0])
+        self.assertIn('Génère un exercice de', prompts[1])
+
+    async def test_invalid_exercises_and_failed_calls_reported(self):
+        self.answers([qcm_payload('A'), {'title': 'Sans questions'}], RuntimeError('Groq en panne'))
+        response = await self.post(4)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['requested'], data['created']), (4, 1))
+        self.assertEqual([error['index'] for error in data['errors'] if 'index' in error], [1])
+        self.assertIn('Groq en panne', data['errors'][0]['error'])
+        self.assertEqual(await Exercise.objects.acount(), 1)
+        self.assertEqual(metrics.snapshot()['counters']['exercise_batch.invalid'], 2)
+
+    async def test_nothing_saved_without_a_valid_exercise(self):
+        self.answers([{'title': 'Sans questions'}])
+        with self.assertLogs('django.request', 'ERROR'):
+            response = await self.post(1)
+        self.assertEqual(response.status_code, 502)
+        self.assertFalse(await Exercise.objects.aexists())
+
+    async def test_count_is_bounded(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            for count in (0, 7, 'beaucoup'):
+                self.assertEqual((await self.post(count)).status_code, 400)
+        self.groq.chat.completions.create.assert_not_called()
+
+    def test_keys_reselected_when_the_bulk_insert_returns_none(self):
+        subject = Subject.objects.get()
+        Exercise.objects.create(subject=subject, title='A', level='cm1', content={}, correct_answers=[0])
+        exercises = [
+            build_exercise(qcm_payload(title), subject, 'cm1', 'qcm', 'medium', creator=self.user)
+            for title in ('A', 'B', 'A')
+        ]
+        # As on MySQL: the INSERT does not return the new primary keys
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            # Savepoint, highest key, one INSERT, reselect, release
+            with self.assertNumQueries(5):
+                saved = save_exercises(exercises)
+        self.assertEqual(
+            [(exercise.pk, exercise.title) for exercise in saved],
+            list(Exercise.objects.filter(creator=self.user).order_by('pk').values_list('pk', 'title'))
+        )
+        self.assertEqual(saved[1].level_rank, 4)
+
+
+class CheckExerciseTests(SimpleTestCase):
+    """Local repairs of generated exercises, and the problems left for the LLM to fix."""
+
+    def qcm(self, correct_answers, **question):
+        question = {'question': 'Combien font 2 + 2 ?', 'options': ['trois', 'quatre', 'cinq'], **question}
+        return {'title': 'Addition', 'content': {'questions': [question]}, 'correct_answers': correct_answers}
+
+    def test_qcm_letter_answers_become_indexes(self):
+        for answer in ('B', 'b)', '(b)', '1', 1, 'quatre'):
+            with self.subTest(answer=answer):
+                result = check_exercise(self.qcm([answer]), 'qcm')
+                self.assertTrue(result.ok, result.problems)
+                self.assertEqual(result.data['correct_answers'], [1])
+                self.assertEqual(result.data['content']['questions'][0]['correct_option'], 1)
+
+    def test_qcm_answer_out_of_range_is_a_problem(self):
+        result = check_exercise(self.qcm(['E']), 'qcm')
+        self.assertEqual(result.failing_fields, ['correct_answers'])
+        result = check_exercise(self.qcm([], correct_option='C'), 'qcm')
+        self.assertTrue(result.ok)
+        self.assertEqual(result.data['correct_answers'], [2])
+
+    def test_unterminated_latex_is_closed(self):
+        self.assertEqual(balance_latex('On a $x^2 + 1'), ('On a $x^2 + 1$', 'repaired'))
+        self.assertEqual(balance_latex('$$\\frac{1}{2}'), ('$$\\frac{1}{2}$$', 'repaired'))
+        self.assertEqual(balance_latex('Coûte 5 $ et $x$'), ('Coûte 5 $ et $x$', 'unbalanced'))
+        self.assertEqual(balance_latex('Prix : 5 \\$'), ('Prix : 5 \\$', 'ok'))
+
+        data = self.qcm([1])
+        data['explanation'] = 'Car $2 + 2 = 4'
+        result = check_exercise(data, 'qcm')
+        self.assertTrue(result.ok, result.problems)
+        self.assertEqual(result.data['explanation'], 'Car $2 + 2 = 4$')
+
+    def test_classic_answers_given_as_a_dict(self):
+        data = {
+            'title': 'Fiche',
+            'content': {'text': 'Réponds.', 'questions': ['Q1', {'question': 'Q2'}, 'Q3']},
+            'correct_answers': {'2': 'R2', '1': 'R1', '3': 12},
+        }
+        result = check_exercise(data, 'classic')
+        self.assertTrue(result.ok, result.problems)
+        self.assertEqual(result.data['correct_answers'], ['R1', 'R2', '12'])
+        self.assertEqual(result.data['content']['questions'], ['Q1', 'Q2', 'Q3'])
+        self.assertEqual(data['correct_answers'], {'2': 'R2', '1': 'R1', '3': 12})
+
+    def test_missing_classic_answers_reported(self):
+        data = {'title': 'Fiche', 'content': {'text': '', 'questions': ['Q1', 'Q2']}, 'correct_answers': ['R1']}
+        result = check_exercise(data, 'classic')
+        self.assertEqual(result.failing_fields, ['correct_answers'])
+
+
+@override_settings(AI_BREAKER_FAILURE_THRESHOLD=3, AI_BREAKER_RESET_TIMEOUT=30)
+class CircuitBreakerTests(SimpleTestCase):
+    """closed -> open after repeated failures -> half open after the timeout -> one probe decides."""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('test-model')
+        self.now = 1000.0
+        clock = mock.patch('ai_tutor.resilience.time.monotonic', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold_and_fails_fast(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.fail(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.now += 10
+        with self.assertRaises(CircuitOpen) as refused:
+            self.breaker.before_call()
+        self.assertEqual(refused.exception.retry_after, 20)
+
+    def test_success_resets_the_failure_count(self):
+        self.fail(2)
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_single_probe_after_timeout(self):
+        self.fail(3)
+        self.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.before_call()
+
+    def test_failed_probe_reopens(self):
+        self.fail(3)
+        self.now += 30
+        self.fail(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+    def test_released_probe_lets_another_one_through(self):
+        self.fail(3)
+        self.now += 30
+        self.breaker.before_call()
+        self.breaker.release()
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+
+@override_settings(AI_ROUTING_ENABLED=True)
+class ModelRouterTests(SimpleTestCase):
+    """The first rule whose conditions all hold wins; the call defaults apply otherwise."""
+
+    rules = [
+        {'name': 'primary_short', 'task': 'chat', 'max_level': 'cm2', 'max_message_tokens': 20,
+         'math': False, 'model': 'small', 'max_tokens': 400},
+        {'name': 'lycee', 'task': 'chat', 'min_level': 'seconde', 'model': 'lycee'},
+        {'name': 'math', 'task': 'chat', 'math': True, 'model': 'big', 'max_tokens': 1024},
+        {'name': 'exercise', 'task': ['exercise', 'exercise_batch'], 'model': 'exercise'},
+    ]
+
+    def setUp(self):
+        self.router = ModelRouter(rules=self.rules)
+
+    def route(self, task, content='Bonjour', **kwargs):
+        with self.assertLogs('ai_tutor.routing', 'INFO'):
+            return self.router.route(task, 'default', 800, messages=[{'role': 'user', 'content': content}], **kwargs)
+
+    def test_level_labels_and_codes_share_a_rank(self):
+        self.assertEqual(level_rank('6ème'), level_rank('sixieme'))
+        self.assertLess(level_rank('CM2'), level_rank('6ème'))
+        self.assertIsNone(level_rank('inconnu'))
+
+    def test_short_primary_question_goes_to_the_small_model(self):
+        route = self.route('chat', level='CM2')
+        self.assertEqual((route.name, route.model, route.max_tokens), ('primary_short', 'small', 400))
+
+    def test_level_bounds(self):
+        self.assertEqual(self.route('chat', level='6ème').name, 'default')
+        self.assertEqual(self.route('chat', level='Seconde').name, 'lycee')
+        self.assertEqual(self.route('chat', level='2nde').name, 'lycee')
+        self.assertEqual(self.route('chat', level='terminale').name, 'lycee')
+
+    def test_unknown_level_fails_level_conditions(self):
+        self.assertEqual(self.route('chat', level=None).name, 'default')
+
+    def test_long_message_skips_the_short_rule(self):
+        route = self.route('chat', 'Explique-moi ' + 'encore ' * 40, level='cm1')
+        self.assertEqual(route.name, 'default')
+
+    def test_math_from_message_or_subject(self):
+        self.assertEqual(self.route('chat', 'Combien font 3 + 4 ?', level='cm1').name, 'math')
+        self.assertEqual(self.route('chat', level='cm1', subject='Mathématiques').name, 'math')
+
+    def test_task_list_and_defaults(self):
+        route = self.route('exercise_batch')
+        self.assertEqual((route.model, route.max_tokens), ('exercise', 800))
+        route = self.route('exercise_repair')
+        self.assertEqual((route.name, route.model, route.max_tokens), ('default', 'default', 800))
+
+    @override_settings(AI_ROUTING_ENABLED=False)
+    def test_disabled_routing_uses_the_defaults(self):
+        route = self.router.route('chat', 'default', 800, messages=[{'role': 'user', 'content': 'Bonjour'}], level='CM2')
+        self.assertEqual((route.name, route.model), ('default', 'default'))
+
+
+def make_lesson(pk, title, content, summary='', chapter='Nombres'):
+    return SimpleNamespace(pk=pk, title=title, content=content, summary=summary,
+                           chapter=SimpleNamespace(title=chapter), updated_at=pk)
+
+
+@override_settings(AI_LESSON_PASSAGE_TOKENS=40)
+class LessonIndexTests(SimpleTestCase):
+    """BM25 search over lesson passages, with the chapter and lesson titles indexed in every passage."""
+
+    def setUp(self):
+        self.index = LessonIndex()
+        self.index.index_lesson(make_lesson(
+            1, 'Les fractions',
+            '<p>Une fraction représente une partie d\'un tout.</p>'
+            '<p>Pour additionner deux fractions, on les met au même dénominateur.</p>',
+            summary='Numérateur et dénominateur.'
+        ))
+        self.index.index_lesson(make_lesson(
+            2, 'Le théorème de Pythagore',
+            '<p>Dans un triangle rectangle, le carré de l\'hypoténuse est égal à la somme des carrés.</p>',
+            chapter='Géométrie'
+        ))
+
+    def test_tokenize_folds_accents_stop_words_and_plurals(self):
+        self.assertEqual(tokenize('Comment additionner les Fractions ?'), ['additionner', 'fraction'])
+        self.assertEqual(tokenize('Dénominateurs'), ['denominateur'])
+
+    def test_long_paragraphs_are_split(self):
+        text = '<p>' + ' '.join(f'Phrase numéro {i} sur les fractions.' for i in range(30)) + '</p><p>Fin.</p>'
+        passages = split_passages(text, 40)
+        self.assertGreater(len(passages), 1)
+        self.assertNotIn('<p>', ''.join(passages))
+
+    def test_best_passage_first(self):
+        results = self.index.search('additionner des fractions')
+        self.assertTrue(results)
+        score, passage = results[0]
+        self.assertEqual(passage.lesson_id, 1)
+        self.assertIn('additionner', passage.text)
+        self.assertEqual(results, sorted(results, key=lambda result: -result[0]))
+
+    def test_titles_are_indexed_with_every_passage(self):
+        results = self.index.search('géométrie')
+        self.assertEqual([passage.lesson_id for _, passage in results], [2])
+
+    def test_search_within_a_lesson(self):
+        self.assertEqual(self.index.search('fraction', lesson_id=2), [])
+        self.assertEqual(self.index.search('fraction', lesson_id=99), [])
+        self.assertTrue(all(passage.lesson_id == 1 for _, passage in self.index.search('fraction', lesson_id=1, k=5)))
+
+    def test_no_terms_no_results(self):
+        self.assertEqual(self.index.search('comment pourquoi'), [])
+        self.assertEqual(self.index.search('photosynthèse'), [])
+
+    def test_reindexing_replaces_the_old_passages(self):
+        self.index.index_lesson(make_lesson(2, 'Le cercle', '<p>Le rayon du cercle.</p>', chapter='Géométrie'))
+        self.assertEqual(self.index.search('hypoténuse'), [])
+        self.assertEqual(self.index.search('rayon')[0][1].lesson_id, 2)
+        self.index.remove_lesson(2)
+        self.assertEqual(self.index.search('rayon'), [])
+        self.assertNotIn('rayon', self.index.postings)
+
+    def test_fallback_prefers_the_summary(self):
+        self.assertEqual([p.kind for p in self.index.fallback_passages(1)], ['summary'])
+        self.assertEqual([p.kind for p in self.index.fallback_passages(2)], ['content'])
+
+    def test_snapshot_round_trip(self):
+        copy = pickle.loads(pickle.dumps(self.index))
+        self.assertEqual(
+            [(score, p.text) for score, p in copy.search('fractions')],
+            [(score, p.text) for score, p in self.index.search('fractions')]
+        )
+
+
+@override_settings(AI_JOB_MAX_ATTEMPTS=3, AI_JOB_RETRY_BASE_DELAY=5, AI_JOB_RETRY_MAX_DELAY=300,
+                   AI_JOB_LEASE_TIMEOUT=600, AI_JOB_CLAIM_CANDIDATES=5)
+class JobQueueTests(TestCase):
+    """Jobs are claimed once, in order, and retried with backoff until max_attempts."""
+
+    def setUp(self):
+        self.handler = mock.Mock(return_value={'ok': True})
+        patcher = mock.patch.dict(HANDLERS, {'test': lambda payload, job: self.handler(payload, job)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_claimed(self):
+        with self.assertLogs('ai_tutor.jobs'):
+            return run_job(claim_job('worker-1'))
+
+    def test_claims_runnable_jobs_in_order_once(self):
+        first = enqueue('test', {'n': 1})
+        enqueue('test', {'n': 2}, delay=60)
+        second = enqueue('test', {'n': 3})
+        job = claim_job('worker-1')
+        self.assertEqual((job.pk, job.status, job.attempts, job.locked_by), (first.pk, Job.RUNNING, 1, 'worker-1'))
+        self.assertEqual(claim_job('worker-2').pk, second.pk)
+        self.assertIsNone(claim_job('worker-3'))
+
+    def test_skip_locked_claim(self):
+        job = enqueue('test', {})
+        with mock.patch('ai_tutor.jobs.connection.features.has_select_for_update_skip_locked', True):
+            claimed = claim_job('worker-1')
+            self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (job.pk, Job.RUNNING, 1))
+            self.assertIsNone(claim_job('worker-2'))
+
+    def test_unknown_kind_refused(self):
+        with self.assertRaises(ValueError):
+            enqueue('nope', {})
+
+    def test_success_stores_the_result(self):
+        job = enqueue('test', {})
+        self.assertEqual(self.run_claimed(), Job.SUCCEEDED)
+        job.refresh_from_db()
+        self.assertEqual((job.result, job.finished_at is not None), ({'ok': True}, True))
+
+    def test_error_retried_with_backoff_then_failed(self):
+        self.handler.side_effect = RuntimeError('boom')
+        job = enqueue('test', {})
+        before = timezone.now()
+        self.assertEqual(self.run_claimed(), Job.PENDING)
+        job.refresh_from_db()
+        self.assertEqual((job.attempts, job.locked_by, job.error), (1, '', 'boom'))
+        # First retry: between half and all of the base delay
+        self.assertGreaterEqual(job.run_after, before + datetime.timedelta(seconds=2.5))
+        self.assertLessEqual(job.run_after, timezone.now() + datetime.timedelta(seconds=5))
+        self.assertIsNone(claim_job('worker-1'))
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(self.run_claimed(), Job.PENDING)
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(self.run_claimed(), Job.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 3)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_retry_job_delay_is_used(self):
+        self.handler.side_effect = RetryJob('rate limited', delay=120)
+        job = enqueue('test', {})
+        self.run_claimed()
+        job.refresh_from_db()
+        delay = (job.run_after - timezone.now()).total_seconds()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertTrue(110 < delay <= 120)
+
+    def test_job_failed_is_not_retried(self):
+        self.handler.side_effect = JobFailed('bad payload')
+        job = enqueue('test', {})
+        self.assertEqual(self.run_claimed(), Job.FAILED)
+        job.refresh_from_db()
+        self.assertEqual((job.attempts, job.error), (1, 'bad payload'))
+
+    def test_stale_jobs_requeued_or_failed(self):
+        lost = enqueue('test', {})
+        exhausted = enqueue('test', {}, max_attempts=1)
+        claim_job('worker-1')
+        claim_job('worker-1')
+        Job.objects.update(locked_at=timezone.now() - datetime.timedelta(seconds=601))
+        with self.assertLogs('ai_tutor.jobs', 'WARNING'):
+            self.assertEqual(requeue_stale_jobs(), 1)
+        lost.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual((lost.status, lost.locked_by), (Job.PENDING, ''))
+        self.assertEqual(exhausted.status, Job.FAILED)
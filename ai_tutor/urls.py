@@ -1,7 +1,17 @@
 from django.urls import path
-from .views import ChatView, GenerateExerciseView
+from .views import (
+    ChatView, ChatStreamView, ExerciseStockView, GenerateExerciseBatchView, GenerateExerciseView,
+    JobListView, JobView, MetricsView, UsageReportView,
+)
 
 urlpatterns = [
     path('chat/', ChatView.as_view(), name='ai-chat'),
+    path('chat/stream/', ChatStreamView.as_view(), name='ai-chat-stream'),
     path('generate-exercise/', GenerateExerciseView.as_view(), name='generate-exercise'),
+    path('generate-exercises/', GenerateExerciseBatchView.as_view(), name='generate-exercises'),
+    path('jobs/', JobListView.as_view(), name='ai-jobs'),
+    path('jobs/<int:pk>/', JobView.as_view(), name='ai-job'),
+    path('exercise-stock/', ExerciseStockView.as_view(), name='ai-exercise-stock'),
+    path('metrics/', MetricsView.as_view(), name='ai-metrics'),
+    path('usage/', UsageReportView.as_view(), name='ai-usage'),
 ]
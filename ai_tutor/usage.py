@@ -0,0 +1,254 @@
+"""
+Ledger of LLM calls: who called which model, for which feature, with how
+many tokens, how fast and whether it failed.
+
+``usage_recorder.record`` only appends to an in-memory buffer. A background
+thread of each worker process writes the buffer with one bulk_create every
+few seconds, or as soon as a batch is full, so requests never wait on it.
+A batch that cannot be written goes back to the buffer (AI_USAGE_MAX_BUFFER
+records at most) until the database is available again.
+``rollup_day`` aggregates the records into LLMUsageDaily rows with p95
+latency and cost.
+"""
+import os
+import atexit
+import logging
+import datetime
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from .metrics import metrics, percentile
+
+logger = logging.getLogger(__name__)
+
+
+class UsageRecorder:
+    """Buffer of call records flushed by a per-process background thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record(self, **fields):
+        if not settings.AI_USAGE_ENABLED:
+            return
+        fields.setdefault('created_at', timezone.now())
+        with self._lock:
+            self._buffer.append(fields)
+            overflow = len(self._buffer) - settings.AI_USAGE_MAX_BUFFER
+            if overflow > 0:
+                del self._buffer[:overflow]
+                metrics.incr('usage.records_dropped', overflow)
+            full = len(self._buffer) >= settings.AI_USAGE_BATCH_SIZE
+        self._ensure_flusher()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='llm-usage-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.AI_USAGE_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records now; returns how many were written."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        try:
+            close_old_connections()
+            try:
+                self._write(batch)
+            except IntegrityError:
+                # A user deleted since the call: keep its records without the user
+                self._detach_missing_users(batch)
+                self._write(batch)
+        except Exception as e:
+            logger.error(f"Could not write {len(batch)} LLM call records, kept for the next flush: {str(e)}")
+            metrics.incr('usage.write_errors')
+            self._requeue(batch)
+            return 0
+        metrics.incr('usage.records_written', len(batch))
+        return len(batch)
+
+    def _write(self, batch):
+        from .models import LLMCallRecord
+
+        # All or nothing: a failed batch is retried whole
+        with transaction.atomic():
+            LLMCallRecord.objects.bulk_create(
+                [LLMCallRecord(**fields) for fields in batch],
+                batch_size=settings.AI_USAGE_BATCH_SIZE
+            )
+
+    def _detach_missing_users(self, batch):
+        from django.contrib.auth import get_user_model
+
+        user_ids = {fields['user_id'] for fields in batch if fields.get('user_id') is not None}
+        existing = set(get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        for fields in batch:
+            if fields.get('user_id') is not None and fields['user_id'] not in existing:
+                fields['user_id'] = None
+
+    def _requeue(self, batch):
+        """Put a batch that could not be written back in front of the buffer, oldest dropped first."""
+        with self._lock:
+            self._buffer = batch + self._buffer
+            overflow = len(self._buffer) - settings.AI_USAGE_MAX_BUFFER
+            if overflow > 0:
+                del self._buffer[:overflow]
+                metrics.incr('usage.records_dropped', overflow)
+
+    def _after_fork_in_child(self):
+        # Records buffered by the parent are flushed by the parent
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+
+usage_recorder = UsageRecorder()
+
+atexit.register(usage_recorder.flush)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=usage_recorder._after_fork_in_child)
+
+
+def call_cost(model, prompt_tokens, completion_tokens):
+    """Cost in USD of a call, from AI_MODEL_PRICES (0 for unknown models)."""
+    prompt_price, completion_price = settings.AI_MODEL_PRICES.get(model, (0, 0))
+    cost = (Decimal(str(prompt_price)) * prompt_tokens + Decimal(str(completion_price)) * completion_tokens)
+    return (cost / 1000000).quantize(Decimal('0.000001'))
+
+
+def rollup_day(day):
+    """(Re)build the LLMUsageDaily rows of ``day``; returns how many were written."""
+    from .models import LLMCallRecord, LLMUsageDaily
+
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    end = start + datetime.timedelta(days=1)
+    records = LLMCallRecord.objects.filter(created_at__gte=start, created_at__lt=end).values_list(
+        'user_id', 'endpoint', 'model', 'prompt_tokens', 'completion_tokens', 'latency_ms', 'success'
+    )
+
+    groups = defaultdict(lambda: {'calls': 0, 'errors': 0, 'prompt': 0, 'completion': 0, 'latencies': []})
+    for user_id, endpoint, model, prompt, completion, latency, success in records.iterator(chunk_size=2000):
+        group = groups[(user_id, endpoint, model)]
+        group['calls'] += 1
+        group['errors'] += 0 if success else 1
+        group['prompt'] += prompt
+        group['completion'] += completion
+        group['latencies'].append(latency)
+
+    rows = []
+    for (user_id, endpoint, model), group in groups.items():
+        latencies = sorted(group['latencies'])
+        rows.append(LLMUsageDaily(
+            date=day,
+            user_id=user_id,
+            endpoint=endpoint,
+            model=model,
+            calls=group['calls'],
+            errors=group['errors'],
+            prompt_tokens=group['prompt'],
+            completion_tokens=group['completion'],
+            avg_latency_ms=round(sum(latencies) / len(latencies)),
+            p95_latency_ms=round(percentile(latencies, 95)),
+            cost=call_cost(model, group['prompt'], group['completion']),
+        ))
+
+    with transaction.atomic():
+        LLMUsageDaily.objects.filter(date=day).delete()
+        LLMUsageDaily.objects.bulk_create(rows)
+    return len(rows)
+
+
+def purge_records(retention_days=None):
+    """Delete call records older than the retention period (rollups are kept)."""
+    from .models import LLMCallRecord
+
+    days = settings.AI_USAGE_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = LLMCallRecord.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def usage_report(days=30, limit=10):
+    """Top users, features and models by cost over the last ``days`` days of rollups."""
+    from .models import LLMUsageDaily
+
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+    rows = LLMUsageDaily.objects.filter(date__gte=since)
+    totals = dict(
+        calls=Sum('calls'),
+        errors=Sum('errors'),
+        prompt_tokens=Sum('prompt_tokens'),
+        completion_tokens=Sum('completion_tokens'),
+        cost=Sum('cost'),
+    )
+
+    def top(*fields):
+        return list(rows.values(*fields).annotate(**totals).order_by('-cost')[:limit])
+
+    return {
+        'since': since,
+        'total': rows.aggregate(**totals, active_users=Count('user', distinct=True, filter=Q(user__isnull=False))),
+        'by_day': list(rows.values('date').annotate(**totals).order_by('-date')),
+        'by_endpoint': top('endpoint'),
+        'by_model': top('model'),
+        'by_user': top('user_id', 'user__username'),
+    }
+
+
+def route_report(days=7):
+    """
+    Calls, errors, latency and output size per routing rule and model over
+    the last ``days`` days of call records, to tune AI_ROUTING_RULES.
+    """
+    from .models import LLMCallRecord
+
+    since = timezone.now() - datetime.timedelta(days=days)
+    records = LLMCallRecord.objects.filter(created_at__gte=since).exclude(route='').values_list(
+        'route', 'model', 'completion_tokens', 'latency_ms', 'success'
+    )
+    groups = defaultdict(lambda: {'calls': 0, 'errors': 0, 'completion': 0, 'latencies': []})
+    for route, model, completion, latency, success in records.iterator(chunk_size=2000):
+        group = groups[(route, model)]
+        group['calls'] += 1
+        group['errors'] += 0 if success else 1
+        group['completion'] += completion
+        group['latencies'].append(latency)
+
+    report = []
+    for (route, model), group in groups.items():
+        latencies = sorted(group['latencies'])
+        report.append({
+            'route': route,
+            'model': model,
+            'calls': group['calls'],
+            'errors': group['errors'],
+            'avg_completion_tokens': round(group['completion'] / group['calls']),
+            'p50_latency_ms': round(percentile(latencies, 50)),
+            'p95_latency_ms': round(percentile(latencies, 95)),
+        })
+    return sorted(report, key=lambda row: -row['calls'])
@@ -0,0 +1,16 @@
+import re
+import unicodedata
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def fold_text(text):
+    """
+    Normalize free text for matching: accents removed, case folded and
+    whitespace collapsed ("  C'est  quoi une FRACTION ? " -> "c'est quoi une fraction ?").
+    """
+    if text is None:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _WHITESPACE_RE.sub(' ', stripped).strip().casefold()
@@ -0,0 +1,303 @@
+"""
+Validation and local repair of generated exercises.
+
+One validator per exercise type is built once at import time (compiled
+regexes, fixed list of checks). ``check`` returns a repaired copy of the
+exercise, the repairs made and the problems left. Problems are keyed by
+top-level field, so that only those fields have to be asked again to the
+LLM instead of regenerating the whole exercise.
+"""
+import re
+import copy
+
+# "B", "b)", "(c)", "D." → option letter
+_LETTER_RE = re.compile(r"^\s*\(?([A-Ha-h])\s*[).:]?\s*$")
+_INT_RE = re.compile(r"^\s*(\d+)\s*$")
+# LaTeX delimiters not escaped with a backslash; "$$" is one block delimiter
+_DELIMITER_RE = re.compile(r"(?<!\\)\$\$|(?<!\\)\$")
+# Text looking like unfinished math (command, exponent, index, operator, digit)
+_MATH_TAIL_RE = re.compile(r"\\[a-zA-Z]+|[\^_=+]|\d")
+
+
+class Problem:
+    def __init__(self, field, message):
+        self.field = field
+        self.message = message
+
+    def __str__(self):
+        return f"{self.field}: {self.message}"
+
+    def __repr__(self):
+        return f"Problem({self.field!r}, {self.message!r})"
+
+
+class ValidationResult:
+    def __init__(self, data):
+        self.data = data
+        self.problems = []
+        self.repairs = []
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    @property
+    def failing_fields(self):
+        fields = []
+        for problem in self.problems:
+            if problem.field not in fields:
+                fields.append(problem.field)
+        return fields
+
+    def problem(self, field, message):
+        self.problems.append(Problem(field, message))
+
+    def repaired(self, message):
+        self.repairs.append(message)
+
+
+def option_index(value, options=None):
+    """Index of a QCM answer given as int, numeric string, letter or option text; None if unknown."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        index = value
+    elif isinstance(value, str):
+        match = _LETTER_RE.match(value)
+        if match:
+            index = ord(match.group(1).upper()) - ord('A')
+        elif _INT_RE.match(value):
+            index = int(value)
+        elif options and value.strip() in [str(option).strip() for option in options]:
+            index = [str(option).strip() for option in options].index(value.strip())
+        else:
+            return None
+    else:
+        return None
+    if options is not None and not 0 <= index < len(options):
+        return None
+    return index
+
+
+def balance_latex(text):
+    """
+    Return (text, status): status is 'ok', 'repaired' when an unterminated
+    formula at the end of the text was closed, or 'unbalanced'.
+    """
+    delimiters = _DELIMITER_RE.findall(text)
+    blocks = delimiters.count('$$')
+    inline = len(delimiters) - blocks
+    if blocks % 2 == 0 and inline % 2 == 0:
+        return text, 'ok'
+    if blocks % 2 + inline % 2 == 1:
+        last = list(_DELIMITER_RE.finditer(text))[-1]
+        tail = text[last.end():]
+        # Unterminated formula running to the end (typically a truncated answer)
+        if tail.strip() and _MATH_TAIL_RE.search(tail) and last.group() == ('$$' if blocks % 2 else '$'):
+            return text.rstrip() + last.group(), 'repaired'
+    return text, 'unbalanced'
+
+
+class ExerciseValidator:
+    """Checks shared by every exercise type."""
+
+    exercise_type = None
+
+    def __init__(self):
+        self.checks = [self.check_metadata, self.check_content, self.check_answers, self.check_latex]
+
+    def check(self, exercise_data, difficulty=None):
+        if not isinstance(exercise_data, dict):
+            result = ValidationResult({})
+            result.problem('content', "l'exercice n'est pas un objet JSON")
+            return result
+        result = ValidationResult(copy.deepcopy(exercise_data))
+        if difficulty:
+            result.data['difficulty'] = difficulty
+        for check in self.checks:
+            check(result)
+        return result
+
+    def check_metadata(self, result):
+        data = result.data
+        if self.exercise_type and data.get('type') != self.exercise_type:
+            data['type'] = self.exercise_type
+        if not isinstance(data.get('title'), str) or not data['title'].strip():
+            result.problem('title', "titre manquant")
+        for field in ('description', 'explanation'):
+            if data.get(field) is None:
+                data[field] = ''
+            elif not isinstance(data[field], str):
+                data[field] = str(data[field])
+                result.repaired(f"{field} converti en texte")
+        hints = data.get('hints')
+        if isinstance(hints, str):
+            data['hints'] = [hints]
+            result.repaired("hints converti en liste")
+        elif not isinstance(hints, list):
+            data['hints'] = []
+        else:
+            data['hints'] = [str(hint) for hint in hints if hint]
+        try:
+            data['points'] = max(1, int(data.get('points', 10)))
+        except (TypeError, ValueError):
+            data['points'] = 10
+            result.repaired("points remis à 10")
+
+    def check_content(self, result):
+        pass
+
+    def check_answers(self, result):
+        pass
+
+    def _texts(self, data):
+        """(field, container, key) of every text that may hold LaTeX."""
+        for field in ('title', 'description', 'explanation'):
+            yield field, data, field
+        for index in range(len(data.get('hints', []))):
+            yield 'hints', data['hints'], index
+        content = data.get('content')
+        if isinstance(content, dict):
+            if isinstance(content.get('text'), str):
+                yield 'content', content, 'text'
+            for question in content.get('questions') or []:
+                if isinstance(question, dict):
+                    if isinstance(question.get('question'), str):
+                        yield 'content', question, 'question'
+                    options = question.get('options')
+                    if isinstance(options, list):
+                        for index in range(len(options)):
+                            yield 'content', options, index
+        answers = data.get('correct_answers')
+        if isinstance(answers, list):
+            for index, answer in enumerate(answers):
+                if isinstance(answer, str):
+                    yield 'correct_answers', answers, index
+
+    def check_latex(self, result):
+        for field, container, key in list(self._texts(result.data)):
+            text = container[key]
+            if not isinstance(text, str) or '$' not in text:
+                continue
+            fixed, status = balance_latex(text)
+            if status == 'repaired':
+                container[key] = fixed
+                result.repaired(f"{field}: formule LaTeX refermée")
+            elif status == 'unbalanced':
+                result.problem(field, f"délimiteurs LaTeX ($) non appariés dans « {text[:60]} »")
+
+
+class QcmValidator(ExerciseValidator):
+    exercise_type = 'qcm'
+
+    def check_content(self, result):
+        content = result.data.get('content')
+        questions = content.get('questions') if isinstance(content, dict) else None
+        if not isinstance(questions, list) or not questions:
+            result.problem('content', "content.questions est absent ou vide")
+            return
+        for number, question in enumerate(questions, start=1):
+            if not isinstance(question, dict) or not str(question.get('question') or '').strip():
+                result.problem('content', f"question {number} sans énoncé")
+                continue
+            options = question.get('options')
+            if not isinstance(options, list) or len(options) < 2:
+                result.problem('content', f"question {number}: il faut au moins 2 options")
+                continue
+            if any(not isinstance(option, str) for option in options):
+                question['options'] = [str(option) for option in options]
+                result.repaired(f"question {number}: options converties en texte")
+
+    def check_answers(self, result):
+        data = result.data
+        content = data.get('content')
+        questions = content.get('questions') if isinstance(content, dict) else None
+        if not isinstance(questions, list) or not questions or any(
+                not isinstance(q, dict) or not isinstance(q.get('options'), list) for q in questions):
+            return
+
+        answers = data.get('correct_answers')
+        if not isinstance(answers, list):
+            answers = [answers] if answers is not None and len(questions) == 1 else []
+        resolved = []
+        for number, question in enumerate(questions, start=1):
+            options = question['options']
+            from_answers = option_index(answers[number - 1], options) if number <= len(answers) else None
+            from_option = option_index(question.get('correct_option'), options)
+            # correct_answers is what grading uses: it wins when both are valid
+            index = from_answers if from_answers is not None else from_option
+            if index is None:
+                result.problem('correct_answers', f"question {number}: aucune bonne réponse valide parmi les {len(options)} options")
+            elif question.get('correct_option') != index:
+                question['correct_option'] = index
+                result.repaired(f"question {number}: correct_option normalisé")
+            resolved.append(index)
+
+        if None not in resolved and data.get('correct_answers') != resolved:
+            data['correct_answers'] = resolved
+            result.repaired("correct_answers normalisé en index d'options")
+
+
+class ClassicValidator(ExerciseValidator):
+    exercise_type = 'classic'
+
+    def check_content(self, result):
+        content = result.data.get('content')
+        questions = content.get('questions') if isinstance(content, dict) else None
+        if not isinstance(questions, list) or not questions:
+            result.problem('content', "content.questions est absent ou vide")
+            return
+        if not isinstance(content.get('text'), str):
+            content['text'] = ''
+            result.repaired("content.text ajouté")
+        for index, question in enumerate(questions):
+            if isinstance(question, dict) and isinstance(question.get('question'), str):
+                questions[index] = question['question']
+                result.repaired(f"question {index + 1}: convertie en texte")
+            elif not isinstance(question, str) or not question.strip():
+                result.problem('content', f"question {index + 1} vide ou invalide")
+
+    def check_answers(self, result):
+        data = result.data
+        content = data.get('content')
+        questions = content.get('questions') if isinstance(content, dict) else None
+        if not isinstance(questions, list) or not questions:
+            return
+
+        answers = data.get('correct_answers')
+        if isinstance(answers, dict):
+            # {"1": "...", "2": "..."} → list in question order
+            try:
+                answers = [answers[key] for key in sorted(answers, key=lambda key: int(key))]
+                result.repaired("correct_answers converti en liste")
+            except (TypeError, ValueError):
+                answers = list(answers.values())
+        elif isinstance(answers, str):
+            answers = [answers]
+        if not isinstance(answers, list):
+            result.problem('correct_answers', "correct_answers doit être une liste")
+            return
+        if len(answers) > len(questions):
+            answers = answers[:len(questions)]
+            result.repaired("correct_answers tronqué au nombre de questions")
+        if any(not isinstance(answer, str) for answer in answers):
+            answers = [answer if isinstance(answer, str) else str(answer) for answer in answers]
+        data['correct_answers'] = answers
+        if len(answers) < len(questions):
+            result.problem(
+                'correct_answers',
+                f"{len(answers)} correction(s) pour {len(questions)} questions, il manque les questions "
+                f"{', '.join(str(n) for n in range(len(answers) + 1, len(questions) + 1))}"
+            )
+
+
+VALIDATORS = {
+    'qcm': QcmValidator(),
+    'classic': ClassicValidator(),
+}
+_DEFAULT_VALIDATOR = ExerciseValidator()
+
+
+def check_exercise(exercise_data, exercise_type, difficulty=None):
+    """Validate and locally repair a generated exercise; returns a ValidationResult."""
+    return VALIDATORS.get(exercise_type, _DEFAULT_VALIDATOR).check(exercise_data, difficulty)
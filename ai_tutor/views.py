@@ -1,52 +1,164 @@
+import time
 import logging
+from asgiref.sync import sync_to_async
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from django.conf import settings
+from django.urls import reverse
+from .async_api import AsyncAPIView, json_response, sse_response
+from .generation import build_exercise, save_exercises
+from .jobs import enqueue
+from .metrics import metrics
 from .services import AIService
-from exercises.models import Exercise, Subject
+from .singleflight import exercise_generation
+from .stock import claim_exercise, fill_report, record_demand
+from .models import Job
+from .usage import route_report, usage_report
+from .utils import fold_text
+from exercises.models import Exercise
 from exercises.serializers import ExerciseDetailSerializer
+from lessons.models import Lesson
+from lessons.resolvers import resolve_level, subject_resolver
 
 logger = logging.getLogger(__name__)
 
-class ChatView(APIView):
-    permission_classes = [IsAuthenticated]
 
-    def post(self, request):
+def ai_error_response(result):
+    """
+    429 with Retry-After when a limit refused the call, 503 with Retry-After
+    while the circuit breaker is open, 500 otherwise.
+    """
+    if "retry_after" in result:
+        if result.get("unavailable"):
+            code = status.HTTP_503_SERVICE_UNAVAILABLE
+        else:
+            code = status.HTTP_429_TOO_MANY_REQUESTS
+        return json_response(
+            result,
+            status=code,
+            headers={'Retry-After': str(result["retry_after"])}
+        )
+    return json_response(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+async def stream_response(events):
+    """
+    SSE response for a chat stream. The first event is awaited before the
+    response starts, so a refused call still gets a real 429 or 503.
+    """
+    first = await anext(events, None)
+    if first and first["type"] == "error" and "retry_after" in first:
+        return ai_error_response({key: value for key, value in first.items() if key != "type"})
+
+    async def replay():
+        if first:
+            yield first
+        async for event in events:
+            yield event
+
+    return sse_response(replay())
+
+
+def wants_background(request):
+    """True when the client asked for a job (202 + polling) instead of waiting for the answer."""
+    return str(request.data.get('background', '')).lower() in ('1', 'true')
+
+
+def lesson_param(request):
+    """Optional id of the lesson the chat is about; raises ValueError if it is not an integer."""
+    lesson = request.data.get('lesson')
+    if lesson in (None, ''):
+        return None
+    return int(lesson)
+
+
+class ChatView(AsyncAPIView):
+    """
+    Tutor chat, served on the event loop so Groq waits do not hold a worker.
+    With "lesson": <id>, the answer is grounded in the passages of that lesson
+    relevant to the question.
+    """
+
+    async def post(self, request):
         messages = request.data.get('messages', [])
         if not messages:
-            return Response({"error": "No messages provided"}, status=status.HTTP_400_BAD_REQUEST)
-        
+            return json_response({"error": "No messages provided"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            lesson = lesson_param(request)
+        except (TypeError, ValueError):
+            return json_response({"error": "lesson must be a lesson id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if str(request.data.get('stream', '')).lower() in ('1', 'true'):
+            return await stream_response(
+                AIService(request.user).astream_chat_response(messages, level=request.user.level, lesson=lesson)
+            )
+
         try:
-            ai_service = AIService()
-            response = ai_service.get_chat_response(messages)
+            ai_service = AIService(request.user)
+            response = await ai_service.aget_chat_response(messages, level=request.user.level, lesson=lesson)
             
             if "error" in response:
                 logger.error(f"AI Chat Error: {response['error']}")
-                return Response(response, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                return ai_error_response(response)
                 
-            return Response(response)
+            return json_response(response)
         except Exception as e:
             logger.exception("Unexpected error in AI Chat")
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return json_response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class GenerateExerciseView(APIView):
-    permission_classes = [IsAuthenticated]
 
-    # Map any human-readable level name → DB slug code
-    LEVEL_MAP = {
-        'cp1': 'cp1', 'cp2': 'cp2', 'ce1': 'ce1', 'ce2': 'ce2',
-        'cm1': 'cm1', 'cm2': 'cm2',
-        '6ème': 'sixieme', '6eme': 'sixieme', 'sixieme': 'sixieme', '6e': 'sixieme',
-        '5ème': 'cinquieme', '5eme': 'cinquieme', 'cinquieme': 'cinquieme', '5e': 'cinquieme',
-        '4ème': 'quatrieme', '4eme': 'quatrieme', 'quatrieme': 'quatrieme', '4e': 'quatrieme',
-        '3ème': 'troisieme', '3eme': 'troisieme', 'troisieme': 'troisieme', '3e': 'troisieme',
-        'seconde': 'seconde', '2nde': 'seconde',
-        'première': 'premiere', 'premiere': 'premiere', '1ère': 'premiere', '1ere': 'premiere',
-        'terminale': 'terminale', 'tle': 'terminale',
-    }
+class ChatStreamView(AsyncAPIView):
+    """Stream the tutor answer as Server-Sent Events while it is generated."""
+
+    async def post(self, request):
+        messages = request.data.get('messages', [])
+        if not messages:
+            return json_response({"error": "No messages provided"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            lesson = lesson_param(request)
+        except (TypeError, ValueError):
+            return json_response({"error": "lesson must be a lesson id"}, status=status.HTTP_400_BAD_REQUEST)
+        return await stream_response(
+            AIService(request.user).astream_chat_response(messages, level=request.user.level, lesson=lesson)
+        )
+
+
+class MetricsView(APIView):
+    """Expose the in-process AI metrics of this worker."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
+
+
+class UsageReportView(APIView):
+    """LLM consumption over the last days: totals, top users, features and models by cost, routing rules."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            days = max(1, min(int(request.query_params.get('days', 30)), 366))
+        except ValueError:
+            return Response({"error": "days must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        report = usage_report(days=days)
+        # Per-call records are kept AI_USAGE_RETENTION_DAYS days only
+        report['by_route'] = route_report(days=min(days, settings.AI_USAGE_RETENTION_DAYS))
+        return Response(report)
+
+
+class ExerciseStockView(APIView):
+    """Fill level of the pre-generated exercise stock."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(fill_report())
 
-    def post(self, request):
+
+class GenerateExerciseView(AsyncAPIView):
+
+    async def post(self, request):
         subject_name = request.data.get('subject')
         level_raw = request.data.get('level', '')
         topic = request.data.get('topic')
@@ -55,51 +167,239 @@ class GenerateExerciseView(APIView):
         language = request.data.get('language', 'fr')
         
         if not all([subject_name, level_raw, topic]):
-            return Response({"error": "Missing required parameters"}, status=status.HTTP_400_BAD_REQUEST)
+            return json_response({"error": "Missing required parameters"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Normalize level to DB code
-        level = self.LEVEL_MAP.get(level_raw.lower(), level_raw.lower())
+        level = resolve_level(level_raw) or level_raw.lower()
 
-        # Find subject - more robust lookup
-        subject = Subject.objects.filter(name__iexact=subject_name).first()
-        if not subject:
-             subject = Subject.objects.filter(name__icontains=subject_name).first()
+        subject = await self._find_subject(subject_name)
         if not subject:
-             # Try search by slug
-             subject = Subject.objects.filter(slug__iexact=subject_name.lower().replace(' ', '-')).first()
-        
-        if not subject:
-            logger.warning(f"Subject '{subject_name}' not found in DB. Available subjects: {list(Subject.objects.values_list('name', flat=True))}")
-            return Response({"error": f"Matière '{subject_name}' non trouvée. Vérifiez que la matière est créée dans l'administration."}, status=status.HTTP_404_NOT_FOUND)
+            return self._subject_not_found(subject_name)
 
-        ai_service = AIService()
-        exercise_data = ai_service.generate_exercise(subject.name, level_raw, topic, difficulty, exercise_type, language)
+        # Serve a pre-generated exercise when the stock has one for this slot
+        use_stock = settings.AI_EXERCISE_STOCK_ENABLED and level in dict(Lesson.LEVEL_CHOICES)
+        if use_stock:
+            exercise = await sync_to_async(self._claim_from_stock)(
+                request.user, subject, level, difficulty, exercise_type, language, topic
+            )
+            if exercise:
+                logger.info(f"AI Exercise {exercise.id} served from stock for user {request.user}")
+                return await self._exercise_response(request, exercise, 'stock')
+
+        if wants_background(request):
+            return await self._enqueue(request, subject, level, level_raw, topic, difficulty, exercise_type, language)
+
+        # Sharing only makes sense when identical requests are coalesced; otherwise
+        # every request would publish its own ownerless exercise
+        share_exercise = settings.AI_GENERATION_SHARE_EXERCISE and settings.AI_GENERATION_SINGLEFLIGHT_ENABLED
+
+        async def generate():
+            exercise_data = await AIService(request.user).agenerate_exercise(subject.name, level_raw, topic, difficulty, exercise_type, language)
+            if share_exercise and "error" not in exercise_data:
+                # Shared mode: the leader saves one public, ownerless exercise for every
+                # coalesced request (a private one would be hidden from the followers)
+                exercise = build_exercise(exercise_data, subject, level, exercise_type, difficulty)
+                exercise.visibility = Exercise.PUBLIC
+                await exercise.asave()
+                return {"exercise_id": exercise.id}
+            return exercise_data
+
+        # Identical concurrent requests (a whole class on the same topic) share one LLM call
+        coalesced = False
+        if settings.AI_GENERATION_SINGLEFLIGHT_ENABLED:
+            flight_key = exercise_generation.make_key(
+                subject.id, level, fold_text(topic), difficulty, exercise_type, language, share_exercise
+            )
+            exercise_data, coalesced = await exercise_generation.ado(flight_key, generate)
+        else:
+            exercise_data = await generate()
 
         if "error" in exercise_data:
             logger.error(f"AI Exercise Generation Error: {exercise_data['error']}")
-            return Response(exercise_data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return ai_error_response(exercise_data)
 
         try:
-            # Save the exercise to the database
-            exercise = Exercise.objects.create(
-                title=exercise_data.get('title', f"Exercice de {subject.name}"),
-                description=exercise_data.get('description', ''),
-                subject=subject,
-                level=level,
-                exercise_type=exercise_type,
-                difficulty=difficulty,
-                content=exercise_data.get('content', {}),
-                correct_answers=exercise_data.get('correct_answers', []),
-                explanation=exercise_data.get('explanation', ''),
-                hints=exercise_data.get('hints', []),
-                points=int(exercise_data.get('points', 10)),
-                creator=request.user,
-                is_ai_generated=True
-            )
+            if "exercise_id" in exercise_data:
+                exercise = await Exercise.objects.select_related('subject').aget(pk=exercise_data["exercise_id"])
+            else:
+                # Save the exercise to the database
+                exercise = build_exercise(exercise_data, subject, level, exercise_type, difficulty, creator=request.user)
+                await exercise.asave()
             logger.info(f"AI Exercise saved with ID {exercise.id} for user {request.user}")
-            
-            serializer = ExerciseDetailSerializer(exercise, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return await self._exercise_response(request, exercise, 'coalesced' if coalesced else 'live')
         except Exception as e:
             logger.error(f"Error saving AI exercise: {str(e)}", exc_info=True)
-            return Response({"error": f"Erreur lors de la sauvegarde de l'exercice : {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return json_response({"error": f"Erreur lors de la sauvegarde de l'exercice : {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    async def _find_subject(self, subject_name):
+        # Names, slugs and aliases of the active subjects, accent-insensitive and typo-tolerant
+        subject = await subject_resolver.aresolve(subject_name)
+        if not subject:
+            suggestions = await sync_to_async(subject_resolver.suggestions)(subject_name)
+            logger.warning(f"Subject '{subject_name}' not found. Closest subjects: {suggestions}")
+        return subject
+
+    def _subject_not_found(self, subject_name):
+        return json_response({"error": f"Matière '{subject_name}' non trouvée. Vérifiez que la matière est créée dans l'administration."}, status=status.HTTP_404_NOT_FOUND)
+
+    def _claim_from_stock(self, user, subject, level, difficulty, exercise_type, language, topic):
+        """Record the demand and claim a stocked exercise (transactional, runs in a thread)."""
+        try:
+            record_demand(subject, level, difficulty, exercise_type, language, topic)
+            return claim_exercise(user, subject, level, difficulty, exercise_type, language, topic)
+        except Exception:
+            logger.exception("Exercise stock lookup failed, falling back to live generation")
+            return None
+
+    async def _enqueue(self, request, subject, level, level_raw, topic, difficulty, exercise_type, language, count=1):
+        """Queue the generation for `run_workers` and answer 202 with the job to poll."""
+        job = await sync_to_async(enqueue)('generate_exercises', {
+            'subject_id': subject.id,
+            'level': level,
+            'level_label': level_raw,
+            'topic': topic,
+            'difficulty': difficulty,
+            'exercise_type': exercise_type,
+            'language': language,
+            'count': count,
+        }, user=request.user)
+        status_url = reverse('ai-job', args=[job.pk])
+        logger.info(f"AI exercise generation queued as job {job.pk} for user {request.user}")
+        return json_response(
+            {"job_id": job.pk, "status": job.status, "status_url": status_url},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': status_url}
+        )
+
+    async def _exercise_response(self, request, exercise, source):
+        serializer = ExerciseDetailSerializer(exercise, context={'request': request})
+        # Serializer fields (attempts, resources) query the database
+        data = await sync_to_async(lambda: serializer.data)()
+        return json_response(data, status=status.HTTP_201_CREATED, headers={'X-Exercise-Source': source})
+
+
+class GenerateExerciseBatchView(GenerateExerciseView):
+    """
+    Generate a worksheet of ``count`` exercises with a few Groq calls instead
+    of one call per exercise. Each exercise is validated on its own: the
+    valid ones are saved together and returned, the others are reported.
+    """
+
+    async def post(self, request):
+        subject_name = request.data.get('subject')
+        level_raw = request.data.get('level', '')
+        topic = request.data.get('topic')
+        difficulty = request.data.get('difficulty', 'medium')
+        exercise_type = request.data.get('exercise_type', 'qcm')
+        language = request.data.get('language', 'fr')
+
+        if not all([subject_name, level_raw, topic]):
+            return json_response({"error": "Missing required parameters"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            count = int(request.data.get('count', 5))
+        except (TypeError, ValueError):
+            count = 0
+        if not 1 <= count <= settings.AI_EXERCISE_BATCH_MAX:
+            return json_response(
+                {"error": f"count must be between 1 and {settings.AI_EXERCISE_BATCH_MAX}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        level = resolve_level(level_raw) or level_raw.lower()
+        subject = await self._find_subject(subject_name)
+        if not subject:
+            return self._subject_not_found(subject_name)
+        if wants_background(request):
+            return await self._enqueue(request, subject, level, level_raw, topic, difficulty, exercise_type, language, count)
+
+        started = time.monotonic()
+        result = await AIService(request.user).agenerate_exercises(
+            subject.name, level_raw, topic, count, difficulty, exercise_type, language
+        )
+        if "error" in result:
+            logger.error(f"AI Exercise Batch Generation Error: {result['error']}")
+            return ai_error_response(result)
+
+        exercises, errors = [], [{"error": error} for error in result["errors"]]
+        for index, exercise_data in enumerate(result["exercises"]):
+            # Already validated and repaired by the service
+            if "error" in exercise_data:
+                errors.append({"index": index, "error": exercise_data["error"]})
+                continue
+            exercises.append(build_exercise(exercise_data, subject, level, exercise_type, difficulty, creator=request.user))
+        metrics.incr('exercise_batch.invalid', len(errors))
+
+        if not exercises:
+            return json_response(
+                {"error": "Aucun exercice valide n'a été généré.", "errors": errors},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+
+        try:
+            data = await sync_to_async(self._save_batch)(request, exercises)
+        except Exception as e:
+            logger.error(f"Error saving AI exercise batch: {str(e)}", exc_info=True)
+            return json_response({"error": f"Erreur lors de la sauvegarde des exercices : {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        latency_ms = (time.monotonic() - started) * 1000
+        metrics.incr('exercise_batch.created', len(exercises))
+        metrics.observe('exercise_batch.latency_ms', latency_ms)
+        logger.info(f"AI exercise batch: {len(exercises)}/{count} saved in {latency_ms:.0f} ms for user {request.user}")
+        return json_response({
+            "requested": count,
+            "created": len(exercises),
+            "exercises": data,
+            "errors": errors,
+        }, status=status.HTTP_201_CREATED)
+
+    def _save_batch(self, request, exercises):
+        """Insert the exercises in one query and serialize them (runs in a thread)."""
+        exercises = save_exercises(exercises)
+        return ExerciseDetailSerializer(exercises, many=True, context={'request': request}).data
+
+
+class JobView(APIView):
+    """
+    Status of a background generation job. Once it succeeded the generated
+    exercises are returned with it; poll again after Retry-After otherwise.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = Job.objects.filter(pk=pk).first()
+        if job is None or (job.user_id != request.user.id and not request.user.is_staff):
+            return Response({"error": "Tâche introuvable."}, status=status.HTTP_404_NOT_FOUND)
+        data = job_data(job)
+        if job.status == Job.SUCCEEDED and job.result:
+            exercises = Exercise.objects.filter(pk__in=job.result.get('exercise_ids', [])).select_related('subject')
+            data["exercises"] = ExerciseDetailSerializer(exercises, many=True, context={'request': request}).data
+            return Response(data)
+        if job.status == Job.FAILED:
+            return Response(data)
+        return Response(data, headers={'Retry-After': str(settings.AI_JOB_POLL_AFTER)})
+
+
+class JobListView(APIView):
+    """Latest background jobs of the current user."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        jobs = Job.objects.filter(user=request.user)[:settings.AI_JOB_LIST_SIZE]
+        return Response([job_data(job) for job in jobs])
+
+
+def job_data(job):
+    result = job.result or {}
+    return {
+        "id": job.pk,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "requested": result.get("requested", job.payload.get("count")),
+        "created": len(result.get("exercise_ids", [])),
+        "errors": result.get("errors", []),
+    }
@@ -102,6 +102,18 @@ else:
         }
     }
 
+# Cache: local memory by default, set CACHE_BACKEND to share it between workers
+# (e.g. django.core.cache.backends.db.DatabaseCache + "python manage.py createcachetable")
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'tuteur-cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 5000)),
+        },
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -229,6 +241,143 @@ else:
     # Relaxed security for development
     X_FRAME_OPTIONS = 'SAMEORIGIN'
 
+# AI tutor (Groq) - OpenAI-compatible endpoint. Point it at
+# "python manage.py fake_llm_server" to benchmark without network.
+AI_BASE_URL = os.getenv('AI_BASE_URL', 'https://api.groq.com/openai/v1')
+
+# AI tutor (Groq) - pooled HTTP client shared by each worker process
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv('AI_HTTP_MAX_CONNECTIONS', 20))
+AI_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('AI_HTTP_MAX_KEEPALIVE_CONNECTIONS', 10))
+AI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('AI_HTTP_KEEPALIVE_EXPIRY', 60))
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv('AI_HTTP_CONNECT_TIMEOUT', 5))
+AI_HTTP_READ_TIMEOUT = float(os.getenv('AI_HTTP_READ_TIMEOUT', 60))
+
+# Chat answer cache: 'memory' (per-process LRU) or 'django' (CACHES alias, shared)
+AI_CHAT_CACHE_ENABLED = os.getenv('AI_CHAT_CACHE_ENABLED', 'True') == 'True'
+AI_CHAT_CACHE_BACKEND = os.getenv('AI_CHAT_CACHE_BACKEND', 'memory')
+AI_CHAT_CACHE_ALIAS = 'default'
+AI_CHAT_CACHE_TTL = int(os.getenv('AI_CHAT_CACHE_TTL', 24 * 3600))
+AI_CHAT_CACHE_MAX_ENTRIES = int(os.getenv('AI_CHAT_CACHE_MAX_ENTRIES', 2000))
+# Only conversations with at most this many student messages are cached
+AI_CHAT_CACHE_MAX_TURNS = int(os.getenv('AI_CHAT_CACHE_MAX_TURNS', 1))
+
+# Chat history windowing: system prompt + last turns within the token budget,
+# older turns folded into a cached rolling summary
+AI_CHAT_TOKEN_BUDGET = int(os.getenv('AI_CHAT_TOKEN_BUDGET', 3000))
+AI_CHAT_KEEP_TURNS = int(os.getenv('AI_CHAT_KEEP_TURNS', 6))
+AI_CHAT_SUMMARY_MODEL = os.getenv('AI_CHAT_SUMMARY_MODEL', 'llama-3.1-8b-instant')
+AI_CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('AI_CHAT_SUMMARY_MAX_TOKENS', 300))
+AI_CHAT_SUMMARY_CACHE_ALIAS = 'default'
+AI_CHAT_SUMMARY_TTL = int(os.getenv('AI_CHAT_SUMMARY_TTL', 24 * 3600))
+
+# Pre-generated exercise stock (filled by "python manage.py refill_exercise_stock")
+AI_EXERCISE_STOCK_ENABLED = os.getenv('AI_EXERCISE_STOCK_ENABLED', 'True') == 'True'
+AI_EXERCISE_STOCK_TARGET = int(os.getenv('AI_EXERCISE_STOCK_TARGET', 3))
+AI_EXERCISE_STOCK_MAX_SLOTS = int(os.getenv('AI_EXERCISE_STOCK_MAX_SLOTS', 50))
+AI_EXERCISE_STOCK_MIN_REQUESTS = int(os.getenv('AI_EXERCISE_STOCK_MIN_REQUESTS', 2))
+AI_EXERCISE_STOCK_DEMAND_DAYS = int(os.getenv('AI_EXERCISE_STOCK_DEMAND_DAYS', 14))
+
+# Single-flight coalescing of identical exercise generations. Coalescing across
+# workers needs a shared CACHES backend; with local memory it is per process.
+AI_GENERATION_SINGLEFLIGHT_ENABLED = os.getenv('AI_GENERATION_SINGLEFLIGHT_ENABLED', 'True') == 'True'
+# False: each student gets their own copy; True: one public exercise without creator is shared
+AI_GENERATION_SHARE_EXERCISE = os.getenv('AI_GENERATION_SHARE_EXERCISE', 'False') == 'True'
+AI_SINGLEFLIGHT_CACHE_ALIAS = 'default'
+AI_SINGLEFLIGHT_LOCK_TIMEOUT = int(os.getenv('AI_SINGLEFLIGHT_LOCK_TIMEOUT', 90))
+AI_SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv('AI_SINGLEFLIGHT_WAIT_TIMEOUT', 60))
+AI_SINGLEFLIGHT_RESULT_TTL = int(os.getenv('AI_SINGLEFLIGHT_RESULT_TTL', 15))
+AI_SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv('AI_SINGLEFLIGHT_POLL_INTERVAL', 0.25))
+
+# Batch exercise generation (worksheets): exercises per request and per Groq call
+AI_EXERCISE_BATCH_MAX = int(os.getenv('AI_EXERCISE_BATCH_MAX', 20))
+AI_EXERCISE_BATCH_PER_CALL = int(os.getenv('AI_EXERCISE_BATCH_PER_CALL', 10))
+
+# Background jobs (DB queue processed by `manage.py run_workers`): requests
+# with "background": true get a 202 and a job to poll
+AI_JOB_MAX_ATTEMPTS = int(os.getenv('AI_JOB_MAX_ATTEMPTS', 3))
+AI_JOB_RETRY_BASE_DELAY = float(os.getenv('AI_JOB_RETRY_BASE_DELAY', 5))
+AI_JOB_RETRY_MAX_DELAY = float(os.getenv('AI_JOB_RETRY_MAX_DELAY', 300))
+AI_JOB_LEASE_TIMEOUT = int(os.getenv('AI_JOB_LEASE_TIMEOUT', 600))
+AI_JOB_POLL_INTERVAL = float(os.getenv('AI_JOB_POLL_INTERVAL', 1))
+AI_JOB_CLAIM_CANDIDATES = int(os.getenv('AI_JOB_CLAIM_CANDIDATES', 5))
+AI_JOB_POLL_AFTER = int(os.getenv('AI_JOB_POLL_AFTER', 2))
+AI_JOB_LIST_SIZE = int(os.getenv('AI_JOB_LIST_SIZE', 20))
+
+# Groq call resilience: per-attempt timeout and overall deadline (seconds),
+# jittered retries on 429/5xx/timeouts, circuit breaker per model
+AI_CALL_TIMEOUT = float(os.getenv('AI_CALL_TIMEOUT', 20))
+AI_CALL_DEADLINE = float(os.getenv('AI_CALL_DEADLINE', 30))
+AI_RETRY_ATTEMPTS = int(os.getenv('AI_RETRY_ATTEMPTS', 2))
+AI_RETRY_BASE_DELAY = float(os.getenv('AI_RETRY_BASE_DELAY', 0.5))
+AI_RETRY_MAX_DELAY = float(os.getenv('AI_RETRY_MAX_DELAY', 8))
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv('AI_BREAKER_FAILURE_THRESHOLD', 5))
+AI_BREAKER_RESET_TIMEOUT = float(os.getenv('AI_BREAKER_RESET_TIMEOUT', 30))
+# Models tried in order when the chat model fails or its circuit is open
+AI_CHAT_FALLBACK_MODELS = [m.strip() for m in os.getenv('AI_CHAT_FALLBACK_MODELS', 'llama-3.1-8b-instant').split(',') if m.strip()]
+
+# Lesson grounding of the tutor chat: in-process BM25 index over the lessons,
+# optionally loaded from a snapshot written by `manage.py build_lesson_index`
+AI_LESSON_INDEX_ENABLED = os.getenv('AI_LESSON_INDEX_ENABLED', 'True') == 'True'
+AI_LESSON_INDEX_PATH = os.getenv('AI_LESSON_INDEX_PATH', str(BASE_DIR / 'var' / 'lesson_index.pickle'))
+AI_LESSON_PASSAGE_TOKENS = int(os.getenv('AI_LESSON_PASSAGE_TOKENS', 120))
+AI_LESSON_TOP_K = int(os.getenv('AI_LESSON_TOP_K', 3))
+
+# Model routing: the first matching rule gives the model and max_tokens of a
+# call (conditions documented in ai_tutor/routing.py). Short questions without
+# maths go to the small fast model, generations stay on the large one.
+AI_ROUTING_ENABLED = os.getenv('AI_ROUTING_ENABLED', 'True') == 'True'
+AI_ROUTING_RULES = [
+    {'name': 'chat_primary_short', 'task': 'chat', 'max_level': 'cm2', 'max_message_tokens': 60,
+     'math': False, 'model': 'llama-3.1-8b-instant', 'max_tokens': 400},
+    {'name': 'chat_short', 'task': 'chat', 'max_message_tokens': 25, 'max_context_tokens': 1500,
+     'math': False, 'model': 'llama-3.1-8b-instant', 'max_tokens': 500},
+    {'name': 'chat_math', 'task': 'chat', 'math': True, 'model': 'llama-3.3-70b-versatile', 'max_tokens': 1024},
+    {'name': 'chat', 'task': 'chat', 'model': 'llama-3.3-70b-versatile', 'max_tokens': 800},
+    {'name': 'exercise', 'task': ['exercise', 'exercise_batch', 'exercise_repair'], 'model': 'llama-3.3-70b-versatile'},
+]
+
+# Limits around every Groq call, enforced per worker process (divide the global
+# values by the number of workers). Requests over the limits wait in a bounded
+# queue up to AI_LIMIT_QUEUE_TIMEOUT seconds, otherwise they get a 429.
+# A rate or in-flight maximum of 0 disables that limit.
+AI_LIMITS_ENABLED = os.getenv('AI_LIMITS_ENABLED', 'True') == 'True'
+AI_GLOBAL_REQUESTS_PER_MINUTE = float(os.getenv('AI_GLOBAL_REQUESTS_PER_MINUTE', 300))
+AI_GLOBAL_BURST = int(os.getenv('AI_GLOBAL_BURST', 30))
+AI_GLOBAL_MAX_IN_FLIGHT = int(os.getenv('AI_GLOBAL_MAX_IN_FLIGHT', 40))
+AI_USER_REQUESTS_PER_MINUTE = float(os.getenv('AI_USER_REQUESTS_PER_MINUTE', 20))
+AI_USER_BURST = int(os.getenv('AI_USER_BURST', 5))
+AI_USER_MAX_IN_FLIGHT = int(os.getenv('AI_USER_MAX_IN_FLIGHT', 2))
+AI_LIMIT_QUEUE_SIZE = int(os.getenv('AI_LIMIT_QUEUE_SIZE', 200))
+AI_LIMIT_QUEUE_TIMEOUT = float(os.getenv('AI_LIMIT_QUEUE_TIMEOUT', 20))
+
+# LLM call ledger: records are buffered and written in batches by a background
+# thread; "python manage.py rollup_llm_usage" builds the daily rollups
+AI_USAGE_ENABLED = os.getenv('AI_USAGE_ENABLED', 'True') == 'True'
+AI_USAGE_BATCH_SIZE = int(os.getenv('AI_USAGE_BATCH_SIZE', 200))
+AI_USAGE_FLUSH_INTERVAL = float(os.getenv('AI_USAGE_FLUSH_INTERVAL', 5))
+# Records kept in memory at most when the database is unavailable
+AI_USAGE_MAX_BUFFER = int(os.getenv('AI_USAGE_MAX_BUFFER', 10000))
+AI_USAGE_RETENTION_DAYS = int(os.getenv('AI_USAGE_RETENTION_DAYS', 90))
+# Groq prices in USD per million tokens: (prompt, completion)
+AI_MODEL_PRICES = {
+    'llama-3.3-70b-versatile': (0.59, 0.79),
+    'llama-3.1-8b-instant': (0.05, 0.08),
+}
+
+# Shared catalogue responses (lessons by level, exercises by lesson), keyed by a
+# content version bumped on every change; per process with local memory CACHES
+CONTENT_CACHE_ENABLED = os.getenv('CONTENT_CACHE_ENABLED', 'True') == 'True'
+CONTENT_CACHE_ALIAS = 'default'
+CONTENT_CACHE_TTL = int(os.getenv('CONTENT_CACHE_TTL', 600))
+
+# Offline bundles of the mobile app (one compressed JSON file per subject and
+# level), rebuilt when their content changes; kept out of MEDIA_ROOT uploads
+CONTENT_BUNDLE_ROOT = Path(os.getenv('CONTENT_BUNDLE_ROOT', BASE_DIR / 'var' / 'bundles'))
+
+# Subject lookup of free-text inputs ("maths", "histoire geo"): in-memory index
+# per process, invalidated on save in this process and reloaded after this TTL
+SUBJECT_RESOLVER_TTL = float(os.getenv('SUBJECT_RESOLVER_TTL', 300))
+
 # Logging configuration
 LOGGING = {
     'version': 1,
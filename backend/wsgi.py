@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Build the lesson retrieval index of this worker in the background
+from ai_tutor.retrieval import warm_lesson_index  # noqa: E402
+warm_lesson_index()
@@ -2,7 +2,7 @@
 Admin pour les exercices.
 """
 from django.contrib import admin
-from .models import Exercise, ExerciseAttempt, Quiz, QuizAttempt, ExerciseResource
+from .models import Exercise, ExerciseAttempt, ExerciseAttemptSummary, Quiz, QuizAttempt, ExerciseResource
 
 
 class ExerciseResourceInline(admin.TabularInline):
@@ -19,7 +19,7 @@ class ExerciseAdmin(admin.ModelAdmin):
         'title', 'exercise_type', 'difficulty', 'level',
         'subject', 'points', 'order', 'is_active'
     ]
-    list_filter = ['exercise_type', 'difficulty', 'level', 'subject', 'is_active']
+    list_filter = ['exercise_type', 'difficulty', 'level', 'subject', 'visibility', 'is_active']
     search_fields = ['title', 'description']
     inlines = [ExerciseResourceInline]
 
@@ -36,6 +36,22 @@ class ExerciseAttemptAdmin(admin.ModelAdmin):
     search_fields = ['student__username', 'exercise__title']
 
 
+@admin.register(ExerciseAttemptSummary)
+class ExerciseAttemptSummaryAdmin(admin.ModelAdmin):
+    """Admin pour les résumés de tentatives (calculés, en lecture seule)."""
+    
+    list_display = [
+        'student', 'exercise', 'attempt_count', 'best_score',
+        'last_score', 'last_at', 'first_correct_at'
+    ]
+    list_filter = ['last_at']
+    search_fields = ['student__username', 'exercise__title']
+    readonly_fields = [
+        'student', 'exercise', 'attempt_count', 'best_score',
+        'last_score', 'last_at', 'first_correct_at'
+    ]
+
+
 class ExerciseInline(admin.TabularInline):
     """Inline pour les exercices dans un quiz."""
     model = Quiz.exercises.through
@@ -8,3 +8,6 @@ class ExercisesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'exercises'
     verbose_name = 'Exercices'
+
+    def ready(self):
+        from . import signals  # noqa: F401
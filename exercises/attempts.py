@@ -0,0 +1,98 @@
+"""
+Enregistrement des tentatives et tenue des résumés par (élève, exercice).
+
+La ligne ExerciseAttemptSummary de l'élève sur l'exercice est verrouillée
+(SELECT ... FOR UPDATE) avant l'insertion d'une tentative : son compteur
+donne le numéro de la tentative, sans requête sur la dernière tentative ni
+doublon de numéro entre deux soumissions simultanées.
+"""
+from django.db import transaction
+from django.db.models import Count, Max, Min, OuterRef, Q, Subquery
+from .models import ExerciseAttempt, ExerciseAttemptSummary
+
+SUMMARY_FIELDS = ['attempt_count', 'best_score', 'last_score', 'last_at', 'first_correct_at']
+
+
+def summarize(attempts):
+    """Résumés (non enregistrés) calculés à partir d'un queryset de tentatives."""
+    last_score = ExerciseAttempt.objects.filter(
+        student=OuterRef('student'), exercise=OuterRef('exercise')
+    ).order_by('-created_at', '-id').values('score')[:1]
+    rows = attempts.order_by().values('student_id', 'exercise_id').annotate(
+        attempt_count=Count('id'),
+        best_score=Max('score'),
+        last_at=Max('created_at'),
+        first_correct_at=Min('created_at', filter=Q(is_correct=True)),
+        last_score=Subquery(last_score),
+    )
+    for row in rows.iterator():
+        yield ExerciseAttemptSummary(**row)
+
+
+def _locked(student, exercise_ids):
+    summaries = ExerciseAttemptSummary.objects.select_for_update().filter(
+        student=student, exercise_id__in=exercise_ids
+    ).order_by('exercise_id')
+    return {summary.exercise_id: summary for summary in summaries}
+
+
+def lock_summaries(student, attempts):
+    """
+    Verrouiller les résumés des exercices tentés (en les créant au besoin) et
+    numéroter les tentatives. À appeler dans une transaction, avant l'insertion.
+    """
+    exercise_ids = {attempt.exercise_id for attempt in attempts}
+    summaries = _locked(student, exercise_ids)
+    missing = exercise_ids - set(summaries)
+    if missing:
+        # Première tentative, ou tentatives enregistrées avant l'existence des résumés
+        created = {summary.exercise_id: summary for summary in summarize(
+            ExerciseAttempt.objects.filter(student=student, exercise_id__in=missing)
+        )}
+        for exercise_id in missing - set(created):
+            created[exercise_id] = ExerciseAttemptSummary(student=student, exercise_id=exercise_id)
+        ExerciseAttemptSummary.objects.bulk_create(created.values(), ignore_conflicts=True)
+        summaries = _locked(student, exercise_ids)
+
+    for attempt in attempts:
+        summary = summaries[attempt.exercise_id]
+        summary.attempt_count += 1
+        attempt.attempt_number = summary.attempt_count
+    return summaries
+
+
+def update_summaries(summaries, attempts):
+    """Reporter dans les résumés verrouillés les tentatives qui viennent d'être insérées."""
+    for attempt in attempts:
+        summary = summaries[attempt.exercise_id]
+        summary.best_score = max(summary.best_score, attempt.score)
+        summary.last_score = attempt.score
+        summary.last_at = attempt.created_at
+        if attempt.is_correct and summary.first_correct_at is None:
+            summary.first_correct_at = attempt.created_at
+    ExerciseAttemptSummary.objects.bulk_update(list(summaries.values()), SUMMARY_FIELDS)
+
+
+def record_attempts(student, attempts):
+    """Insérer en une requête des tentatives d'un élève, numérotées, et mettre à jour ses résumés."""
+    if not attempts:
+        return attempts
+    with transaction.atomic():
+        summaries = lock_summaries(student, attempts)
+        ExerciseAttempt.objects.bulk_create(attempts)
+        update_summaries(summaries, attempts)
+    return attempts
+
+
+def rebuild_summaries(batch_size=1000):
+    """Recalculer tous les résumés à partir des tentatives ; renvoie leur nombre."""
+    count, batch = 0, []
+    with transaction.atomic():
+        ExerciseAttemptSummary.objects.all().delete()
+        for summary in summarize(ExerciseAttempt.objects.all()):
+            batch.append(summary)
+            if len(batch) >= batch_size:
+                ExerciseAttemptSummary.objects.bulk_create(batch)
+                count, batch = count + len(batch), []
+        ExerciseAttemptSummary.objects.bulk_create(batch)
+    return count + len(batch)
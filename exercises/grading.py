@@ -0,0 +1,160 @@
+"""
+Correction des exercices.
+
+La clé de correction (``Exercise.answer_key``) est la forme canonique de
+``correct_answers`` : elle est calculée une fois à l'enregistrement de
+l'exercice, si bien qu'une soumission ne normalise plus que la réponse de
+l'élève avant de la comparer à la clé.
+
+Chaque type d'exercice a son correcteur, enregistré avec ``@grader(type)``.
+"""
+import re
+import math
+from typing import NamedTuple
+
+# À incrémenter quand une normalisation change : les clés plus anciennes
+# sont recalculées à la volée (puis par ``manage.py build_answer_keys``)
+KEY_VERSION = 1
+
+GRADERS = {}
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_OPTION_LETTERS = 'ABCD'
+
+
+class Grade(NamedTuple):
+    is_correct: bool
+    score: int
+    max_score: int
+
+
+def grader(*exercise_types):
+    """Enregistrer une classe de correcteur pour un ou plusieurs types d'exercice."""
+    def register(cls):
+        for exercise_type in exercise_types:
+            GRADERS[exercise_type] = cls()
+        return cls
+    return register
+
+
+class ExactGrader:
+    """Réponse identique à la correction (types sans normalisation particulière)."""
+
+    def canonical(self, value):
+        return value
+
+    def build_key(self, correct_answers):
+        return self.canonical(correct_answers)
+
+    def grade(self, key, answer, points):
+        is_correct = self.canonical(answer) == key
+        return Grade(is_correct, points if is_correct else 0, points)
+
+    def max_score(self, key, points):
+        return points
+
+
+def qcm_option(value):
+    """Option de QCM sous forme canonique : index en texte ('B', 1 et '1' -> '1')."""
+    if isinstance(value, int):
+        return str(value)
+    text = str(value).strip()
+    if len(text) == 1 and text.upper() in _OPTION_LETTERS:
+        return str(_OPTION_LETTERS.index(text.upper()))
+    if text.isdigit():
+        return str(int(text))
+    return text.upper()
+
+
+@grader('qcm')
+class QCMGrader(ExactGrader):
+    """Une option par question ; une liste de réponses est notée question par question."""
+
+    def canonical(self, value):
+        if isinstance(value, list):
+            return [qcm_option(option) for option in value]
+        return qcm_option(value)
+
+    def grade(self, key, answer, points):
+        answer = self.canonical(answer)
+        if isinstance(key, list) and isinstance(answer, list):
+            correct_count = sum(1 for given, expected in zip(answer, key) if given == expected)
+            return Grade(correct_count == len(key), correct_count, len(key))
+        return super().grade(key, answer, points)
+
+    def max_score(self, key, points):
+        # Un point par question quand la correction est une liste
+        return len(key) if isinstance(key, list) else points
+
+
+def normalize_text(value):
+    return _WHITESPACE_RE.sub(' ', str(value)).strip().casefold()
+
+
+@grader('text')
+class TextGrader(ExactGrader):
+    """Texte sans tenir compte de la casse ni des espaces superflus."""
+
+    def canonical(self, value):
+        return normalize_text(value)
+
+
+@grader('classic')
+class ClassicGrader(ExactGrader):
+    """Fiche d'exercices à correction rédigée : jamais comptée juste automatiquement."""
+
+    def grade(self, key, answer, points):
+        return Grade(False, 0, points)
+
+
+@grader('number')
+class NumberGrader(ExactGrader):
+    """Valeur numérique ; une réponse illisible n'est jamais correcte."""
+
+    def canonical(self, value):
+        try:
+            number = float(str(value).strip().replace(',', '.'))
+        except (TypeError, ValueError):
+            return None
+        return number if math.isfinite(number) else None
+
+    def grade(self, key, answer, points):
+        answer = self.canonical(answer)
+        is_correct = key is not None and answer == key
+        return Grade(is_correct, points if is_correct else 0, points)
+
+
+@grader('matching', 'ordering', 'fill_blank')
+class StructureGrader(ExactGrader):
+    """Associations, ordre ou textes à trous : la structure doit être identique."""
+
+
+def get_grader(exercise_type):
+    return GRADERS.get(exercise_type) or ExactGrader()
+
+
+def build_answer_key(exercise_type, correct_answers):
+    """Clé de correction à stocker dans ``Exercise.answer_key``."""
+    return {
+        'version': KEY_VERSION,
+        'type': exercise_type,
+        'key': get_grader(exercise_type).build_key(correct_answers),
+    }
+
+
+def answer_key(exercise):
+    """Clé canonique de l'exercice ; recalculée si la clé stockée est absente ou périmée."""
+    stored = exercise.answer_key
+    if stored and stored.get('version') == KEY_VERSION and stored.get('type') == exercise.exercise_type:
+        return stored['key']
+    return build_answer_key(exercise.exercise_type, exercise.correct_answers)['key']
+
+
+def max_score(exercise):
+    """Score maximal de l'exercice, par exemple pour une question laissée sans réponse."""
+    return get_grader(exercise.exercise_type).max_score(answer_key(exercise), exercise.points)
+
+
+def grade_answer(exercise, answer):
+    """Corriger la réponse d'un élève ; renvoie un ``Grade`` (score avant pénalité d'indices)."""
+    return get_grader(exercise.exercise_type).grade(answer_key(exercise), answer, exercise.points)
@@ -0,0 +1,42 @@
+"""
+Calcule la clé de correction des exercices existants.
+
+    python manage.py build_answer_keys          # clés absentes ou d'une version antérieure
+    python manage.py build_answer_keys --all    # toutes les clés
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from exercises.grading import build_answer_key
+from exercises.models import Exercise
+
+
+class Command(BaseCommand):
+    help = "Calcule la clé de correction (answer_key) des exercices enregistrés avant son introduction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recalculer aussi les clés à jour.')
+        parser.add_argument('--batch-size', type=int, default=500, help="Nombre d'exercices mis à jour par requête.")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        exercises = Exercise.objects.only('id', 'exercise_type', 'correct_answers', 'answer_key').order_by('id')
+        checked, updated, batch = 0, 0, []
+        for exercise in exercises.iterator(chunk_size=batch_size):
+            checked += 1
+            key = build_answer_key(exercise.exercise_type, exercise.correct_answers)
+            if not options['all'] and exercise.answer_key == key:
+                continue
+            exercise.answer_key = key
+            batch.append(exercise)
+            if len(batch) >= batch_size:
+                updated += self._save(batch)
+                batch = []
+        if batch:
+            updated += self._save(batch)
+        self.stdout.write(self.style.SUCCESS(f"{updated} clé(s) de correction mise(s) à jour sur {checked} exercice(s)."))
+
+    def _save(self, batch):
+        # bulk_update ne touche pas updated_at : les exercices ne paraissent pas modifiés
+        with transaction.atomic():
+            Exercise.objects.bulk_update(batch, ['answer_key'])
+        return len(batch)
@@ -0,0 +1,24 @@
+"""
+Recalcule les résumés de tentatives (ExerciseAttemptSummary) à partir des
+tentatives enregistrées : à lancer une fois après leur introduction, ou
+après une suppression de tentatives.
+
+    python manage.py rebuild_attempt_summaries
+"""
+import time
+from django.core.management.base import BaseCommand
+from exercises.attempts import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = "Recalcule le résumé des tentatives de chaque élève sur chaque exercice."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Nombre de résumés insérés par requête.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_summaries(max(1, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(
+            f"{count} résumé(s) de tentatives recalculé(s) en {time.perf_counter() - started:.2f}s."
+        ))
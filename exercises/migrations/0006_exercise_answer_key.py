@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0005_exerciseresource'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='answer_key',
+            field=models.JSONField(blank=True, editable=False, help_text="Forme canonique des réponses correctes, calculée à l'enregistrement.", null=True, verbose_name='Clé de correction'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('exercises', '0006_exercise_answer_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExerciseAttemptSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt_count', models.PositiveIntegerField(default=0, verbose_name='Nombre de tentatives')),
+                ('best_score', models.PositiveIntegerField(default=0, verbose_name='Meilleur score')),
+                ('last_score', models.PositiveIntegerField(default=0, verbose_name='Dernier score')),
+                ('last_at', models.DateTimeField(blank=True, null=True, verbose_name='Dernière tentative')),
+                ('first_correct_at', models.DateTimeField(blank=True, null=True, verbose_name='Première réussite')),
+                ('exercise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempt_summaries', to='exercises.exercise', verbose_name='Exercice')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exercise_attempt_summaries', to=settings.AUTH_USER_MODEL, verbose_name='Élève')),
+            ],
+            options={
+                'verbose_name': 'Résumé des tentatives',
+                'verbose_name_plural': 'Résumés des tentatives',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='exerciseattemptsummary',
+            constraint=models.UniqueConstraint(fields=('student', 'exercise'), name='unique_attempt_summary'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:16
+
+from django.db import migrations, models
+
+
+def set_visibility(apps, schema_editor):
+    Exercise = apps.get_model('exercises', 'Exercise')
+    Exercise.objects.filter(creator__user_type='admin').update(visibility='public')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0007_exerciseattemptsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='visibility',
+            field=models.CharField(choices=[('public', 'Public (créé par un administrateur)'), ('private', 'Privé (visible par son créateur)')], default='private', editable=False, help_text="Déduite du type du créateur, tenue à jour à l'enregistrement.", max_length=10, verbose_name='Visibilité'),
+        ),
+        migrations.RunPython(set_visibility, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='exercise',
+            index=models.Index(fields=['is_active', 'visibility', 'subject', 'level', 'difficulty'], name='exercise_visibility_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0008_exercise_visibility'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercise',
+            name='level_rank',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Rang du niveau'),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='level_rank',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Rang du niveau'),
+        ),
+    ]
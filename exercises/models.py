@@ -1,14 +1,16 @@
 """
 Modèles pour la gestion des exercices.
 """
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from lessons.models import Lesson, Subject
+from users.models import LevelRankMixin
+from .grading import build_answer_key
 
 User = get_user_model()
 
 
-class Exercise(models.Model):
+class Exercise(LevelRankMixin, models.Model):
     """Exercice pour les élèves."""
     
     DIFFICULTY_CHOICES = [
@@ -22,6 +24,13 @@ class Exercise(models.Model):
         ('classic', 'Classique (Fiche d\'exercices)'),
     ]
     
+    PUBLIC = 'public'
+    PRIVATE = 'private'
+    VISIBILITY_CHOICES = [
+        (PUBLIC, 'Public (créé par un administrateur)'),
+        (PRIVATE, 'Privé (visible par son créateur)'),
+    ]
+    
     lesson = models.ForeignKey(
         Lesson,
         on_delete=models.CASCADE,
@@ -57,6 +66,13 @@ class Exercise(models.Model):
     )
     content = models.JSONField(verbose_name='Contenu (JSON)')
     correct_answers = models.JSONField(verbose_name='Réponses correctes')
+    answer_key = models.JSONField(
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name='Clé de correction',
+        help_text='Forme canonique des réponses correctes, calculée à l\'enregistrement.'
+    )
     explanation = models.TextField(blank=True, verbose_name='Explication')
     hints = models.JSONField(default=list, blank=True, verbose_name='Indices')
     points = models.PositiveIntegerField(default=10, verbose_name='Points')
@@ -76,6 +92,14 @@ class Exercise(models.Model):
         null=True
     )
     is_ai_generated = models.BooleanField(default=False, verbose_name='Généré par IA')
+    visibility = models.CharField(
+        max_length=10,
+        choices=VISIBILITY_CHOICES,
+        default=PRIVATE,
+        editable=False,
+        verbose_name='Visibilité',
+        help_text='Déduite du type du créateur, tenue à jour à l\'enregistrement.'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -83,10 +107,59 @@ class Exercise(models.Model):
         verbose_name = 'Exercice'
         verbose_name_plural = 'Exercices'
         ordering = ['order', 'difficulty', 'title']
+        indexes = [
+            models.Index(
+                fields=['is_active', 'visibility', 'subject', 'level', 'difficulty'],
+                name='exercise_visibility_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.title} ({self.get_difficulty_display()})"
 
+    def refresh_answer_key(self):
+        """Recalculer la clé de correction à partir de correct_answers."""
+        self.answer_key = build_answer_key(self.exercise_type, self.correct_answers)
+
+    @staticmethod
+    def visibility_for(creator):
+        """Les exercices d'un administrateur sont publics, les autres réservés à leur créateur."""
+        return Exercise.PUBLIC if creator is not None and creator.user_type == 'admin' else Exercise.PRIVATE
+
+    def refresh_visibility(self):
+        # Sans créateur (exercice partagé, créateur supprimé), la visibilité enregistrée est conservée
+        if self.creator_id is not None:
+            self.visibility = self.visibility_for(self.creator)
+
+    def refresh_derived_fields(self, update_fields=None):
+        """
+        Recalculer les champs déduits (clé de correction, visibilité, rang du
+        niveau). Appelée par save() et avant un bulk_create, qui ne passe pas
+        par save() ; renvoie ``update_fields`` complété des champs recalculés.
+        """
+        if update_fields is None:
+            self.refresh_answer_key()
+            self.refresh_visibility()
+            self.refresh_level_rank()
+            return None
+        update_fields = set(update_fields)
+        if {'correct_answers', 'exercise_type'} & update_fields:
+            self.refresh_answer_key()
+            update_fields.add('answer_key')
+        if 'creator' in update_fields:
+            self.refresh_visibility()
+            update_fields.add('visibility')
+        if 'level' in update_fields:
+            self.refresh_level_rank()
+            update_fields.add('level_rank')
+        return update_fields
+
+    def save(self, *args, **kwargs):
+        update_fields = self.refresh_derived_fields(kwargs.get('update_fields'))
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
 
 class ExerciseAttempt(models.Model):
     """Tentative d'exercice par un élève."""
@@ -129,15 +202,46 @@ class ExerciseAttempt(models.Model):
         return f"{self.student} - {self.exercise} - {'✓' if self.is_correct else '✗'}"
     
     def save(self, *args, **kwargs):
-        # Calculer le numéro de tentative
-        if not self.pk:
-            last_attempt = ExerciseAttempt.objects.filter(
-                exercise=self.exercise,
-                student=self.student
-            ).order_by('-attempt_number').first()
-            if last_attempt:
-                self.attempt_number = last_attempt.attempt_number + 1
-        super().save(*args, **kwargs)
+        if self.pk:
+            return super().save(*args, **kwargs)
+        # Numéro de tentative et résumé tirés de la ligne verrouillée de ExerciseAttemptSummary
+        from .attempts import lock_summaries, update_summaries
+        with transaction.atomic():
+            summaries = lock_summaries(self.student, [self])
+            super().save(*args, **kwargs)
+            update_summaries(summaries, [self])
+
+
+class ExerciseAttemptSummary(models.Model):
+    """Résumé des tentatives d'un élève sur un exercice, tenu à jour à chaque tentative."""
+    
+    student = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='exercise_attempt_summaries',
+        verbose_name='Élève'
+    )
+    exercise = models.ForeignKey(
+        Exercise,
+        on_delete=models.CASCADE,
+        related_name='attempt_summaries',
+        verbose_name='Exercice'
+    )
+    attempt_count = models.PositiveIntegerField(default=0, verbose_name='Nombre de tentatives')
+    best_score = models.PositiveIntegerField(default=0, verbose_name='Meilleur score')
+    last_score = models.PositiveIntegerField(default=0, verbose_name='Dernier score')
+    last_at = models.DateTimeField(blank=True, null=True, verbose_name='Dernière tentative')
+    first_correct_at = models.DateTimeField(blank=True, null=True, verbose_name='Première réussite')
+    
+    class Meta:
+        verbose_name = 'Résumé des tentatives'
+        verbose_name_plural = 'Résumés des tentatives'
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'exercise'], name='unique_attempt_summary'),
+        ]
+    
+    def __str__(self):
+        return f"{self.student} - {self.exercise} ({self.attempt_count})"
 
 
 class ExerciseResource(models.Model):
@@ -177,7 +281,7 @@ class ExerciseResource(models.Model):
         return f"{self.exercise.title} - {self.title}"
 
 
-class Quiz(models.Model):
+class Quiz(LevelRankMixin, models.Model):
     """Quiz composé de plusieurs exercices."""
     
     title = models.CharField(max_length=200, verbose_name='Titre')
@@ -13,7 +13,37 @@ class ExerciseResourceSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'resource_type', 'file', 'order']
 
 
-class ExerciseListSerializer(serializers.ModelSerializer):
+class AttemptSummaryFieldsMixin(serializers.Serializer):
+    """
+    Tentatives de l'élève connecté, lues dans ExerciseAttemptSummary : annotées
+    par ExerciseViewSet (une jointure pour toute la liste), sinon une requête.
+    """
+    
+    attempts_count = serializers.SerializerMethodField()
+    best_score = serializers.SerializerMethodField()
+    
+    def _user_summary(self, obj):
+        if not hasattr(obj, 'user_attempt_count'):
+            # Objet non annoté (détail, exercice généré) : une requête, gardée sur l'objet
+            request = self.context.get('request')
+            summary = obj.attempt_summaries.filter(student=request.user).first()
+            obj.user_attempt_count = summary.attempt_count if summary else 0
+            obj.user_best_score = summary.best_score if summary else 0
+        return obj.user_attempt_count or 0, obj.user_best_score or 0
+    
+    def get_attempts_count(self, obj):
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            return self._user_summary(obj)[0]
+        return 0
+    
+    def get_best_score(self, obj):
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            return self._user_summary(obj)[1]
+
+
+class ExerciseListSerializer(AttemptSummaryFieldsMixin, serializers.ModelSerializer):
     """Sérialiseur liste pour les exercices."""
     
     subject_name = serializers.CharField(source='subject.name', read_only=True)
@@ -27,7 +57,7 @@ class ExerciseListSerializer(serializers.ModelSerializer):
             'id', 'title', 'description', 'exercise_type', 'type_display',
             'difficulty', 'difficulty_display', 'level', 'subject', 'subject_name',
             'lesson', 'lesson_title', 'points', 'time_limit', 'order',
-            'creator', 'is_ai_generated'
+            'creator', 'is_ai_generated', 'attempts_count', 'best_score'
         ]
 
 
@@ -46,15 +76,13 @@ class ExerciseCreateSerializer(serializers.ModelSerializer):
         ]
 
 
-class ExerciseDetailSerializer(serializers.ModelSerializer):
+class ExerciseDetailSerializer(AttemptSummaryFieldsMixin, serializers.ModelSerializer):
     """Sérialiseur détail pour les exercices."""
     
     subject_name = serializers.CharField(source='subject.name', read_only=True)
     lesson_title = serializers.CharField(source='lesson.title', read_only=True)
     difficulty_display = serializers.CharField(source='get_difficulty_display', read_only=True)
     type_display = serializers.CharField(source='get_exercise_type_display', read_only=True)
-    attempts_count = serializers.SerializerMethodField()
-    best_score = serializers.SerializerMethodField()
     resources = ExerciseResourceSerializer(many=True, read_only=True)
     
     class Meta:
@@ -73,18 +101,6 @@ class ExerciseDetailSerializer(serializers.ModelSerializer):
         if instance.exercise_type == 'classic':
             ret['correct_answers'] = instance.correct_answers
         return ret
-    
-    def get_attempts_count(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.attempts.filter(student=request.user).count()
-        return 0
-    
-    def get_best_score(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            best = obj.attempts.filter(student=request.user).order_by('-score').first()
-            return best.score if best else 0
 
 
 class ExerciseAnswerSerializer(serializers.Serializer):
@@ -95,6 +111,20 @@ class ExerciseAnswerSerializer(serializers.Serializer):
     hints_used = serializers.IntegerField(default=0)
 
 
+class ExerciseBatchItemSerializer(ExerciseAnswerSerializer):
+    """Réponse à un exercice dans une soumission groupée."""
+    
+    exercise_id = serializers.IntegerField()
+
+
+class ExerciseBatchAnswerSerializer(serializers.Serializer):
+    """Sérialiseur pour la soumission de plusieurs réponses en une requête."""
+    
+    MAX_ITEMS = 100
+    
+    answers = ExerciseBatchItemSerializer(many=True, allow_empty=False, max_length=MAX_ITEMS)
+
+
 class ExerciseResultSerializer(serializers.Serializer):
     """Sérialiseur pour le résultat d'un exercice."""
     
@@ -122,14 +152,58 @@ class ExerciseAttemptSerializer(serializers.ModelSerializer):
 class QuizExerciseSerializer(serializers.ModelSerializer):
     """Sérialiseur pour les exercices dans un quiz (inclut le contenu sans les réponses)."""
     
+    # Clés de réponse que la génération place dans les questions (correct_option pour le mobile)
+    ANSWER_FIELDS = ('correct_option', 'correct_answer', 'correct_answers', 'answer')
+    
     type_display = serializers.CharField(source='get_exercise_type_display', read_only=True)
+    content = serializers.SerializerMethodField()
     
     class Meta:
         model = Exercise
         fields = [
             'id', 'title', 'description', 'exercise_type', 'type_display',
-            'difficulty', 'points', 'content', 'time_limit' # Added content
+            'difficulty', 'points', 'content', 'time_limit'
         ]
+    
+    def get_content(self, obj):
+        content = obj.content
+        if not isinstance(content, dict):
+            return content
+        content = {key: value for key, value in content.items() if key not in self.ANSWER_FIELDS}
+        if isinstance(content.get('questions'), list):
+            content['questions'] = [
+                {key: value for key, value in question.items() if key not in self.ANSWER_FIELDS}
+                if isinstance(question, dict) else question
+                for question in content['questions']
+            ]
+        return content
+
+
+class BundleExerciseSerializer(QuizExerciseSerializer):
+    """
+    Exercice d'un paquet hors ligne : les QCM sont corrigés par le serveur à la
+    synchronisation (sans réponses ni explication), les autres types gardent leur
+    correction pour l'auto-évaluation.
+    """
+    
+    correct_answers = serializers.SerializerMethodField()
+    explanation = serializers.SerializerMethodField()
+    
+    class Meta(QuizExerciseSerializer.Meta):
+        fields = QuizExerciseSerializer.Meta.fields + [
+            'lesson', 'level', 'order', 'hints', 'correct_answers', 'explanation'
+        ]
+    
+    def get_content(self, obj):
+        if obj.exercise_type == 'qcm':
+            return super().get_content(obj)
+        return obj.content
+    
+    def get_correct_answers(self, obj):
+        return None if obj.exercise_type == 'qcm' else obj.correct_answers
+    
+    def get_explanation(self, obj):
+        return '' if obj.exercise_type == 'qcm' else obj.explanation
 
 
 class QuizListSerializer(serializers.ModelSerializer):
@@ -148,6 +222,9 @@ class QuizListSerializer(serializers.ModelSerializer):
         ]
     
     def get_exercise_count(self, obj):
+        # Annoté par QuizViewSet pour toute la liste
+        if hasattr(obj, 'exercise_total'):
+            return obj.exercise_total
         return obj.exercises.count()
 
 
@@ -167,6 +244,14 @@ class QuizDetailSerializer(serializers.ModelSerializer):
         ]
 
 
+class QuizSubmitSerializer(serializers.Serializer):
+    """Sérialiseur pour la soumission de toutes les réponses d'un quiz."""
+    
+    attempt = serializers.IntegerField(required=False)
+    answers = ExerciseBatchItemSerializer(many=True, max_length=ExerciseBatchAnswerSerializer.MAX_ITEMS)
+    time_spent = serializers.IntegerField(default=0, min_value=0)
+
+
 class QuizAttemptSerializer(serializers.ModelSerializer):
     """Sérialiseur pour les tentatives de quiz."""
     
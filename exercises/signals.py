@@ -0,0 +1,54 @@
+"""
+Signaux de l'application exercises.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from lessons.cache import bump_content_version
+from .models import Exercise
+
+User = get_user_model()
+
+
+@receiver(post_init, sender=User)
+def remember_user_type(sender, instance, **kwargs):
+    # Valeur chargée (None si le champ est différé), comparée à l'enregistrement
+    instance._loaded_user_type = instance.__dict__.get('user_type')
+
+
+@receiver(post_save, sender=User)
+def sync_exercise_visibility(sender, instance, created, update_fields=None, **kwargs):
+    """Répercuter un changement de type d'utilisateur sur la visibilité de ses exercices."""
+    loaded, instance._loaded_user_type = instance._loaded_user_type, instance.user_type
+    if created or (update_fields is not None and 'user_type' not in update_fields):
+        return
+    if loaded == instance.user_type:
+        return
+    visibility = Exercise.visibility_for(instance)
+    if Exercise.objects.filter(creator=instance).exclude(visibility=visibility).update(visibility=visibility):
+        bump_content_version()
+
+
+@receiver(pre_delete, sender=User)
+def hide_deleted_creator_exercises(sender, instance, **kwargs):
+    """Les exercices d'un utilisateur supprimé perdent leur créateur : ils ne sont plus publics."""
+    if Exercise.objects.filter(creator=instance, visibility=Exercise.PUBLIC).update(visibility=Exercise.PRIVATE):
+        bump_content_version()
+
+
+@receiver(post_init, sender=Exercise)
+def remember_visibility(sender, instance, **kwargs):
+    instance._loaded_visibility = instance.__dict__.get('visibility')
+
+
+@receiver(post_save, sender=Exercise)
+@receiver(post_delete, sender=Exercise)
+def invalidate_exercise_catalog(sender, instance, **kwargs):
+    """
+    Les exercices privés (générés par les élèves) n'apparaissent pas dans les
+    réponses en cache : seul un exercice public, ou qui l'était, les invalide.
+    """
+    was_public = instance._loaded_visibility == Exercise.PUBLIC
+    instance._loaded_visibility = instance.visibility
+    if was_public or instance.visibility == Exercise.PUBLIC:
+        bump_content_version()
@@ -1,3 +1,375 @@
-from django.test import TestCase
+import json
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+from lessons.models import Chapter, Lesson, Subject
+from .attempts import rebuild_summaries, record_attempts
+from .grading import KEY_VERSION, Grade, build_answer_key, grade_answer, max_score
+from .models import Exercise, ExerciseAttempt, ExerciseAttemptSummary, Quiz, QuizAttempt
+from .serializers import ExerciseListSerializer
 
-# Create your tests here.
+User = get_user_model()
+
+
+class GradingTests(SimpleTestCase):
+    """Correcteurs par type d'exercice, appliqués à la clé de correction précalculée."""
+
+    def grade(self, exercise_type, correct_answers, answer, points=10):
+        exercise = Exercise(exercise_type=exercise_type, correct_answers=correct_answers, points=points)
+        exercise.refresh_answer_key()
+        return grade_answer(exercise, answer)
+
+    def test_qcm_letter_or_index(self):
+        for key in ('B', 1, '1', 'b'):
+            for answer in ('B', 'b', 1, '1', ' B '):
+                with self.subTest(key=key, answer=answer):
+                    self.assertEqual(self.grade('qcm', key, answer), Grade(True, 10, 10))
+        self.assertEqual(self.grade('qcm', 'B', 'C'), Grade(False, 0, 10))
+        self.assertEqual(self.grade('qcm', 'B', 0), Grade(False, 0, 10))
+
+    def test_qcm_partial_credit(self):
+        self.assertEqual(self.grade('qcm', ['A', 2, 'D'], [0, 'C', 'B']), Grade(False, 2, 3))
+        self.assertEqual(self.grade('qcm', ['A', 2, 'D'], ['a', '2', 3]), Grade(True, 3, 3))
+        self.assertEqual(self.grade('qcm', ['A', 2, 'D'], ['A']), Grade(False, 1, 3))
+
+    def test_number_with_comma_decimal(self):
+        self.assertEqual(self.grade('number', '3.5', '3,5'), Grade(True, 10, 10))
+        self.assertEqual(self.grade('number', 3.5, ' 3.50 '), Grade(True, 10, 10))
+        self.assertEqual(self.grade('number', '3.5', '3,6'), Grade(False, 0, 10))
+        self.assertEqual(self.grade('number', '3.5', 'trois'), Grade(False, 0, 10))
+        self.assertEqual(self.grade('number', 'nan', 'nan'), Grade(False, 0, 10))
+
+    def test_classic_answers_are_never_correct(self):
+        # Comportement d'origine conservé, même pour une réponse identique à la correction
+        self.assertEqual(self.grade('classic', 'Paris', 'Paris'), Grade(False, 0, 10))
+        self.assertEqual(self.grade('classic', ['Paris', '12 cm'], ['paris', '12 cm']), Grade(False, 0, 10))
+
+    def test_stale_key_is_rebuilt(self):
+        exercise = Exercise(exercise_type='qcm', correct_answers='C', points=5)
+        exercise.answer_key = dict(build_answer_key('qcm', 'A'), version=KEY_VERSION - 1)
+        self.assertEqual(grade_answer(exercise, 2), Grade(True, 5, 5))
+        exercise.answer_key = None
+        self.assertEqual(max_score(exercise), 5)
+
+
+class SubmitBatchTests(TestCase):
+    """Soumission groupée : une correction par réponse, dans l'ordre, enregistrées en une transaction."""
+
+    def setUp(self):
+        admin = User.objects.create_user('admin', password='x', user_type='admin')
+        other = User.objects.create_user('autre', password='x', user_type='student', level='cm2')
+        self.student = User.objects.create_user('eleve', password='x', user_type='student', level='cm2')
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        subject = Subject.objects.create(name='Mathématiques', slug='mathematiques')
+        self.first, self.second, self.private = [
+            Exercise.objects.create(
+                subject=subject, title=title, exercise_type='qcm', level='cm2',
+                content={}, correct_answers=key, points=10, creator=creator
+            )
+            for title, key, creator in [('Addition', 'A', admin), ('Soustraction', 'B', admin), ('Brouillon', 'A', other)]
+        ]
+
+    def submit(self, answers):
+        return self.client.post('/api/exercises/submit-batch/', {'answers': answers}, format='json')
+
+    def test_results_in_order_with_totals(self):
+        response = self.submit([
+            {'exercise_id': self.second.pk, 'answer': 'B', 'time_spent': 30},
+            {'exercise_id': self.private.pk, 'answer': 'A'},
+            {'exercise_id': self.first.pk, 'answer': 'C'},
+            {'exercise_id': self.second.pk, 'answer': 'B', 'hints_used': 2},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(
+            [result['exercise_id'] for result in results],
+            [self.second.pk, self.private.pk, self.first.pk, self.second.pk]
+        )
+        self.assertEqual(results[1], {'exercise_id': self.private.pk, 'error': 'Exercice introuvable.'})
+        self.assertEqual([result.get('is_correct') for result in results], [True, None, False, True])
+        self.assertEqual([result.get('score') for result in results], [10, None, 0, 6])
+        self.assertEqual([result.get('attempt_number') for result in results], [1, None, 1, 2])
+        self.assertEqual((response.data['score'], response.data['max_score']), (16, 30))
+        attempts = ExerciseAttempt.objects.filter(student=self.student).order_by('id')
+        self.assertEqual(
+            [(attempt.exercise_id, attempt.attempt_number, attempt.time_spent) for attempt in attempts],
+            [(self.second.pk, 1, 30), (self.first.pk, 1, 0), (self.second.pk, 2, 0)]
+        )
+
+    def test_invalid_batches_are_rejected(self):
+        item = {'exercise_id': self.first.pk, 'answer': 'A'}
+        with self.assertLogs('django.request', 'WARNING'):
+            for answers in [[], [item] * 101, [{'answer': 'A'}], [dict(item, hints_used='deux')], 'A']:
+                with self.subTest(answers=answers):
+                    self.assertEqual(self.submit(answers).status_code, 400)
+        self.assertEqual(self.submit([item] * 100).status_code, 200)
+        self.assertEqual(ExerciseAttempt.objects.count(), 100)
+
+    def test_batch_is_one_transaction(self):
+        bulk_create = ExerciseAttempt.objects.bulk_create
+
+        def insert_then_fail(attempts, *args, **kwargs):
+            # Tentatives insérées, puis erreur avant la fin de la transaction
+            bulk_create(attempts, *args, **kwargs)
+            raise RuntimeError('échec')
+
+        answers = [{'exercise_id': self.first.pk, 'answer': 'A'}, {'exercise_id': self.second.pk, 'answer': 'A'}]
+        with mock.patch.object(ExerciseAttempt.objects, 'bulk_create', side_effect=insert_then_fail):
+            with self.assertRaises(RuntimeError), self.assertLogs('django.request', 'ERROR'):
+                self.submit(answers)
+        self.assertFalse(ExerciseAttempt.objects.exists())
+        self.assertFalse(ExerciseAttemptSummary.objects.exists())
+
+        self.assertEqual(self.submit(answers).status_code, 200)
+        self.assertEqual(ExerciseAttempt.objects.count(), 2)
+
+
+class AttemptSummaryTests(TestCase):
+    """Numérotation des tentatives et résumés par (élève, exercice), tenus à jour à chaque soumission."""
+
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', password='x', user_type='admin')
+        self.student = User.objects.create_user('eleve', password='x', user_type='student', level='cm2')
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        subject = Subject.objects.create(name='Mathématiques', slug='mathematiques')
+        self.exercise = Exercise.objects.create(
+            subject=subject, title='Addition', exercise_type='qcm', level='cm2',
+            content={}, correct_answers='A', points=10, creator=self.admin
+        )
+        self.other = Exercise.objects.create(
+            subject=subject, title='Soustraction', exercise_type='qcm', level='cm2',
+            content={}, correct_answers='B', points=10, creator=self.admin
+        )
+
+    def submit(self, exercise, answer, hints_used=0):
+        response = self.client.post(
+            f'/api/exercises/{exercise.pk}/submit/', {'answer': answer, 'hints_used': hints_used}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def summary(self, exercise):
+        return ExerciseAttemptSummary.objects.get(student=self.student, exercise=exercise)
+
+    def test_attempts_are_numbered_across_submits(self):
+        for _ in range(3):
+            self.submit(self.exercise, 'B')
+        response = self.client.post('/api/exercises/submit-batch/', {'answers': [
+            {'exercise_id': self.exercise.pk, 'answer': 'A'},
+            {'exercise_id': self.other.pk, 'answer': 'B'},
+            {'exercise_id': self.exercise.pk, 'answer': 'C'},
+        ]}, format='json')
+        self.assertEqual([result['attempt_number'] for result in response.data['results']], [4, 1, 5])
+        numbers = ExerciseAttempt.objects.filter(exercise=self.exercise).order_by('attempt_number')
+        self.assertEqual([attempt.attempt_number for attempt in numbers], [1, 2, 3, 4, 5])
+        self.assertEqual(self.summary(self.exercise).attempt_count, 5)
+
+    def test_best_score_and_attempts_count(self):
+        self.submit(self.exercise, 'B')
+        self.submit(self.exercise, 'A', hints_used=1)
+        self.submit(self.exercise, 0)
+        self.submit(self.exercise, 'D')
+
+        summary = self.summary(self.exercise)
+        self.assertEqual(
+            (summary.attempt_count, summary.best_score, summary.last_score), (4, 10, 0)
+        )
+        self.assertIsNotNone(summary.first_correct_at)
+        response = self.client.get(f'/api/exercises/{self.exercise.pk}/')
+        self.assertEqual((response.data['attempts_count'], response.data['best_score']), (4, 10))
+        response = self.client.get(f'/api/exercises/{self.other.pk}/')
+        self.assertEqual((response.data['attempts_count'], response.data['best_score']), (0, 0))
+
+    def test_summary_read_once_without_annotation(self):
+        self.submit(self.exercise, 'A')
+        exercise = Exercise.objects.select_related('subject', 'lesson').get(pk=self.exercise.pk)
+        with self.assertNumQueries(1):
+            data = ExerciseListSerializer(exercise, context={'request': mock.Mock(user=self.student)}).data
+        self.assertEqual((data['attempts_count'], data['best_score']), (1, 10))
+
+    def test_rebuild_matches_incremental_summaries(self):
+        self.submit(self.exercise, 'B')
+        self.submit(self.exercise, 'A', hints_used=2)
+        self.submit(self.other, 'B')
+        self.submit(self.other, 'A')
+        fields = ['student_id', 'exercise_id', 'attempt_count', 'best_score', 'last_score', 'last_at', 'first_correct_at']
+        incremental = list(ExerciseAttemptSummary.objects.order_by('exercise_id').values(*fields))
+
+        self.assertEqual(rebuild_summaries(), 2)
+        self.assertEqual(list(ExerciseAttemptSummary.objects.order_by('exercise_id').values(*fields)), incremental)
+
+
+class ExercisesByLessonTests(TestCase):
+    """Exercices groupés par leçon : une requête quel que soit le nombre de leçons, puis le cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = User.objects.create_user('admin', password='x', user_type='admin')
+        self.student = User.objects.create_user('eleve', password='x', user_type='student', level='cm2')
+        self.subject = Subject.objects.create(name='Mathématiques', slug='mathematiques')
+        self.chapter = Chapter.objects.create(subject=self.subject, title='Nombres', slug='nombres')
+
+    def add_lesson(self, title, exercises, creator=None):
+        lesson = Lesson.objects.create(
+            chapter=self.chapter, title=title, slug=title.lower(), content='Contenu', level='cm2'
+        )
+        for number in range(exercises):
+            Exercise.objects.create(
+                lesson=lesson, subject=self.subject, title=f'{title} {number}', level='cm2',
+                content={}, correct_answers=[0], creator=creator or self.admin
+            )
+        return lesson
+
+    def test_single_query_whatever_the_number_of_lessons(self):
+        self.add_lesson('Fractions', 2)
+        with self.assertNumQueries(1):
+            self.client.get('/api/exercises/by_lesson/')
+
+        for number in range(10):
+            self.add_lesson(f'Lecon{number}', 3)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/exercises/by_lesson/')
+        self.assertEqual(len(response.data), 11)
+        self.assertEqual(len(response.data['Fractions']), 2)
+
+    def test_private_exercises_are_not_listed(self):
+        self.add_lesson('Fractions', 1)
+        self.add_lesson('Decimaux', 2, creator=self.student)
+        response = self.client.get('/api/exercises/by_lesson/')
+        self.assertEqual(list(response.data), ['Fractions'])
+
+    def test_cached_until_content_changes(self):
+        lesson = self.add_lesson('Fractions', 1)
+        self.client.get('/api/exercises/by_lesson/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/exercises/by_lesson/')
+
+        Exercise.objects.create(
+            lesson=lesson, subject=self.subject, title='Nouveau', level='cm2',
+            content={}, correct_answers=[0], creator=self.admin
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/exercises/by_lesson/')
+        self.assertEqual(len(response.data['Fractions']), 2)
+
+    def test_cache_invalidated_when_an_exercise_becomes_private(self):
+        self.add_lesson('Fractions', 2)
+        self.client.get('/api/exercises/by_lesson/')
+        exercise = Exercise.objects.filter(lesson__title='Fractions').first()
+        exercise.creator = self.student
+        exercise.save()
+        self.assertEqual(exercise.visibility, Exercise.PRIVATE)
+        response = self.client.get('/api/exercises/by_lesson/')
+        self.assertEqual(len(response.data['Fractions']), 1)
+
+    def test_user_type_change_syncs_visibility(self):
+        self.add_lesson('Fractions', 1, creator=self.student)
+        self.student.first_name = 'Awa'
+        with self.assertNumQueries(1):
+            # Type inchangé : pas de mise à jour des exercices
+            self.student.save()
+        self.student.user_type = 'admin'
+        self.student.save()
+        self.assertEqual(Exercise.objects.get(creator=self.student).visibility, Exercise.PUBLIC)
+
+
+class QuizApiTests(TestCase):
+    """Quiz : démarrage sans les réponses, correction de toutes les réponses par le serveur en une soumission."""
+
+    def setUp(self):
+        admin = User.objects.create_user('admin', password='x', user_type='admin')
+        self.student = User.objects.create_user('eleve', password='x', user_type='student', level='cm2')
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        subject = Subject.objects.create(name='Mathématiques', slug='mathematiques')
+        self.quiz = Quiz.objects.create(title='Calcul', subject=subject, level='cm2', passing_score=50)
+        self.exercises = [
+            Exercise.objects.create(
+                subject=subject, title=f'Question {number}', exercise_type='qcm', level='cm2', points=10,
+                order=number, correct_answers=number, creator=admin,
+                content={
+                    'question': f'{number} + 0 ?', 'options': ['0', '1', '2'], 'correct_option': number,
+                    'questions': [{'text': f'{number} + 0 ?', 'correct_answer': number}],
+                }
+            )
+            for number in range(3)
+        ]
+        self.quiz.exercises.set(self.exercises)
+        self.url = f'/api/exercises/quizzes/{self.quiz.pk}/'
+
+    def test_start_never_exposes_answers(self):
+        response = self.client.post(self.url + 'start/')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.data['attempt']['completed'])
+        self.assertEqual(len(response.data['quiz']['exercises']), 3)
+        body = json.dumps(response.data)
+        for field in ('correct_answers', 'correct_option', 'correct_answer', 'answer_key'):
+            self.assertNotIn(field, body)
+        self.assertNotIn('correct_option', json.dumps(self.client.get(self.url).data))
+
+    def test_submit_grades_every_answer(self):
+        attempt = self.client.post(self.url + 'start/').data['attempt']
+        first, second, third = self.exercises
+        response = self.client.post(self.url + 'submit/', {'attempt': attempt['id'], 'time_spent': 90, 'answers': [
+            {'exercise_id': first.pk, 'answer': 'A'},
+            {'exercise_id': second.pk, 'answer': 2},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = {result['exercise_id']: result for result in response.data['results']}
+        self.assertTrue(results[first.pk]['is_correct'])
+        self.assertFalse(results[second.pk]['is_correct'])
+        self.assertFalse(results[third.pk]['answered'])
+        self.assertEqual(results[third.pk]['max_score'], 10)
+        quiz_attempt = response.data['attempt']
+        self.assertEqual(quiz_attempt['id'], attempt['id'])
+        self.assertEqual((quiz_attempt['score'], quiz_attempt['total_score'], quiz_attempt['percentage']), (10, 30, 33))
+        self.assertTrue(quiz_attempt['completed'])
+        self.assertFalse(quiz_attempt['is_passed'])
+        self.assertEqual(ExerciseAttempt.objects.filter(student=self.student).count(), 2)
+        self.assertEqual(ExerciseAttemptSummary.objects.filter(student=self.student).count(), 2)
+
+    def test_submit_is_one_transaction(self):
+        attempt = self.client.post(self.url + 'start/').data['attempt']
+        answers = [{'exercise_id': exercise.pk, 'answer': 0} for exercise in self.exercises]
+
+        def record_then_fail(student, attempts):
+            # Tentatives et résumés écrits, puis erreur avant la fin de la transaction
+            record_attempts(student, attempts)
+            raise RuntimeError('échec')
+
+        with mock.patch('exercises.views.record_attempts', side_effect=record_then_fail):
+            with self.assertRaises(RuntimeError), self.assertLogs('django.request', 'ERROR'):
+                self.client.post(self.url + 'submit/', {'attempt': attempt['id'], 'answers': answers}, format='json')
+        self.assertFalse(QuizAttempt.objects.get(pk=attempt['id']).completed)
+        self.assertFalse(ExerciseAttempt.objects.exists())
+        self.assertFalse(ExerciseAttemptSummary.objects.exists())
+
+    def test_bad_payloads_are_rejected(self):
+        other_quiz_exercise = Exercise.objects.create(
+            subject=self.quiz.subject, title='Hors quiz', exercise_type='qcm', level='cm2',
+            content={}, correct_answers=0, creator=self.exercises[0].creator
+        )
+        attempt = self.client.post(self.url + 'start/').data['attempt']
+        with self.assertLogs('django.request', 'WARNING'):
+            for payload in [
+                {},
+                {'answers': 'A'},
+                {'answers': [{'answer': 'A'}]},
+                {'answers': [{'exercise_id': other_quiz_exercise.pk, 'answer': 'A'}]},
+                {'attempt': attempt['id'] + 100, 'answers': []},
+                {'answers': [], 'time_spent': -1},
+            ]:
+                with self.subTest(payload=payload):
+                    response = self.client.post(self.url + 'submit/', payload, format='json')
+                    self.assertEqual(response.status_code, 400)
+            self.client.post(self.url + 'submit/', {'attempt': attempt['id'], 'answers': []}, format='json')
+            response = self.client.post(self.url + 'submit/', {'attempt': attempt['id'], 'answers': []}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(ExerciseAttempt.objects.exists())
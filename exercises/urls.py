@@ -3,9 +3,11 @@ URLs pour la gestion des exercices.
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ExerciseViewSet
+from .views import ExerciseViewSet, QuizViewSet
 
 router = DefaultRouter()
+# Avant le préfixe vide : sinon « quizzes/ » serait pris pour l'identifiant d'un exercice
+router.register(r'quizzes', QuizViewSet, basename='quiz')
 router.register(r'', ExerciseViewSet, basename='exercise')
 
 urlpatterns = [
@@ -6,14 +6,35 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.utils import timezone
-from django.db import models
-from .models import Exercise, ExerciseAttempt
+from django.db import models, transaction
+from django.db.models import FilteredRelation
+from lessons.cache import cached_content
+from .attempts import record_attempts
+from .grading import grade_answer, max_score
+from .models import Exercise, ExerciseAttempt, Quiz, QuizAttempt
 from .serializers import (
     ExerciseListSerializer, ExerciseDetailSerializer, ExerciseCreateSerializer, ExerciseAnswerSerializer,
-    ExerciseResultSerializer, ExerciseAttemptSerializer
+    ExerciseBatchAnswerSerializer, ExerciseResultSerializer, ExerciseAttemptSerializer,
+    QuizListSerializer, QuizDetailSerializer, QuizSubmitSerializer, QuizAttemptSerializer
 )
 
 
+def grade_submission(exercise, answer, hints_used=0):
+    """Corriger une réponse et construire le résultat renvoyé à l'élève."""
+    grade = grade_answer(exercise, answer)
+    score = grade.score
+    if hints_used > 0:
+        score = max(0, score - (hints_used * 2))  # Pénalité pour indices
+    return grade, {
+        'is_correct': grade.is_correct,
+        'score': score,
+        'max_score': grade.max_score,
+        'correct_answer': exercise.correct_answers,
+        'explanation': exercise.explanation,
+        'message': 'Bravo !' if grade.is_correct else 'Exercice terminé'
+    }
+
+
 class ExerciseViewSet(viewsets.ModelViewSet):
     """ViewSet pour les exercices."""
     
@@ -41,29 +62,21 @@ class ExerciseViewSet(viewsets.ModelViewSet):
         # Base queryset: only active exercises
         queryset = Exercise.objects.filter(is_active=True)
         
-        if user.is_authenticated:
-            if user.user_type == 'admin' or user.is_superuser:
-                # Admins see everything
-                pass
-            else:
-                # Students and Teachers see:
-                # 1. Exercises created by an admin
-                # 2. Exercises they created themselves (unless it's AI generated by someone else)
-                # 3. AI generated exercises ONLY if they are the creator
-                
-                queryset = queryset.filter(
-                    models.Q(creator__user_type='admin') | 
-                    models.Q(creator=user)
-                )
-                
-                # Further restriction: if is_ai_generated, must be the creator
-                # (This is already covered by the filter above, but let's be explicit if needed)
-                # Actually, the logic is: 
-                # (creator is admin) OR (creator is me)
-                # This automatically hides AI exercises of others (since they aren't admin and aren't me)
-        else:
+        # Visibilité précalculée (Exercise.visibility) : pas de jointure sur le créateur
+        if not user.is_authenticated:
             # Public/unauthenticated view: only admin exercises
-            queryset = queryset.filter(creator__user_type='admin')
+            queryset = queryset.filter(visibility=Exercise.PUBLIC)
+        elif user.user_type == 'student':
+            from users.utils import allowed_levels_q
+            # L'élève voit les exercices publics de son niveau (et inférieurs),
+            # MAIS aussi tous les exercices qu'il a générés lui-même, peu importe le niveau
+            visible = allowed_levels_q(user)
+            if not user.is_superuser:
+                visible &= models.Q(visibility=Exercise.PUBLIC)
+            queryset = queryset.filter(visible | models.Q(creator=user))
+        elif user.user_type != 'admin' and not user.is_superuser:
+            # Teachers and parents see admin exercises and the ones they created
+            queryset = queryset.filter(models.Q(visibility=Exercise.PUBLIC) | models.Q(creator=user))
 
         # Filtrer par matière
         subject = self.request.query_params.get('subject', None)
@@ -75,17 +88,6 @@ class ExerciseViewSet(viewsets.ModelViewSet):
         if level_param:
             queryset = queryset.filter(level=level_param)
             
-        # Restriction d'accès par niveau de l'élève
-        if user.is_authenticated and user.user_type == 'student':
-            from users.utils import get_allowed_levels
-            allowed_levels = get_allowed_levels(user.level)
-            # L'élève peut voir les exercices de son niveau (et inférieurs), 
-            # MAIS aussi tous les exercices qu'il a générés lui-même, peu importe le niveau
-            queryset = queryset.filter(
-                models.Q(level__in=allowed_levels) | 
-                models.Q(creator=user)
-            )
-        
         # Filtrer par difficulté
         difficulty = self.request.query_params.get('difficulty', None)
         if difficulty:
@@ -96,7 +98,16 @@ class ExerciseViewSet(viewsets.ModelViewSet):
         if lesson:
             queryset = queryset.filter(lesson__slug=lesson)
         
-        return queryset.distinct()
+        # Tentatives de l'élève lues dans son résumé, en une jointure
+        if user.is_authenticated and self.action in ['list', 'retrieve']:
+            queryset = queryset.annotate(
+                user_summary=FilteredRelation('attempt_summaries', condition=models.Q(attempt_summaries__student=user)),
+                user_attempt_count=models.F('user_summary__attempt_count'),
+                user_best_score=models.F('user_summary__best_score'),
+            )
+        
+        # Jointures sur des relations uniques seulement : pas besoin de DISTINCT
+        return queryset
     
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def submit(self, request, pk=None):
@@ -111,116 +122,64 @@ class ExerciseViewSet(viewsets.ModelViewSet):
         time_spent = serializer.validated_data.get('time_spent', 0)
         hints_used = serializer.validated_data.get('hints_used', 0)
         
-        # Vérifier la réponse
-        correct_answers = exercise.correct_answers
-        
-        # Calculate partial score for QCM arrays
-        if exercise.exercise_type == 'qcm' and isinstance(answer, list) and isinstance(correct_answers, list):
-            correct_count: int = 0
-            total_questions = len(correct_answers)
-            
-            # Normalize correct answers
-            norm_correct = []
-            for c in correct_answers:
-                if isinstance(c, str) and c.upper() in ['A', 'B', 'C', 'D']:
-                    val = str(ord(c.upper()) - 65)
-                    norm_correct.append(val)
-                else:
-                    norm_correct.append(str(c))
-                    
-            # Normalize provided answers
-            norm_answer = []
-            for a in answer:
-                if isinstance(a, int) or (isinstance(a, str) and a.isdigit()):
-                    norm_answer.append(str(a))
-                else:
-                    norm_answer.append(str(a).upper())
-            
-            # Count matches
-            for i in range(min(len(norm_answer), len(norm_correct))):
-                if norm_answer[i] == norm_correct[i]:
-                    correct_count += 1
-                    
-            is_correct = correct_count == total_questions
-            score_out_of_total = correct_count
-            max_possible = total_questions
-        else:
-            is_correct = self._check_answer(answer, correct_answers, exercise.exercise_type)
-            score_out_of_total = exercise.points if is_correct else 0
-            max_possible = exercise.points
-        
-        # Calculer le score (legacy approach for non-qcm arrays)
-        score = score_out_of_total
-        if hints_used > 0:
-            score = max(0, score - (hints_used * 2))  # Pénalité pour indices
+        # Vérifier la réponse contre la clé de correction précalculée
+        grade, result = grade_submission(exercise, answer, hints_used)
         
         # Créer la tentative
-        attempt = ExerciseAttempt.objects.create(
+        ExerciseAttempt.objects.create(
             exercise=exercise,
             student=request.user,
             answer=answer,
-            is_correct=is_correct,
-            score=score,
+            is_correct=grade.is_correct,
+            score=result['score'],
             time_spent=time_spent,
             hints_used=hints_used
         )
         
-        result = {
-            'is_correct': is_correct,
-            'score': score,
-            'max_score': max_possible,
-            'correct_answer': correct_answers,
-            'explanation': exercise.explanation,
-            'message': 'Bravo !' if is_correct else 'Exercice terminé'
-        }
-        
         return Response(result)
     
-    def _check_answer(self, answer, correct_answers, exercise_type):
-        """Vérifier si la réponse est correcte selon le type d'exercice."""
-        if exercise_type == 'qcm':
-            # Handle AI generated list of letters vs list of integers
-            if isinstance(answer, list) and isinstance(correct_answers, list):
-                if len(answer) != len(correct_answers):
-                    return False
-                
-                norm_answer = []
-                for a in answer:
-                    if isinstance(a, int) or (isinstance(a, str) and a.isdigit()):
-                        norm_answer.append(str(a))
-                    else:
-                        norm_answer.append(str(a).upper())
-                        
-                norm_correct = []
-                for c in correct_answers:
-                    if isinstance(c, str) and c.upper() in ['A', 'B', 'C', 'D']:
-                        val = str(ord(c.upper()) - 65)
-                        norm_correct.append(val)
-                    else:
-                        norm_correct.append(str(c))
-                        
-                return norm_answer == norm_correct
-            # Handle legacy string/int fallback
-            if isinstance(answer, int) and isinstance(correct_answers, str):
-                if correct_answers.upper() in ['A', 'B', 'C', 'D']:
-                    return str(answer) == str(ord(correct_answers.upper()) - 65)
-            
-            # Direct string comparison
-            return str(answer) == str(correct_answers)
-        elif exercise_type == 'text':
-            return answer.lower().strip() == correct_answers.lower().strip()
-        elif exercise_type == 'number':
-            try:
-                return float(answer) == float(correct_answers)
-            except (ValueError, TypeError):
-                return False
-        elif exercise_type == 'matching':
-            return answer == correct_answers
-        elif exercise_type == 'fill_blank':
-            return answer == correct_answers
-        elif exercise_type == 'ordering':
-            return answer == correct_answers
-        return False
+    @action(detail=False, methods=['post'], url_path='submit-batch', permission_classes=[IsAuthenticated])
+    def submit_batch(self, request):
+        """Soumettre les réponses à plusieurs exercices en une seule requête."""
+        serializer = ExerciseBatchAnswerSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        items = serializer.validated_data['answers']
+        
+        # Une requête pour les exercices accessibles à l'élève, corrigés en mémoire
+        exercise_ids = {item['exercise_id'] for item in items}
+        exercises = {exercise.pk: exercise for exercise in self.get_queryset().filter(pk__in=exercise_ids)}
+        
+        results, graded = [], []
+        for item in items:
+            exercise = exercises.get(item['exercise_id'])
+            if exercise is None:
+                results.append({'exercise_id': item['exercise_id'], 'error': 'Exercice introuvable.'})
+                continue
+            grade, result = grade_submission(exercise, item['answer'], item['hints_used'])
+            attempt = ExerciseAttempt(
+                exercise=exercise,
+                student=request.user,
+                answer=item['answer'],
+                is_correct=grade.is_correct,
+                score=result['score'],
+                time_spent=item['time_spent'],
+                hints_used=item['hints_used']
+            )
+            result = {'exercise_id': exercise.pk, **result}
+            graded.append((attempt, result))
+            results.append(result)
+        
+        # Numérotation et résumés par (élève, exercice), insertion groupée, une transaction
+        record_attempts(request.user, [attempt for attempt, _ in graded])
+        for attempt, result in graded:
+            result['attempt_number'] = attempt.attempt_number
+        
+        return Response({
+            'results': results,
+            'score': sum(result.get('score', 0) for result in results),
+            'max_score': sum(result.get('max_score', 0) for result in results),
+        })
     
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def my_attempts(self, request):
@@ -231,14 +190,144 @@ class ExerciseViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def by_lesson(self, request):
-        """Récupérer les exercices groupés par leçon."""
-        from lessons.models import Lesson
-        
+        """Récupérer les exercices (publics) groupés par leçon."""
+        return Response(cached_content('exercises_by_lesson', self._exercises_by_lesson))
+    
+    def _exercises_by_lesson(self):
+        # Une requête, triée comme les leçons puis comme les exercices de chaque leçon
+        exercises = Exercise.objects.filter(
+            is_active=True, visibility=Exercise.PUBLIC, lesson__is_active=True
+        ).select_related('subject', 'lesson').order_by(
+            'lesson__level_rank', 'lesson__order', 'lesson__title', 'lesson_id', 'order', 'difficulty', 'title'
+        )
         lessons = {}
-        for lesson in Lesson.objects.filter(is_active=True):
-            exercises = Exercise.objects.filter(lesson=lesson, is_active=True)
-            if exercises.exists():
-                lessons[lesson.title] = ExerciseListSerializer(exercises, many=True).data
-        return Response(lessons)
+        for exercise in exercises:
+            lessons.setdefault(exercise.lesson.title, []).append(exercise)
+        return {title: ExerciseListSerializer(group, many=True).data for title, group in lessons.items()}
 
 
+class QuizViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet pour les quiz : consultation, démarrage et correction en une soumission."""
+    
+    permission_classes = [AllowAny]
+    
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return QuizDetailSerializer
+        return QuizListSerializer
+    
+    def get_queryset(self):
+        queryset = Quiz.objects.filter(is_active=True).select_related('subject', 'lesson')
+        
+        # Restriction d'accès par niveau de l'élève
+        user = self.request.user
+        if user.is_authenticated and user.user_type == 'student':
+            from users.utils import allowed_levels_q
+            queryset = queryset.filter(allowed_levels_q(user))
+        
+        subject = self.request.query_params.get('subject', None)
+        if subject:
+            queryset = queryset.filter(subject__slug=subject)
+        lesson = self.request.query_params.get('lesson', None)
+        if lesson:
+            queryset = queryset.filter(lesson__slug=lesson)
+        
+        if self.action == 'list':
+            queryset = queryset.annotate(exercise_total=models.Count('exercises'))
+        elif self.action in ['retrieve', 'start']:
+            # Exercices du quiz chargés en une requête, sans N+1 dans le sérialiseur
+            queryset = queryset.prefetch_related(
+                models.Prefetch('exercises', queryset=Exercise.objects.filter(is_active=True).order_by('order', 'id'))
+            )
+        return queryset.order_by('level_rank', 'title')
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def start(self, request, pk=None):
+        """Démarrer une tentative et renvoyer le quiz (sans les réponses)."""
+        quiz = self.get_object()
+        attempt = QuizAttempt.objects.create(quiz=quiz, student=request.user)
+        return Response({
+            'attempt': QuizAttemptSerializer(attempt).data,
+            'quiz': QuizDetailSerializer(quiz, context=self.get_serializer_context()).data,
+        }, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def submit(self, request, pk=None):
+        """Soumettre toutes les réponses du quiz : correction en un passage, une transaction."""
+        quiz = self.get_object()
+        serializer = QuizSubmitSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        
+        exercises = list(quiz.exercises.filter(is_active=True).order_by('order', 'id'))
+        answers = {item['exercise_id']: item for item in data['answers']}
+        unknown = sorted(set(answers) - {exercise.pk for exercise in exercises})
+        if unknown:
+            return Response(
+                {'answers': f"Exercices absents de ce quiz : {unknown}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Correction en mémoire avec les clés précalculées ; les questions sans réponse valent 0
+        results, attempts = [], []
+        score = total_score = 0
+        for exercise in exercises:
+            item = answers.get(exercise.pk)
+            if item is None:
+                total_score += max_score(exercise)
+                results.append({
+                    'exercise_id': exercise.pk, 'answered': False, 'is_correct': False, 'score': 0,
+                    'max_score': max_score(exercise), 'correct_answer': exercise.correct_answers,
+                    'explanation': exercise.explanation
+                })
+                continue
+            grade, result = grade_submission(exercise, item['answer'], item['hints_used'])
+            score += result['score']
+            total_score += result['max_score']
+            attempts.append(ExerciseAttempt(
+                exercise=exercise,
+                student=request.user,
+                answer=item['answer'],
+                is_correct=grade.is_correct,
+                score=result['score'],
+                time_spent=item['time_spent'],
+                hints_used=item['hints_used']
+            ))
+            results.append({'exercise_id': exercise.pk, 'answered': True, **result})
+        percentage = round(100 * score / total_score) if total_score else 0
+        
+        with transaction.atomic():
+            if 'attempt' in data:
+                attempt = QuizAttempt.objects.select_for_update().filter(
+                    pk=data['attempt'], quiz=quiz, student=request.user, completed=False
+                ).first()
+                if attempt is None:
+                    return Response(
+                        {'attempt': "Tentative introuvable ou déjà terminée."},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            else:
+                attempt = QuizAttempt(quiz=quiz, student=request.user)
+            attempt.score = score
+            attempt.total_score = total_score
+            attempt.percentage = percentage
+            attempt.is_passed = percentage >= quiz.passing_score
+            attempt.time_spent = data['time_spent']
+            attempt.completed = True
+            attempt.completed_at = timezone.now()
+            attempt.save()
+            record_attempts(request.user, attempts)
+        
+        return Response({
+            'attempt': QuizAttemptSerializer(attempt).data,
+            'results': results,
+            'message': 'Quiz réussi !' if attempt.is_passed else 'Quiz terminé'
+        })
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def my_attempts(self, request):
+        """Récupérer les tentatives de quiz de l'élève connecté."""
+        attempts = QuizAttempt.objects.filter(student=request.user).select_related('quiz')
+        serializer = QuizAttemptSerializer(attempts, many=True)
+        return Response(serializer.data)
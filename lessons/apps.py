@@ -8,3 +8,6 @@ class LessonsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lessons'
     verbose_name = 'Leçons'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,242 @@
+"""
+Paquets hors ligne de l'application mobile : tout le contenu d'une matière
+pour un niveau (arborescence des chapitres, leçons et ressources, exercices
+publics sans les réponses des QCM) en un seul fichier JSON.
+
+Chaque paquet est écrit sur disque sous CONTENT_BUNDLE_ROOT en trois
+variantes (brute, gzip, brotli si le module est installé), accompagné d'un
+fichier .meta.json qui contient sa version (hash du contenu, servie comme
+ETag) et le tampon du contenu dont il est issu. Le tampon (nombres et dates
+de dernière modification des lignes du paquet) se calcule en trois petites
+requêtes d'agrégation : un paquet n'est reconstruit que si son tampon a
+changé, par ``manage.py build_content_bundles`` (à planifier). Les requêtes
+ne servent que des paquets déjà construits, sans jamais les construire.
+"""
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+from exercises.models import Exercise
+from exercises.serializers import BundleExerciseSerializer
+from .cache import bump_content_version
+from .models import Chapter, Lesson, Subject
+from .serializers import LessonBundleSerializer
+
+try:
+    import brotli
+except ImportError:  # Fourni par whitenoise[brotli] ; sans lui, gzip seulement
+    brotli = None
+
+# À incrémenter quand la structure du paquet change : tous les paquets sont reconstruits
+FORMAT_VERSION = 1
+
+# Content-Encoding -> extension du fichier, par ordre de préférence
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+
+def _root():
+    return Path(settings.CONTENT_BUNDLE_ROOT)
+
+
+def bundle_path(subject_slug, level, encoding=None):
+    """Chemin du paquet (``encoding`` : None, 'gzip' ou 'br')."""
+    return _root() / subject_slug / f'{level}.json{ENCODINGS.get(encoding, "")}'
+
+
+def _meta_path(subject_slug, level):
+    return _root() / subject_slug / f'{level}.meta.json'
+
+
+def _lessons(subject, level):
+    return Lesson.objects.filter(
+        chapter__subject=subject, chapter__is_active=True, level=level, is_active=True
+    )
+
+
+def _exercises(subject, level):
+    return Exercise.objects.filter(
+        subject=subject, level=level, is_active=True, visibility=Exercise.PUBLIC
+    )
+
+
+def _timestamp(value):
+    return value.isoformat() if value else None
+
+
+def content_stamp(subject, level):
+    """Empreinte du contenu d'un paquet : change dès qu'une ligne est ajoutée, modifiée ou retirée."""
+    lessons = _lessons(subject, level).aggregate(
+        count=Count('id', distinct=True), updated=Max('updated_at'),
+        resource_count=Count('resources'), resource_updated=Max('resources__updated_at')
+    )
+    exercises = _exercises(subject, level).aggregate(count=Count('id'), updated=Max('updated_at'))
+    chapters = Chapter.objects.filter(subject=subject).aggregate(count=Count('id'), updated=Max('updated_at'))
+    return '|'.join(str(part) for part in (
+        FORMAT_VERSION, subject.name, subject.color, subject.icon,
+        lessons['count'], _timestamp(lessons['updated']),
+        lessons['resource_count'], _timestamp(lessons['resource_updated']),
+        exercises['count'], _timestamp(exercises['updated']),
+        chapters['count'], _timestamp(chapters['updated']),
+    ))
+
+
+def build_bundle(subject, level):
+    """Contenu du paquet (sans sa version) ; None si la matière n'a pas de leçon à ce niveau."""
+    lessons = list(
+        _lessons(subject, level).select_related('chapter').prefetch_related('resources')
+        .order_by('chapter__order', 'chapter__title', 'order', 'title')
+    )
+    if not lessons:
+        return None
+    chapters = {}
+    for lesson in lessons:
+        chapter = lesson.chapter
+        if chapter.id not in chapters:
+            chapters[chapter.id] = {
+                'id': chapter.id,
+                'title': chapter.title,
+                'slug': chapter.slug,
+                'description': chapter.description,
+                'order': chapter.order,
+                'lessons': [],
+            }
+        chapters[chapter.id]['lessons'].append(lesson.id)
+    exercises = _exercises(subject, level).order_by('order', 'difficulty', 'title')
+    return {
+        'format': FORMAT_VERSION,
+        'subject': {
+            'id': subject.id,
+            'name': subject.name,
+            'slug': subject.slug,
+            'description': subject.description,
+            'icon': subject.icon,
+            'color': subject.color,
+        },
+        'level': level,
+        'level_label': dict(Lesson.LEVEL_CHOICES).get(level, level),
+        'chapters': list(chapters.values()),
+        'lessons': LessonBundleSerializer(lessons, many=True).data,
+        'exercises': BundleExerciseSerializer(exercises, many=True).data,
+    }
+
+
+def _write(path, data):
+    """Écriture atomique : les lecteurs voient l'ancien ou le nouveau fichier, jamais un fichier partiel."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read_meta(subject_slug, level):
+    try:
+        with open(_meta_path(subject_slug, level), encoding='utf-8') as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_bundle(subject, level, stamp=None, force=False):
+    """
+    Construire et écrire le paquet ; renvoie ses métadonnées, ou None (après
+    suppression d'un ancien paquet) si la matière n'a plus de leçon à ce niveau.
+    """
+    stamp = stamp or content_stamp(subject, level)
+    data = build_bundle(subject, level)
+    if data is None:
+        remove_bundle(subject.slug, level)
+        return None
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    version = hashlib.sha256(raw).hexdigest()[:20]
+    previous = read_meta(subject.slug, level)
+    if not force and previous and previous.get('version') == version and all(
+        bundle_path(subject.slug, level, encoding).exists() for encoding in previous['encodings']
+    ):
+        # Tampon changé sans effet sur le paquet (ex. chapitre d'un autre niveau) : fichiers conservés
+        meta = dict(previous, stamp=stamp)
+    else:
+        bundle_path(subject.slug, level).parent.mkdir(parents=True, exist_ok=True)
+        _write(bundle_path(subject.slug, level), raw)
+        encodings = ['gzip']
+        _write(bundle_path(subject.slug, level, 'gzip'), gzip.compress(raw, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(bundle_path(subject.slug, level, 'br'), brotli.compress(raw))
+            encodings.insert(0, 'br')
+        meta = {
+            'subject': subject.slug,
+            'level': level,
+            'version': version,
+            'size': len(raw),
+            'encodings': encodings,
+            'lessons': len(data['lessons']),
+            'exercises': len(data['exercises']),
+            'built_at': timezone.now().isoformat(),
+            'stamp': stamp,
+        }
+    _write(_meta_path(subject.slug, level), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+    return meta
+
+
+def remove_bundle(subject_slug, level):
+    for path in (_meta_path(subject_slug, level), *(bundle_path(subject_slug, level, e) for e in (None, *ENCODINGS))):
+        path.unlink(missing_ok=True)
+
+
+def get_bundle(subject, level):
+    """Métadonnées du paquet déjà construit ; None s'il ne l'a pas encore été."""
+    meta = read_meta(subject.slug, level)
+    if meta and bundle_path(subject.slug, level).exists():
+        return meta
+    return None
+
+
+def has_content(subject, level):
+    """La matière a-t-elle des leçons à ce niveau, donc un paquet à construire ?"""
+    return _lessons(subject, level).exists()
+
+
+def bundle_pairs():
+    """Couples (matière, niveau) ayant au moins une leçon active, dans l'ordre du cursus."""
+    subjects = {subject.id: subject for subject in Subject.objects.filter(is_active=True)}
+    rows = Lesson.objects.filter(
+        is_active=True, chapter__is_active=True, chapter__subject__in=list(subjects)
+    ).order_by('chapter__subject__order', 'chapter__subject__name', 'level_rank').values_list(
+        'chapter__subject_id', 'level'
+    ).distinct()
+    return [(subjects[subject_id], level) for subject_id, level in rows]
+
+
+def rebuild_bundles(force=False):
+    """
+    Mettre à jour tous les paquets et supprimer ceux qui n'ont plus de contenu ;
+    renvoie (reconstruits, inchangés, supprimés).
+    """
+    built, unchanged, kept = 0, 0, set()
+    for subject, level in bundle_pairs():
+        stamp = content_stamp(subject, level)
+        meta = read_meta(subject.slug, level)
+        if not force and meta and meta.get('stamp') == stamp and bundle_path(subject.slug, level).exists():
+            unchanged += 1
+        elif write_bundle(subject, level, stamp, force=force) is not None:
+            built += 1
+        kept.add((subject.slug, level))
+
+    removed = 0
+    for meta_file in _root().glob('*/*.meta.json') if _root().exists() else ():
+        subject_slug, level = meta_file.parent.name, meta_file.name[:-len('.meta.json')]
+        if (subject_slug, level) not in kept:
+            remove_bundle(subject_slug, level)
+            removed += 1
+    if built or removed:
+        # Liste des paquets (versions) servie depuis le cache du catalogue
+        bump_content_version()
+    return built, unchanged, removed
@@ -0,0 +1,50 @@
+"""
+Cache des réponses de catalogue (leçons et exercices groupés) partagées par
+tous les utilisateurs.
+
+Les clés contiennent un numéro de version du contenu, incrémenté par les
+signaux à chaque modification d'une matière, d'un chapitre, d'une leçon (ou
+de ses ressources) ou d'un exercice public : une modification rend toutes
+les anciennes entrées inaccessibles, qui expirent ensuite d'elles-mêmes. Les écritures faites sans
+signal (``queryset.update``, ``bulk_create``) sont visibles au plus tard après
+CONTENT_CACHE_TTL secondes.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'content:version'
+
+
+def _cache():
+    return caches[settings.CONTENT_CACHE_ALIAS]
+
+
+def content_version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def bump_content_version(**kwargs):
+    """Invalider les réponses en cache ; utilisable directement comme récepteur de signal."""
+    cache = _cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def cached_content(name, build):
+    """Réponse ``name`` de la version courante du contenu, calculée par ``build()`` si absente."""
+    if not settings.CONTENT_CACHE_ENABLED:
+        return build()
+    cache = _cache()
+    key = f'content:{content_version()}:{name}'
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.CONTENT_CACHE_TTL)
+    return data
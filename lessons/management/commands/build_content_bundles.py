@@ -0,0 +1,21 @@
+"""
+Construit les paquets hors ligne (matière, niveau) de l'application mobile.
+
+    python manage.py build_content_bundles          # paquets dont le contenu a changé
+    python manage.py build_content_bundles --force  # tous les paquets
+"""
+from django.core.management.base import BaseCommand
+from lessons.bundles import rebuild_bundles
+
+
+class Command(BaseCommand):
+    help = "Construit les paquets hors ligne (JSON compressé par matière et niveau) dont le contenu a changé."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Reconstruire aussi les paquets à jour.')
+
+    def handle(self, *args, **options):
+        built, unchanged, removed = rebuild_bundles(force=options['force'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{built} paquet(s) construit(s), {unchanged} inchangé(s), {removed} supprimé(s)."
+        ))
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0003_alter_lesson_options_lesson_pdf_content'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='lesson',
+            options={'ordering': ['level_rank', 'order', 'title'], 'verbose_name': 'Leçon', 'verbose_name_plural': 'Leçons'},
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='level_rank',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Rang du niveau'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+# Rang de chaque niveau à la date de cette migration (ordre de User.LEVEL_CHOICES),
+# recopié ici pour ne pas dépendre du code de l'application
+LEVEL_RANKS = {
+    'cp1': 0, 'cp2': 1, 'ce1': 2, 'ce2': 3, 'cm1': 4, 'cm2': 5,
+    'sixieme': 6, 'cinquieme': 7, 'quatrieme': 8, 'troisieme': 9,
+    'seconde': 10, 'premiere': 11, 'terminale': 12,
+}
+BATCH_SIZE = 1000
+
+
+def backfill_level_rank(model):
+    """Remplir level_rank par lots de clés primaires, une courte requête UPDATE par lot."""
+    rank = models.Case(
+        *[models.When(level=code, then=models.Value(value)) for code, value in LEVEL_RANKS.items()],
+        default=None,
+        output_field=models.PositiveSmallIntegerField()
+    )
+    last_pk = 0
+    while True:
+        pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        model.objects.filter(pk__in=pks, level_rank__isnull=True).update(level_rank=rank)
+        last_pk = pks[-1]
+
+
+def backfill(apps, schema_editor):
+    backfill_level_rank(apps.get_model('lessons', 'Lesson'))
+
+
+class Migration(migrations.Migration):
+    # Une transaction par lot plutôt qu'un UPDATE de toute la table
+    atomic = False
+
+    dependencies = [
+        ('lessons', '0004_level_rank'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
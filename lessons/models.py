@@ -3,6 +3,7 @@ Modèles pour la gestion des leçons.
 """
 from django.db import models
 from django.contrib.auth import get_user_model
+from users.models import LevelRankMixin
 
 User = get_user_model()
 
@@ -54,7 +55,7 @@ class Chapter(models.Model):
         return f"{self.subject.name} - {self.title}"
 
 
-class Lesson(models.Model):
+class Lesson(LevelRankMixin, models.Model):
     """Leçon d'un chapitre."""
     
     LEVEL_CHOICES = [
@@ -125,7 +126,7 @@ class Lesson(models.Model):
     class Meta:
         verbose_name = 'Leçon'
         verbose_name_plural = 'Leçons'
-        ordering = ['level', 'order', 'title']
+        ordering = ['level_rank', 'order', 'title']
         unique_together = ['chapter', 'slug']
     
     def __str__(self):
@@ -165,6 +166,7 @@ class LessonResource(models.Model):
     url = models.URLField(blank=True, verbose_name='URL')
     description = models.TextField(blank=True, verbose_name='Description')
     order = models.PositiveIntegerField(default=0, verbose_name='Ordre')
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Ressource'
@@ -0,0 +1,149 @@
+"""
+Résolution des matières et niveaux saisis librement ("maths", "Histoire geo",
+"6ème", "2nde"...) vers les objets de la base.
+
+Les matières actives sont chargées une fois par processus dans un index en
+mémoire (nom, slug et alias normalisés : sans accents, casse ni ponctuation).
+L'index est invalidé par les signaux de Subject dans ce processus et
+rechargé au plus tard après SUBJECT_RESOLVER_TTL secondes dans les autres.
+"""
+import re
+import time
+import difflib
+import threading
+import unicodedata
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .models import Lesson, Subject
+
+_SEPARATORS_RE = re.compile(r"[\s\-_'’.,/]+")
+
+# Alias courants -> nom ou slug de matière
+SUBJECT_ALIASES = {
+    'math': 'mathematiques',
+    'maths': 'mathematiques',
+    'mathematique': 'mathematiques',
+    'mathematics': 'mathematiques',
+    'french': 'francais',
+    'english': 'anglais',
+    'histoire': 'histoire geographie',
+    'geographie': 'histoire geographie',
+    'histoire geo': 'histoire geographie',
+    'hist geo': 'histoire geographie',
+    'hg': 'histoire geographie',
+    'science': 'sciences',
+    'svt': 'sciences',
+    'physique': 'science physique',
+    'physique chimie': 'science physique',
+    'pc': 'science physique',
+    'chimie': 'science physique',
+}
+
+# Toute forme lisible d'un niveau -> code en base
+LEVEL_MAP = {
+    'cp1': 'cp1', 'cp2': 'cp2', 'ce1': 'ce1', 'ce2': 'ce2',
+    'cm1': 'cm1', 'cm2': 'cm2',
+    '6eme': 'sixieme', 'sixieme': 'sixieme', '6e': 'sixieme',
+    '5eme': 'cinquieme', 'cinquieme': 'cinquieme', '5e': 'cinquieme',
+    '4eme': 'quatrieme', 'quatrieme': 'quatrieme', '4e': 'quatrieme',
+    '3eme': 'troisieme', 'troisieme': 'troisieme', '3e': 'troisieme',
+    'seconde': 'seconde', '2nde': 'seconde', '2de': 'seconde',
+    'premiere': 'premiere', '1ere': 'premiere',
+    'terminale': 'terminale', 'tle': 'terminale', 'term': 'terminale',
+}
+
+
+def normalize(text):
+    """Texte sans accents, en minuscules, ponctuation ramenée à des espaces ("Histoire-Géo" -> "histoire geo")."""
+    if text is None:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _SEPARATORS_RE.sub(' ', stripped).strip().casefold()
+
+
+def resolve_level(text):
+    """Code du niveau ('sixieme'...) correspondant à un texte libre, ou None."""
+    key = normalize(text)
+    if key in LEVEL_MAP:
+        return LEVEL_MAP[key]
+    compact = key.replace(' ', '')
+    if compact in LEVEL_MAP:
+        return LEVEL_MAP[compact]
+    for code, label in Lesson.LEVEL_CHOICES:
+        if key == normalize(label):
+            return code
+    return None
+
+
+class SubjectResolver:
+    """Index en mémoire des matières actives par nom, slug et alias normalisés."""
+
+    fuzzy_cutoff = 0.75
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+    def _current(self):
+        """Index (clés, matières) encore valide, ou None s'il faut le recharger."""
+        index = self._index
+        if index is None or time.monotonic() - self._loaded_at > settings.SUBJECT_RESOLVER_TTL:
+            return None
+        return index
+
+    def reload(self):
+        subjects = list(Subject.objects.filter(is_active=True).order_by('order', 'name'))
+        keys = {}
+        for subject in subjects:
+            keys.setdefault(normalize(subject.name), subject)
+            keys.setdefault(normalize(subject.slug), subject)
+        for alias, target in SUBJECT_ALIASES.items():
+            if target in keys:
+                keys.setdefault(alias, keys[target])
+        index = (keys, subjects)
+        with self._lock:
+            self._index, self._loaded_at = index, time.monotonic()
+        return index
+
+    def _get_index(self):
+        return self._current() or self.reload()
+
+    def _match(self, index, text):
+        keys, subjects = index
+        key = normalize(text)
+        if not key:
+            return None
+        if key in keys:
+            return keys[key]
+        # Saisie partielle : "math" dans "mathematiques", "histoire" dans "histoire geographie"
+        for subject in subjects if len(key) >= 3 else ():
+            if key in normalize(subject.name) or key in normalize(subject.slug):
+                return subject
+        close = difflib.get_close_matches(key, list(keys), n=1, cutoff=self.fuzzy_cutoff)
+        return keys[close[0]] if close else None
+
+    def resolve(self, text):
+        """Matière active correspondant à un texte libre (faute de frappe tolérée), ou None."""
+        return self._match(self._get_index(), text)
+
+    async def aresolve(self, text):
+        """Comme ``resolve`` ; la base n'est lue (dans un thread) que si l'index doit être rechargé."""
+        index = self._current() or await sync_to_async(self.reload)()
+        return self._match(index, text)
+
+    def suggestions(self, text, n=3):
+        """Noms de matières les plus proches, pour aider l'utilisateur après un échec."""
+        names = {normalize(subject.name): subject.name for subject in self._get_index()[1]}
+        return [names[key] for key in difflib.get_close_matches(normalize(text), list(names), n=n, cutoff=0.4)]
+
+    def names(self):
+        return [subject.name for subject in self._get_index()[1]]
+
+
+subject_resolver = SubjectResolver()
@@ -113,6 +113,20 @@ class LessonDetailSerializer(serializers.ModelSerializer):
         return 0
 
 
+class LessonBundleSerializer(serializers.ModelSerializer):
+    """Leçon complète d'un paquet hors ligne (sans données propres à l'utilisateur)."""
+    
+    resources = LessonResourceSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = Lesson
+        fields = [
+            'id', 'title', 'slug', 'content', 'summary', 'level', 'chapter',
+            'duration_minutes', 'order', 'is_official', 'image', 'video_url',
+            'pdf_content', 'resources', 'updated_at'
+        ]
+
+
 class LessonViewSerializer(serializers.ModelSerializer):
     """Sérialiseur pour les vues de leçons."""
     
@@ -0,0 +1,20 @@
+"""
+Signaux de l'application lessons.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import bump_content_version
+from .models import Chapter, Lesson, LessonResource, Subject
+from .resolvers import subject_resolver
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def invalidate_subject_resolver(sender, **kwargs):
+    """Recharger l'index des matières après une modification."""
+    subject_resolver.invalidate()
+
+
+for model in (Subject, Chapter, Lesson, LessonResource):
+    post_save.connect(bump_content_version, sender=model, dispatch_uid=f'content_version_{model.__name__}_save')
+    post_delete.connect(bump_content_version, sender=model, dispatch_uid=f'content_version_{model.__name__}_delete')
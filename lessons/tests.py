@@ -1,3 +1,176 @@
-from django.test import TestCase
+import gzip
+import json
+import shutil
+import tempfile
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from .bundles import read_meta, rebuild_bundles
+from .models import Chapter, Lesson, LessonResource, Subject
+from .resolvers import SubjectResolver, resolve_level, subject_resolver
 
-# Create your tests here.
+
+class SubjectResolverTests(TestCase):
+    """Matières et niveaux saisis librement : nom, slug, alias, accents, saisie partielle et fautes de frappe."""
+
+    def setUp(self):
+        self.maths = Subject.objects.create(name='Mathématiques', slug='mathematiques')
+        self.history = Subject.objects.create(name='Histoire Géographie', slug='histoire-geographie')
+        self.french = Subject.objects.create(name='Français', slug='francais')
+        Subject.objects.create(name='Latin', slug='latin', is_active=False)
+        self.resolver = SubjectResolver()
+
+    def test_name_slug_and_aliases(self):
+        self.assertEqual(self.resolver.resolve('Mathématiques'), self.maths)
+        self.assertEqual(self.resolver.resolve('histoire-geographie'), self.history)
+        self.assertEqual(self.resolver.resolve('maths'), self.maths)
+        self.assertEqual(self.resolver.resolve('Histoire-Géo'), self.history)
+
+    def test_accents_and_case_ignored(self):
+        self.assertEqual(self.resolver.resolve('FRANCAIS'), self.french)
+        self.assertEqual(self.resolver.resolve('  mathematiques '), self.maths)
+
+    def test_partial_and_misspelled_names(self):
+        self.assertEqual(self.resolver.resolve('geographie'), self.history)
+        self.assertEqual(self.resolver.resolve('mathemtiques'), self.maths)
+        self.assertEqual(self.resolver.resolve('francias'), self.french)
+
+    def test_unknown_or_inactive_subject(self):
+        self.assertIsNone(self.resolver.resolve('latin'))
+        self.assertIsNone(self.resolver.resolve('astronomie'))
+        self.assertIsNone(self.resolver.resolve(''))
+        self.assertIn('Mathématiques', self.resolver.suggestions('mathematik'))
+
+    def test_index_loaded_once(self):
+        self.resolver.resolve('maths')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolver.resolve('français'), self.french)
+
+    def test_invalidated_when_a_subject_changes(self):
+        subject_resolver.invalidate()
+        self.assertIsNone(subject_resolver.resolve('philosophie'))
+        philosophy = Subject.objects.create(name='Philosophie', slug='philosophie')
+        self.assertEqual(subject_resolver.resolve('philosophie'), philosophy)
+        philosophy.is_active = False
+        philosophy.save()
+        self.assertIsNone(subject_resolver.resolve('philosophie'))
+
+    def test_resolve_level(self):
+        self.assertEqual(resolve_level('6ème'), 'sixieme')
+        self.assertEqual(resolve_level('2nde'), 'seconde')
+        self.assertEqual(resolve_level('CM2'), 'cm2')
+        self.assertEqual(resolve_level('Terminale'), 'terminale')
+        self.assertIsNone(resolve_level('licence'))
+        self.assertIsNone(resolve_level(None))
+
+
+class LessonsByLevelTests(TestCase):
+    """Leçons groupées par niveau : une requête quel que soit le nombre de leçons, puis le cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        subject = Subject.objects.create(name='Mathématiques', slug='mathematiques')
+        self.chapter = Chapter.objects.create(subject=subject, title='Nombres', slug='nombres')
+
+    def add_lessons(self, count, level):
+        for number in range(count):
+            Lesson.objects.create(
+                chapter=self.chapter, title=f'Leçon {level} {number}', slug=f'lecon-{level}-{number}',
+                content='Contenu', level=level
+            )
+
+    def test_single_query_whatever_the_number_of_lessons(self):
+        self.add_lessons(2, 'cm1')
+        with self.assertNumQueries(1):
+            self.client.get('/api/lessons/lessons/by_level/')
+
+        self.add_lessons(20, 'sixieme')
+        self.add_lessons(5, 'cp1')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/lessons/lessons/by_level/')
+        self.assertEqual(list(response.data), ['CP1', 'CM1', '6ème'])
+        self.assertEqual(len(response.data['6ème']), 20)
+
+    def test_cached_until_content_changes(self):
+        self.add_lessons(3, 'cm2')
+        self.client.get('/api/lessons/lessons/by_level/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/lessons/lessons/by_level/')
+        self.assertEqual(len(response.data['CM2']), 3)
+
+        self.add_lessons(1, 'terminale')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/lessons/lessons/by_level/')
+        self.assertIn('Terminale', response.data)
+
+
+class ContentBundleTests(TestCase):
+    """Paquet hors ligne : compressé, versionné par ETag, reconstruit quand le contenu change."""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        overrides = override_settings(CONTENT_BUNDLE_ROOT=root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        cache.clear()
+        self.client = APIClient()
+        subject = Subject.objects.create(name='Mathématiques', slug='mathematiques')
+        chapter = Chapter.objects.create(subject=subject, title='Nombres', slug='nombres')
+        self.lesson = Lesson.objects.create(
+            chapter=chapter, title='Fractions', slug='fractions', content='Contenu', level='sixieme'
+        )
+        self.url = '/api/lessons/subjects/mathematiques/bundle/?level=sixieme'
+
+    def test_gzip_bundle_and_not_modified(self):
+        rebuild_bundles()
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(data['chapters'][0]['lessons'], [self.lesson.id])
+        self.assertEqual(data['lessons'][0]['title'], 'Fractions')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_never_built_during_a_request(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '300')
+            response = self.client.get('/api/lessons/subjects/mathematiques/bundle/?level=cm2')
+            self.assertEqual(response.status_code, 404)
+        self.assertIsNone(read_meta('mathematiques', 'sixieme'))
+        self.assertEqual(self.client.get('/api/lessons/subjects/bundles/?level=sixieme').data, [])
+
+        self.assertEqual(rebuild_bundles(), (1, 0, 0))
+        manifest = self.client.get('/api/lessons/subjects/bundles/?level=sixieme').data
+        self.assertEqual([bundle['subject'] for bundle in manifest], ['mathematiques'])
+
+    def test_rebuilt_when_content_changes(self):
+        rebuild_bundles()
+        etag = self.client.get(self.url)['ETag']
+        self.lesson.title = 'Fractions simples'
+        self.lesson.save()
+        # Le paquet déjà construit reste servi jusqu'au prochain passage de la commande
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.assertEqual(rebuild_bundles(), (1, 0, 0))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['lessons'][0]['title'], 'Fractions simples')
+
+    def test_rebuilt_when_a_resource_changes(self):
+        resource = LessonResource.objects.create(
+            lesson=self.lesson, title='Fiche', resource_type='link', url='https://example.com/fiche'
+        )
+        rebuild_bundles()
+        resource.url = 'https://example.com/fiche-corrigee'
+        resource.save()
+        self.assertEqual(rebuild_bundles(), (1, 0, 0))
+        response = self.client.get(self.url)
+        resources = json.loads(b''.join(response.streaming_content))['lessons'][0]['resources']
+        self.assertEqual(resources[0]['url'], 'https://example.com/fiche-corrigee')
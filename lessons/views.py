@@ -1,12 +1,19 @@
 """
 Vues pour la gestion des leçons.
 """
+from django.http import FileResponse, HttpResponseNotModified
+from django.urls import reverse
+from django.utils.http import parse_etags
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
+from users.models import level_rank
+from .bundles import ENCODINGS, bundle_path, get_bundle, has_content
+from .cache import cached_content
 from .models import Subject, Chapter, Lesson, LessonView
+from .resolvers import resolve_level, subject_resolver
 from .serializers import (
     SubjectSerializer, ChapterListSerializer, ChapterDetailSerializer,
     LessonListSerializer, LessonDetailSerializer, LessonViewSerializer,
@@ -36,6 +43,121 @@ class SubjectViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(subjects, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def resolve(self, request):
+        """Retrouver la matière et le niveau saisis librement (?subject=maths&level=6ème)."""
+        subject_text = request.query_params.get('subject', '')
+        level_text = request.query_params.get('level', '')
+        if not subject_text and not level_text:
+            return Response({'error': 'subject or level parameter required'}, status=status.HTTP_400_BAD_REQUEST)
+        data = {}
+        if subject_text:
+            subject = subject_resolver.resolve(subject_text)
+            data['subject'] = self.get_serializer(subject).data if subject else None
+            data['suggestions'] = [] if subject else subject_resolver.suggestions(subject_text)
+        if level_text:
+            level = resolve_level(level_text)
+            data['level'] = level
+            data['level_label'] = dict(Lesson.LEVEL_CHOICES).get(level)
+        return Response(data)
+    
+    def _bundle_level(self, request):
+        """Niveau demandé (?level=, par défaut celui de l'élève) et erreur éventuelle."""
+        level_text = request.query_params.get('level') or getattr(request.user, 'level', None)
+        level = resolve_level(level_text) if level_text else None
+        if not level:
+            return None, Response({'error': 'level parameter required'}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        if user.is_authenticated and user.user_type == 'student' and (
+            user.level_rank is None or level_rank(level) > user.level_rank
+        ):
+            # Même restriction que la liste des leçons : niveau de l'élève et inférieurs
+            return None, Response({'error': 'Niveau non accessible'}, status=status.HTTP_403_FORBIDDEN)
+        return level, None
+    
+    @action(detail=False, methods=['get'])
+    def bundles(self, request):
+        """Paquets hors ligne disponibles pour un niveau, avec leur version (ETag)."""
+        level, error = self._bundle_level(request)
+        if error:
+            return error
+        return Response(cached_content(f'bundles:{level}', lambda: self._bundle_manifest(level)))
+    
+    def _bundle_manifest(self, level):
+        manifest = []
+        subjects = Subject.objects.filter(
+            is_active=True, chapters__is_active=True,
+            chapters__lessons__level=level, chapters__lessons__is_active=True
+        ).distinct()
+        for subject in subjects:
+            meta = get_bundle(subject, level)
+            if meta:
+                manifest.append({
+                    'subject': subject.slug,
+                    'subject_name': subject.name,
+                    'level': level,
+                    'version': meta['version'],
+                    'size': meta['size'],
+                    'lessons': meta['lessons'],
+                    'exercises': meta['exercises'],
+                    'url': f"{reverse('subject-bundle', args=[subject.slug])}?level={level}",
+                })
+        return manifest
+    
+    @action(detail=True, methods=['get'])
+    def bundle(self, request, slug=None):
+        """
+        Télécharger en une requête le paquet hors ligne d'une matière pour un
+        niveau, compressé selon Accept-Encoding ; 304 si If-None-Match est à jour.
+        """
+        subject = self.get_object()
+        level, error = self._bundle_level(request)
+        if error:
+            return error
+        meta = get_bundle(subject, level)
+        if meta is None and has_content(subject, level):
+            # Paquet pas encore construit par build_content_bundles : jamais construit ici
+            return Response(
+                {'error': 'Paquet en cours de préparation, réessayez plus tard'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '300'}
+            )
+        if meta is None:
+            return Response({'error': 'Aucun contenu pour ce niveau'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = f'W/"{meta["version"]}"'
+        headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'public, no-cache'}
+        client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+        if '*' in client_etags or meta['version'] in {tag.removeprefix('W/').strip('"') for tag in client_etags}:
+            response = HttpResponseNotModified()
+        else:
+            accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+            encoding = next((name for name in ENCODINGS if name in meta['encodings'] and name in accepted), None)
+            response = FileResponse(
+                open(bundle_path(subject.slug, level, encoding), 'rb'),
+                content_type='application/json; charset=utf-8',
+                filename=f'{subject.slug}-{level}.json'
+            )
+            if encoding:
+                headers['Content-Encoding'] = encoding
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+
+def _accepted_encodings(header):
+    """Codages acceptés par le client (en-tête Accept-Encoding, ``q=0`` exclu)."""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = params.strip().removeprefix('q=') if params.strip().startswith('q=') else '1'
+        try:
+            if float(quality) > 0:
+                accepted.add(name.strip().lower())
+        except ValueError:
+            continue
+    return accepted
+
 
 class ChapterViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet pour les chapitres."""
@@ -101,9 +223,8 @@ class LessonViewSet(viewsets.ReadOnlyModelViewSet):
         # Restriction d'accès par niveau de l'élève
         user = self.request.user
         if user.is_authenticated and user.user_type == 'student':
-            from users.utils import get_allowed_levels
-            allowed_levels = get_allowed_levels(user.level)
-            queryset = queryset.filter(level__in=allowed_levels)
+            from users.utils import allowed_levels_q
+            queryset = queryset.filter(allowed_levels_q(user))
         
         # Filtrer par recherche
         search = self.request.query_params.get('search', None)
@@ -140,12 +261,18 @@ class LessonViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'])
     def by_level(self, request):
         """Récupérer les leçons groupées par niveau."""
+        return Response(cached_content('lessons_by_level', self._lessons_by_level))
+    
+    def _lessons_by_level(self):
+        # Une requête, triée par rang de niveau : les groupes suivent l'ordre du cursus
+        lessons = Lesson.objects.filter(is_active=True, level_rank__isnull=False).select_related(
+            'chapter__subject'
+        ).order_by('level_rank', 'order', 'title')
+        labels = dict(Lesson.LEVEL_CHOICES)
         levels = {}
-        for level_code, level_name in Lesson.LEVEL_CHOICES:
-            lessons = Lesson.objects.filter(level=level_code, is_active=True)
-            if lessons.exists():
-                levels[level_name] = LessonListSerializer(lessons, many=True).data
-        return Response(levels)
+        for lesson in lessons:
+            levels.setdefault(labels[lesson.level], []).append(lesson)
+        return {label: LessonListSerializer(group, many=True).data for label, group in levels.items()}
     
     @action(detail=False, methods=['get'])
     def recommended(self, request):
@@ -5,6 +5,7 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from lessons.models import Subject, Lesson
 from exercises.models import Exercise, Quiz
+from users.models import LevelRankMixin
 
 User = get_user_model()
 
@@ -135,7 +136,7 @@ class SubjectProgress(models.Model):
         return 0
 
 
-class Skill(models.Model):
+class Skill(LevelRankMixin, models.Model):
     """Compétence à maîtriser."""
     
     name = models.CharField(max_length=200, verbose_name='Nom')
@@ -13,7 +13,7 @@ if api_key:
 
 try:
     client = OpenAI(
-        base_url="https://api.groq.com/openai/v1",
+        base_url=os.getenv('AI_BASE_URL', "https://api.groq.com/openai/v1"),
         api_key=api_key
     )
 
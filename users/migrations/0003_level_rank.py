@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_add_subject_field'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='level_rank',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Rang du niveau'),
+        ),
+    ]
@@ -5,7 +5,35 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class User(AbstractUser):
+class LevelRankMixin(models.Model):
+    """
+    Rang du niveau scolaire dans le cursus (CP1 = 0 ... Terminale = 12),
+    recalculé à chaque enregistrement, pour filtrer et trier par plage de niveaux.
+    """
+    
+    level_rank = models.PositiveSmallIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        db_index=True,
+        verbose_name='Rang du niveau'
+    )
+    
+    class Meta:
+        abstract = True
+    
+    def refresh_level_rank(self):
+        self.level_rank = level_rank(self.level)
+    
+    def save(self, *args, **kwargs):
+        self.refresh_level_rank()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'level' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'level_rank'}
+        super().save(*args, **kwargs)
+
+
+class User(LevelRankMixin, AbstractUser):
     """Modèle utilisateur personnalisé pour le tuteur intelligent."""
     
     USER_TYPE_CHOICES = [
@@ -84,6 +112,15 @@ class User(AbstractUser):
         return f"{self.first_name} {self.last_name} ({self.username})"
 
 
+# Code de niveau -> rang dans le cursus (ordre de LEVEL_CHOICES)
+LEVEL_RANKS = {code: rank for rank, (code, label) in enumerate(User.LEVEL_CHOICES)}
+
+
+def level_rank(level):
+    """Rang d'un code de niveau ('cm2' -> 5), None s'il est vide ou inconnu."""
+    return LEVEL_RANKS.get(level)
+
+
 class ParentStudentLink(models.Model):
     """Lien entre parent et élève."""
     
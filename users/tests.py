@@ -1,3 +1,59 @@
+import importlib
+from unittest import mock
+from django.apps import apps
 from django.test import TestCase
+from rest_framework.test import APIClient
+from exercises.models import Exercise
+from lessons.models import Chapter, Lesson, Subject
+from .models import User
+from .utils import get_allowed_levels
 
-# Create your tests here.
+
+class LevelRankTests(TestCase):
+    """Rang du niveau : recalculé à l'enregistrement, rempli par migration, filtre des contenus par plage de niveaux."""
+
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', password='x', user_type='admin')
+        self.student = User.objects.create_user('eleve', password='x', user_type='student', level='cm2')
+        subject = Subject.objects.create(name='Mathématiques', slug='mathematiques')
+        chapter = Chapter.objects.create(subject=subject, title='Nombres', slug='nombres')
+        for level in ('sixieme', 'cm2', 'cp1'):
+            Lesson.objects.create(chapter=chapter, title=level, slug=level, content='Contenu', level=level)
+            Exercise.objects.create(
+                subject=subject, title=level, level=level, content={}, correct_answers=[0], creator=self.admin
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def titles(self, url):
+        return [item['title'] for item in self.client.get(url).data['results']]
+
+    def test_rank_follows_the_level(self):
+        self.assertEqual(self.student.level_rank, 5)
+        self.student.level = 'sixieme'
+        self.student.save(update_fields=['level'])
+        self.student.refresh_from_db()
+        self.assertEqual(self.student.level_rank, 6)
+        self.student.level = None
+        self.student.save()
+        self.assertIsNone(User.objects.get(pk=self.student.pk).level_rank)
+
+    def test_backfill_migration(self):
+        User.objects.create_user('lyceen', password='x', user_type='student', level='terminale')
+        User.objects.update(level_rank=None)
+        migration = importlib.import_module('users.migrations.0004_backfill_level_rank')
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            migration.backfill(apps, None)
+        ranks = dict(User.objects.values_list('username', 'level_rank'))
+        self.assertEqual(ranks, {'admin': None, 'eleve': 5, 'lyceen': 12})
+
+    def test_students_see_their_level_and_below(self):
+        self.assertEqual(get_allowed_levels('ce1'), ['cp1', 'cp2', 'ce1'])
+        self.assertEqual(get_allowed_levels('doctorat'), [])
+        self.assertEqual(sorted(self.titles('/api/lessons/lessons/')), ['cm2', 'cp1'])
+        self.assertEqual(sorted(self.titles('/api/exercises/')), ['cm2', 'cp1'])
+
+        self.student.level = None
+        self.student.save()
+        self.assertEqual(self.titles('/api/lessons/lessons/'), [])
+        self.assertEqual(self.titles('/api/exercises/'), [])
@@ -1,16 +1,25 @@
-from .models import User
+from django.db import models
+from .models import LEVEL_RANKS, User
+
+LEVEL_CODES = [code for code, label in User.LEVEL_CHOICES]
+
 
 def get_allowed_levels(user_level):
     """
     Retourne la liste des niveaux autorisés pour un élève donné (niveau actuel et inférieurs).
     """
-    if not user_level:
+    rank = LEVEL_RANKS.get(user_level)
+    if rank is None:
         return []
+    return LEVEL_CODES[:rank + 1]
+
+
+def allowed_levels_q(user):
+    """
+    Filtre des contenus du niveau de l'élève et des niveaux inférieurs
+    (``level_rank <= user.level_rank``) ; aucun contenu si son niveau n'est pas renseigné.
+    """
+    if user.level_rank is None:
+        return models.Q(pk__in=[])
+    return models.Q(level_rank__lte=user.level_rank)
 
-    levels = [code for code, label in User.LEVEL_CHOICES]
-    
-    try:
-        index = levels.index(user_level)
-        return levels[:index + 1]
-    except ValueError:
-        return []